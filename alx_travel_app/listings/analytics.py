@@ -0,0 +1,149 @@
+"""
+Owner revenue and occupancy, precomputed as one row per listing per day.
+
+A row exists only for nights covered by a confirmed booking, so counting
+rows gives occupied nights and missing days read as vacant.
+
+Dashboards read ListingDailyStat only, so a query costs the same however
+many bookings a listing has. Rows are rebuilt a whole listing at a time
+from its confirmed bookings and their completed payments, which makes a
+rebuild idempotent: replaying a listing is always safe.
+
+refresh_daily_stats runs from Celery beat and rebuilds only listings with
+a booking or payment written since the stored watermark. Writes that skip
+save() must bump updated_at themselves for the refresh to notice them;
+deleted bookings are handled by a signal that queues their listing.
+"""
+from datetime import timedelta
+from decimal import Decimal, ROUND_DOWN
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from .models import Booking, ListingDailyStat, Payment, RollupWatermark
+
+WATERMARK_NAME = 'listing_daily_stats'
+CENT = Decimal('0.01')
+
+
+def nightly_revenue(amount, nights):
+    """Split `amount` over `nights` in whole cents; the first night takes the remainder"""
+    if not amount or nights <= 0:
+        return [Decimal('0.00')] * max(nights, 0)
+    share = (amount / nights).quantize(CENT, rounding=ROUND_DOWN)
+    return [amount - share * (nights - 1)] + [share] * (nights - 1)
+
+
+def daily_rows(listing_ids):
+    """ListingDailyStat instances for `listing_ids`, computed from their bookings"""
+    bookings = Booking.objects.filter(listing_id__in=listing_ids, status='CONFIRMED').values_list(
+        'listing_id', 'start_date', 'end_date', 'payment__amount', 'payment__status',
+    )
+    days = {}
+    for listing_id, start, end, amount, payment_status in bookings.iterator():
+        nights = (end - start).days
+        paid = amount if payment_status == 'COMPLETED' else None
+        for offset, revenue in enumerate(nightly_revenue(paid, nights)):
+            date = start + timedelta(days=offset)
+            day = days.get((listing_id, date))
+            if day is None:
+                day = days[(listing_id, date)] = ListingDailyStat(
+                    listing_id=listing_id, date=date, check_ins=0, revenue=Decimal('0.00'),
+                )
+            day.revenue += revenue
+            if offset == 0:
+                day.check_ins += 1
+    return list(days.values())
+
+
+def rebuild_daily_stats(listing_ids, batch_size=1000):
+    """Replace every daily row of `listing_ids`; returns the number of rows written"""
+    rows = daily_rows(listing_ids)
+    with transaction.atomic():
+        ListingDailyStat.objects.filter(listing_id__in=listing_ids).delete()
+        ListingDailyStat.objects.bulk_create(rows, batch_size=batch_size)
+    return len(rows)
+
+
+def changed_listing_ids(since, until):
+    """Listings with a booking or payment written in (since, until]; since=None means all time"""
+    window = Q(updated_at__lte=until)
+    if since is not None:
+        window &= Q(updated_at__gt=since)
+    bookings = Booking.objects.filter(window).values_list('listing_id', flat=True).distinct()
+    payments = Payment.objects.filter(window).values_list('booking__listing_id', flat=True).distinct()
+    return sorted(set(bookings) | set(payments))
+
+
+def chunked(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def refresh_daily_stats(batch_size=None, lag_seconds=None):
+    """
+    Rebuild listings changed since the watermark, then advance it.
+
+    The window stops `lag_seconds` short of now so rows from transactions
+    still in flight (stamped earlier, committed later) are not skipped. The
+    watermark row stays locked for the whole run, so overlapping beat runs
+    queue up instead of doing the same work twice.
+    """
+    batch_size = batch_size or getattr(settings, 'ANALYTICS_ROLLUP_BATCH_SIZE', 500)
+    if lag_seconds is None:
+        lag_seconds = getattr(settings, 'ANALYTICS_ROLLUP_LAG_SECONDS', 60)
+    until = timezone.now() - timedelta(seconds=lag_seconds)
+
+    with transaction.atomic():
+        watermark, _ = RollupWatermark.objects.select_for_update().get_or_create(name=WATERMARK_NAME)
+        if watermark.value is not None and watermark.value >= until:
+            return {'listings': 0, 'rows': 0}
+
+        listing_ids = changed_listing_ids(watermark.value, until)
+        rows = sum(rebuild_daily_stats(chunk) for chunk in chunked(listing_ids, batch_size))
+        watermark.value = until
+        watermark.save(update_fields=['value'])
+    return {'listings': len(listing_ids), 'rows': rows}
+
+
+def set_watermark(value):
+    RollupWatermark.objects.update_or_create(name=WATERMARK_NAME, defaults={'value': value})
+
+
+def listing_totals(queryset, start_date, end_date):
+    """Annotate listings with revenue, occupied nights and check-ins over [start_date, end_date]"""
+    in_range = Q(daily_stats__date__gte=start_date, daily_stats__date__lte=end_date)
+    return queryset.annotate(
+        revenue=Sum('daily_stats__revenue', filter=in_range, default=Decimal('0.00')),
+        occupied_nights=Count('daily_stats', filter=in_range),
+        check_ins=Sum('daily_stats__check_ins', filter=in_range, default=0),
+    )
+
+
+def money(amount):
+    """Render an amount as ModelSerializer renders a DecimalField; SQLite sums come back unscaled"""
+    return str(amount.quantize(CENT))
+
+
+def occupancy_rate(occupied_nights, start_date, end_date):
+    return round(occupied_nights / ((end_date - start_date).days + 1), 4)
+
+
+def daily_series(listing_id, start_date, end_date):
+    """One entry per day of the range, zero-filled where the listing had no stay"""
+    stored = {
+        row['date']: dict(row, occupied=True)
+        for row in ListingDailyStat.objects.filter(
+            listing_id=listing_id, date__gte=start_date, date__lte=end_date,
+        ).values('date', 'check_ins', 'revenue')
+    }
+    series = []
+    day = start_date
+    while day <= end_date:
+        series.append(stored.get(day) or {
+            'date': day, 'occupied': False, 'check_ins': 0, 'revenue': Decimal('0.00'),
+        })
+        day += timedelta(days=1)
+    return series
@@ -0,0 +1,84 @@
+from django.db.models import Count, Exists, OuterRef
+
+from .models import Booking, Listing
+from .pricing import quote_listings
+
+# Bookings in these states hold inventory
+BLOCKING_STATUSES = ('PENDING', 'CONFIRMED')
+BATCH_MAX_LISTINGS = 500
+
+
+def overlapping_bookings(start_date, end_date):
+    """
+    Bookings that hold any night in [start_date, end_date).
+
+    Two stays overlap when each starts before the other ends, which the
+    (listing, start_date, end_date, status) index answers as a range scan.
+    """
+    return Booking.objects.filter(
+        start_date__lt=end_date,
+        end_date__gt=start_date,
+        status__in=BLOCKING_STATUSES,
+    )
+
+
+def available_listings(listings, start_date, end_date, location=None, min_price=None, max_price=None):
+    """Narrow a Listing queryset to those with no blocking booking between the dates"""
+    listings = listings.filter(is_available=True)
+    if location:
+        listings = listings.filter(location=location)
+    if min_price is not None:
+        listings = listings.filter(price_per_night__gte=min_price)
+    if max_price is not None:
+        listings = listings.filter(price_per_night__lte=max_price)
+
+    # Anti-join: a single correlated NOT EXISTS instead of pulling bookings
+    clashes = overlapping_bookings(start_date, end_date).filter(listing=OuterRef('pk'))
+    return listings.filter(~Exists(clashes))
+
+
+def batch_availability(listing_ids, start_date, end_date, currency=None):
+    """
+    Availability and a quote for the same stay at each of `listing_ids`.
+
+    Returns one dict per existing listing, in the order asked for. The query
+    count does not grow with the batch: one IN fetch of the listings, one
+    overlap query grouped by listing, and one for pricing rules when a
+    price calendar is not cached (see pricing.quote_listings). Raises
+    QuoteError for an unsupported currency.
+    """
+    listings = {
+        row['id']: row
+        for row in Listing.objects.filter(id__in=listing_ids).values(
+            'id', 'title', 'location', 'price_per_night', 'is_available',
+        )
+    }
+    if not listings:
+        return []
+
+    clashes = dict(
+        overlapping_bookings(start_date, end_date)
+        .filter(listing_id__in=list(listings))
+        .order_by()
+        .values_list('listing_id')
+        .annotate(clashes=Count('id'))
+    )
+    quotes = quote_listings(
+        {listing_id: row['price_per_night'] for listing_id, row in listings.items()},
+        start_date, end_date, currency,
+    )
+
+    results = []
+    for listing_id in dict.fromkeys(listing_ids):
+        row = listings.get(listing_id)
+        if row is None:
+            continue
+        results.append(dict(
+            quotes[listing_id],
+            title=row['title'],
+            location=row['location'],
+            is_available=row['is_available'],
+            clashes=clashes.get(listing_id, 0),
+            available=row['is_available'] and listing_id not in clashes,
+        ))
+    return results
@@ -0,0 +1,155 @@
+"""
+Booking creation helpers.
+
+Overlap checks run while the listing rows are locked, so two requests can
+never both see a listing as free for the same nights.
+"""
+from collections import defaultdict
+
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .availability import BLOCKING_STATUSES, overlapping_bookings
+from .models import Booking, Listing
+
+
+class BookingConflict(Exception):
+    """The requested nights are already held by another booking"""
+
+
+def lock_listings(listing_ids):
+    """
+    Serialize booking writers per listing for the current transaction.
+
+    Rows are locked in id order so concurrent writers cannot deadlock.
+    SQLite ignores SELECT ... FOR UPDATE, so there a no-op UPDATE takes the
+    database write lock instead.
+    """
+    listings = Listing.objects.filter(id__in=listing_ids).order_by('id').only('id', 'title', 'is_available')
+    if connection.features.has_select_for_update:
+        return {listing.id: listing for listing in listings.select_for_update()}
+    Listing.objects.filter(id__in=listing_ids).update(id=F('id'))
+    return {listing.id: listing for listing in listings}
+
+
+def lock_booking(booking_id):
+    """
+    Lock one booking row for the current transaction, as lock_listings does.
+
+    Returns the booking with its user and payment, read after the lock is
+    held, or None if it does not exist. The locking query does not join the
+    (nullable) payment, which PostgreSQL refuses to lock through.
+    """
+    if connection.features.has_select_for_update:
+        locked = bool(Booking.objects.select_for_update().filter(id=booking_id).values_list('id', flat=True))
+    else:
+        locked = Booking.objects.filter(id=booking_id).update(id=F('id')) > 0
+    if not locked:
+        return None
+    return Booking.objects.select_related('user', 'payment').get(id=booking_id)
+
+def save_booking(booking):
+    """
+    Insert or update a booking unless it would double-book its listing.
+
+    Raises BookingConflict when another blocking booking overlaps.
+    """
+    with transaction.atomic():
+        listing = lock_listings([booking.listing_id]).get(booking.listing_id)
+        if listing is None:
+            raise BookingConflict('Listing not found')
+        if not listing.is_available and not booking.pk:
+            raise BookingConflict('Listing is not available')
+
+        if booking.status in BLOCKING_STATUSES:
+            clashes = overlapping_bookings(booking.start_date, booking.end_date).filter(listing_id=listing.id)
+            if booking.pk:
+                clashes = clashes.exclude(pk=booking.pk)
+            if clashes.exists():
+                raise BookingConflict('Listing is already booked for these dates')
+
+        booking.save()
+    return booking
+
+
+def _overlaps(intervals, start_date, end_date):
+    return any(start < end_date and start_date < end for start, end in intervals)
+
+
+def bulk_create_bookings(user, items):
+    """
+    Validate and insert many bookings for `user` in one transaction.
+
+    `items` is a list of (index, validated_data) pairs. Listings are fetched
+    with one IN query, existing bookings for them with one range query, and
+    overlaps (against the table and within the batch) are checked in memory.
+    Returns (created_bookings, errors) where errors maps index -> message.
+    """
+    from .occupancy import record_saved
+
+    errors = {}
+    if not items:
+        return [], errors
+
+    listing_ids = sorted({data['listing'] for _, data in items})
+    window_start = min(data['start_date'] for _, data in items)
+    window_end = max(data['end_date'] for _, data in items)
+
+    with transaction.atomic():
+        listings = lock_listings(listing_ids)
+
+        taken = defaultdict(list)
+        existing = Booking.objects.filter(
+            listing_id__in=listings.keys(),
+            start_date__lt=window_end,
+            end_date__gt=window_start,
+            status__in=BLOCKING_STATUSES,
+        ).values_list('listing_id', 'start_date', 'end_date')
+        for listing_id, start, end in existing:
+            taken[listing_id].append((start, end))
+
+        pending = []
+        for index, data in items:
+            listing = listings.get(data['listing'])
+            if listing is None:
+                errors[index] = {'listing': ['Listing not found']}
+                continue
+            if not listing.is_available:
+                errors[index] = {'listing': ['Listing is not available']}
+                continue
+            if _overlaps(taken[listing.id], data['start_date'], data['end_date']):
+                errors[index] = {'non_field_errors': ['Listing is already booked for these dates']}
+                continue
+
+            taken[listing.id].append((data['start_date'], data['end_date']))
+            pending.append(Booking(
+                listing=listing,
+                user=user,
+                start_date=data['start_date'],
+                end_date=data['end_date'],
+                total_price=data['total_price'],
+            ))
+
+        started = timezone.now()
+        created = Booking.objects.bulk_create(pending)
+
+        if created and created[0].pk is None:
+            # MySQL cannot return ids from a multi-row INSERT; recover them.
+            # (listing, start_date) is unique among blocking bookings here
+            # because every listing involved is still locked.
+            ids = {
+                (listing_id, start): pk
+                for pk, listing_id, start in Booking.objects.filter(
+                    listing_id__in=listings.keys(),
+                    user=user,
+                    created_at__gte=started,
+                ).values_list('id', 'listing_id', 'start_date')
+            }
+            for booking in created:
+                booking.pk = ids.get((booking.listing_id, booking.start_date))
+
+        # bulk_create sends no post_save, so mark the new nights held here
+        record_saved(created)
+
+    return created, errors
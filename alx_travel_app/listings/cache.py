@@ -0,0 +1,124 @@
+"""
+Read-through cache for serialized Listing payloads.
+
+Detail entries are keyed by primary key and deleted whenever that listing
+changes. List pages are keyed by a global listings version, so bumping the
+version on any write orphans every cached page at once without having to
+enumerate them; orphaned pages simply age out.
+
+List pages carry an ETag but no Last-Modified: the newest updated_at on a
+page does not move when a listing is deleted or drops off it, so
+If-Modified-Since would answer 304 for a page that changed.
+"""
+import hashlib
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+from .metrics import CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'listings:version'
+
+
+def cache_timeout():
+    return getattr(settings, 'LISTING_CACHE_TIMEOUT', 300)
+
+
+def _incr(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Counter missing or evicted; add() avoids clobbering a concurrent incr
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+def _record(kind, hit):
+    # Counted per process for /metrics rather than in the cache, which
+    # would cost every read a second round trip
+    CACHE_LOOKUPS.labels(kind, 'hit' if hit else 'miss').inc()
+
+
+def get_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, 1, timeout=None)
+        version = cache.get(VERSION_KEY, 1)
+    return version
+
+
+def bump_version():
+    _incr(VERSION_KEY)
+
+
+def detail_key(pk):
+    return f'listings:detail:{pk}'
+
+
+def list_key(url):
+    digest = hashlib.md5(url.encode()).hexdigest()
+    return f'listings:list:v{get_version()}:{digest}'
+
+
+def make_entry(data, etag_source, last_modified):
+    """Bundle a payload with the validators used for conditional requests"""
+    return {
+        'data': data,
+        'etag': '"%s"' % hashlib.md5(etag_source.encode()).hexdigest(),
+        'last_modified': int(last_modified.timestamp()) if last_modified else None,
+    }
+
+
+def get_detail(pk):
+    entry = cache.get(detail_key(pk))
+    _record('detail', entry is not None)
+    return entry
+
+
+def set_detail(listing, data):
+    entry = make_entry(dict(data), f'{listing.pk}:{listing.updated_at.isoformat()}', listing.updated_at)
+    cache.set(detail_key(listing.pk), entry, cache_timeout())
+    return entry
+
+
+def get_list(url):
+    entry = cache.get(list_key(url))
+    _record('list', entry is not None)
+    return entry
+
+
+def set_list(url, data):
+    entry = make_entry(dict(data), f'{get_version()}:{url}', None)
+    cache.set(list_key(url), entry, cache_timeout())
+    return entry
+
+
+def invalidate_listing(pk):
+    cache.delete(detail_key(pk))
+    bump_version()
+
+
+def invalidate_listings(pks):
+    """Invalidate many listings at once, e.g. after a bulk_update"""
+    cache.delete_many([detail_key(pk) for pk in pks])
+    bump_version()
+
+
+def cached_response(request, entry):
+    """Answer from a cache entry, honouring If-None-Match / If-Modified-Since"""
+    response = Response(entry['data'])
+    response['ETag'] = entry['etag']
+    if entry['last_modified'] is not None:
+        response['Last-Modified'] = http_date(entry['last_modified'])
+    return get_conditional_response(
+        request,
+        etag=entry['etag'],
+        last_modified=entry['last_modified'],
+        response=response,
+    )
@@ -1,12 +1,125 @@
 import requests
 import uuid
+import hashlib
+import hmac
+import os
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import weakref
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 from decouple import config
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import logging
 
+from .circuit import Bulkhead, CallRejected, CircuitBreaker, guarded_call
+from .instrumentation import external_call
+from .metrics import chapa_call
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover - only needed by AsyncChapaService
+    httpx = None
+
 logger = logging.getLogger(__name__)
 
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Return the process-wide pooled session used for every Chapa call.
+
+    Reusing one session keeps TCP+TLS connections alive between payments.
+    The session is rebuilt after a fork so prefork workers never share
+    sockets with their parent.
+    """
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        with _session_lock:
+            if _session is None or _session_pid != os.getpid():
+                _session = build_session()
+                _session_pid = os.getpid()
+    return _session
+
+
+def build_session():
+    pool_size = config('CHAPA_POOL_SIZE', default=10, cast=int)
+    # Only GET (verify) is idempotent, so POST (initialize) is never retried
+    retry = Retry(
+        total=config('CHAPA_VERIFY_RETRIES', default=3, cast=int),
+        backoff_factor=config('CHAPA_RETRY_BACKOFF', default=0.5, cast=float),
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(['GET']),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+_gateway = None
+_gateway_pid = None
+
+
+def get_gateway():
+    """
+    Return the process-wide (CircuitBreaker, Bulkhead) pair guarding Chapa.
+
+    Like the session, it is rebuilt after a fork: each worker judges the
+    gateway and counts its in-flight calls on its own.
+    """
+    global _gateway, _gateway_pid
+    if _gateway is None or _gateway_pid != os.getpid():
+        with _session_lock:
+            if _gateway is None or _gateway_pid != os.getpid():
+                _gateway = build_gateway()
+                _gateway_pid = os.getpid()
+    return _gateway
+
+
+def build_gateway(max_concurrent=None):
+    if max_concurrent is None:
+        max_concurrent = config('CHAPA_MAX_CONCURRENT_CALLS', default=config('CHAPA_POOL_SIZE', default=10, cast=int), cast=int)
+    breaker = CircuitBreaker(
+        'chapa',
+        failure_threshold=config('CHAPA_BREAKER_FAILURE_THRESHOLD', default=5, cast=int),
+        recovery_timeout=config('CHAPA_BREAKER_RECOVERY_TIMEOUT', default=30, cast=float),
+        half_open_max_calls=config('CHAPA_BREAKER_HALF_OPEN_CALLS', default=1, cast=int),
+    )
+    bulkhead = Bulkhead(
+        'chapa',
+        max_concurrent,
+        retry_after=config('CHAPA_BULKHEAD_RETRY_AFTER', default=1, cast=float),
+    )
+    return breaker, bulkhead
+
+
+def is_gateway_failure(exc):
+    """Transport errors, timeouts and 429/5xx replies count against the circuit; other HTTP errors do not"""
+    response = getattr(exc, 'response', None)
+    if response is None:
+        return True
+    return response.status_code in RETRY_STATUSES
+
+
 class ChapaService:
+    """
+    Chapa API client.
+
+    Gateway failures are logged and reported as None. When the circuit
+    breaker is open or too many calls are already in flight, the call is not
+    attempted and CallRejected is raised instead, so callers can answer 503.
+    """
+
     def __init__(self):
         self.secret_key = config('CHAPA_SECRET_KEY')
         self.base_url = config('CHAPA_BASE_URL', default='https://api.chapa.co/v1')
@@ -14,14 +127,42 @@ class ChapaService:
             'Authorization': f'Bearer {self.secret_key}',
             'Content-Type': 'application/json'
         }
+        self.timeout = (
+            config('CHAPA_CONNECT_TIMEOUT', default=3.05, cast=float),
+            config('CHAPA_READ_TIMEOUT', default=15, cast=float),
+        )
+        # How long a call may wait for a free bulkhead slot before it is rejected
+        self.bulkhead_timeout = config('CHAPA_BULKHEAD_TIMEOUT', default=0.5, cast=float)
+        # A (CircuitBreaker, Bulkhead) pair from build_gateway(); None shares the process-wide one
+        self.gateway = None
+        self.session = get_session()
+
+    def guard(self):
+        """Bulkhead slot and circuit breaker around one gateway call"""
+        breaker, bulkhead = self.gateway or get_gateway()
+        return guarded_call(breaker, bulkhead, is_gateway_failure, timeout=self.bulkhead_timeout)
     
     def initiate_payment(self, amount, currency, email, first_name, last_name, tx_ref, callback_url=None, return_url=None):
         """
         Initiate payment with Chapa
         """
         url = f"{self.base_url}/transaction/initialize"
+        payload = self.initiation_payload(amount, currency, email, first_name, last_name, tx_ref, callback_url, return_url)
         
-        payload = {
+        try:
+            with self.guard(), external_call(), chapa_call('initialize'):
+                response = self.session.post(url, json=payload, headers=self.headers, timeout=self.timeout)
+                response.raise_for_status()
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Chapa payment initiation failed: {e}")
+            return None
+    
+    def initiation_payload(self, amount, currency, email, first_name, last_name, tx_ref, callback_url=None, return_url=None):
+        """
+        Build the transaction/initialize request body
+        """
+        return {
             "amount": str(amount),
             "currency": currency,
             "email": email,
@@ -35,25 +176,134 @@ class ChapaService:
                 "description": "Payment for booking"
             }
         }
+    
+    def verify_payment(self, tx_ref):
+        """
+        Verify payment status with Chapa
+        """
+        url = f"{self.base_url}/transaction/verify/{tx_ref}"
         
         try:
-            response = requests.post(url, json=payload, headers=self.headers)
-            response.raise_for_status()
+            with self.guard(), external_call(), chapa_call('verify'):
+                response = self.session.get(url, headers=self.headers, timeout=self.timeout)
+                response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
+            logger.error(f"Chapa payment verification failed: {e}")
+            return None
+
+    @staticmethod
+    def verify_webhook_signature(body, signature):
+        """
+        Check a webhook's HMAC-SHA256 signature against CHAPA_WEBHOOK_SECRET.
+
+        When no secret is configured every webhook is accepted; the payload
+        is only ever used as a hint to re-verify with the gateway.
+        """
+        secret = config('CHAPA_WEBHOOK_SECRET', default='')
+        if not secret:
+            return True
+        expected = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+        return hmac.compare_digest(expected, signature or '')
+
+
+def verify_many(tx_refs, concurrency):
+    """
+    {tx_ref: verification response or None} with at most `concurrency`
+    gateway calls in flight. Calls the gateway rejects outright also map to
+    None, so callers simply leave those payments PENDING for a later run.
+    """
+    service = ChapaService()
+
+    def verify(tx_ref):
+        try:
+            return service.verify_payment(tx_ref)
+        except CallRejected:
+            return None
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return dict(zip(tx_refs, pool.map(verify, tx_refs)))
+
+
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    """
+    Return the pooled async client for the running event loop.
+
+    httpx clients are bound to the loop they were created on, so one is kept
+    per loop (normally one per ASGI worker process).
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        pool_size = config('CHAPA_ASYNC_POOL_SIZE', default=20, cast=int)
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        )
+        _async_clients[loop] = client
+    return client
+
+
+class AsyncChapaService(ChapaService):
+    """
+    Non-blocking variant of ChapaService for async views.
+
+    Return values and error handling mirror the sync client: the decoded
+    JSON body on success, None on any transport or HTTP error.
+    """
+
+    def __init__(self):
+        if httpx is None:
+            raise ImproperlyConfigured('AsyncChapaService requires the httpx package')
+        super().__init__()
+        self.verify_retries = config('CHAPA_VERIFY_RETRIES', default=3, cast=int)
+        self.retry_backoff = config('CHAPA_RETRY_BACKOFF', default=0.5, cast=float)
+        connect_timeout, read_timeout = self.timeout
+        self.async_timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        # Waiting on the bulkhead's semaphore would block the event loop
+        self.bulkhead_timeout = 0
+
+    async def initiate_payment(self, amount, currency, email, first_name, last_name, tx_ref, callback_url=None, return_url=None):
+        """
+        Initiate payment with Chapa
+        """
+        url = f"{self.base_url}/transaction/initialize"
+        payload = self.initiation_payload(amount, currency, email, first_name, last_name, tx_ref, callback_url, return_url)
+
+        try:
+            with self.guard(), external_call(), chapa_call('initialize'):
+                response = await get_async_client().post(url, json=payload, headers=self.headers, timeout=self.async_timeout)
+                response.raise_for_status()
+            return response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            # ValueError: a non-JSON body, which the sync client sees as a RequestException
             logger.error(f"Chapa payment initiation failed: {e}")
             return None
-    
-    def verify_payment(self, tx_ref):
+
+    async def verify_payment(self, tx_ref):
         """
-        Verify payment status with Chapa
+        Verify payment status with Chapa, retrying transient failures
         """
         url = f"{self.base_url}/transaction/verify/{tx_ref}"
-        
+
+        # Retries happen inside one guarded call, so a verification counts once for the circuit
         try:
-            response = requests.get(url, headers=self.headers)
-            response.raise_for_status()
+            with self.guard():
+                for attempt in range(self.verify_retries + 1):
+                    try:
+                        with external_call(), chapa_call('verify'):
+                            response = await get_async_client().get(url, headers=self.headers, timeout=self.async_timeout)
+                            if response.status_code not in RETRY_STATUSES or attempt == self.verify_retries:
+                                response.raise_for_status()
+                                break
+                    except httpx.TransportError:
+                        if attempt == self.verify_retries:
+                            raise
+                    await asyncio.sleep(self.retry_backoff * (2 ** attempt))
+            # Decoded outside the guard, as in the sync client, so a bad body is not a gateway failure
             return response.json()
-        except requests.exceptions.RequestException as e:
+        except (httpx.HTTPError, ValueError) as e:
             logger.error(f"Chapa payment verification failed: {e}")
-            return None
\ No newline at end of file
+            return None
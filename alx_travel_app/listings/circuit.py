@@ -0,0 +1,159 @@
+"""
+Circuit breaker and bulkhead for calls to an external service.
+
+When the gateway degrades, every request waiting on it holds a worker, and
+soon the whole pool is stuck behind Chapa and unrelated endpoints stop
+answering too. Two guards keep a slow or failing gateway contained:
+
+- Bulkhead: at most N calls in flight per process. Callers beyond that are
+  turned away (after an optional short wait) instead of queueing.
+- CircuitBreaker: after `failure_threshold` consecutive failures the
+  circuit opens and calls are rejected without being attempted. After
+  `recovery_timeout` seconds it goes half-open and lets a few probe calls
+  through; a successful probe closes it, a failed one opens it again.
+
+Both raise CallRejected, which carries a Retry-After hint for clients.
+State is per process, like the connection pool it protects.
+"""
+from contextlib import contextmanager
+import threading
+import time
+
+from .metrics import CIRCUIT_REJECTIONS, CIRCUIT_STATE
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CallRejected(Exception):
+    """The call was not attempted; try again in `retry_after` seconds"""
+
+    def __init__(self, circuit, reason, retry_after):
+        super().__init__(f'{circuit}: {reason}')
+        self.circuit = circuit
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=5, recovery_timeout=30.0, half_open_max_calls=1, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        CIRCUIT_STATE.labels(name).set(STATE_VALUES[CLOSED])
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == OPEN and self.clock() - self._opened_at >= self.recovery_timeout:
+            self._set_state(HALF_OPEN)
+            self._probes = 0
+        return self._state
+
+    def _set_state(self, state):
+        self._state = state
+        CIRCUIT_STATE.labels(self.name).set(STATE_VALUES[state])
+
+    def _reject(self, reason, retry_after):
+        CIRCUIT_REJECTIONS.labels(self.name, reason).inc()
+        raise CallRejected(self.name, reason, retry_after)
+
+    def allow(self):
+        """Claim permission for one call, or raise CallRejected"""
+        with self._lock:
+            state = self._current_state()
+            if state == OPEN:
+                self._reject('circuit_open', self.recovery_timeout - (self.clock() - self._opened_at))
+            if state == HALF_OPEN:
+                if self._probes >= self.half_open_max_calls:
+                    self._reject('circuit_half_open', self.recovery_timeout)
+                self._probes += 1
+
+    def record_success(self):
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._release_probe()
+                self._set_state(CLOSED)
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._release_probe()
+                self._trip()
+            elif self._state == CLOSED:
+                self._failures += 1
+                if self._failures >= self.failure_threshold:
+                    self._trip()
+
+    def release(self):
+        """End a call without judging the gateway, e.g. when it was cancelled"""
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._release_probe()
+
+    def _release_probe(self):
+        # A call allowed while closed may finish after the circuit went half-open
+        self._probes = max(self._probes - 1, 0)
+
+    def _trip(self):
+        self._set_state(OPEN)
+        self._opened_at = self.clock()
+        self._failures = 0
+
+
+class Bulkhead:
+    def __init__(self, name, max_concurrent, retry_after=1.0):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.retry_after = retry_after
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+
+    @contextmanager
+    def slot(self, timeout=0):
+        """Hold one of the slots for the duration of the block; never blocks when timeout is 0"""
+        acquired = self._slots.acquire(timeout=timeout) if timeout > 0 else self._slots.acquire(blocking=False)
+        if not acquired:
+            CIRCUIT_REJECTIONS.labels(self.name, 'bulkhead_full').inc()
+            raise CallRejected(self.name, 'bulkhead_full', self.retry_after)
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+
+@contextmanager
+def guarded_call(breaker, bulkhead, is_failure, timeout=0):
+    """
+    Run the block under `bulkhead` and `breaker`.
+
+    An exception leaving the block counts against the circuit only if
+    is_failure(exc) says the service itself is at fault (e.g. a 4xx reply
+    means the gateway is healthy). It is re-raised either way.
+    """
+    with bulkhead.slot(timeout):
+        breaker.allow()
+        try:
+            yield
+        except Exception as e:
+            if is_failure(e):
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            raise
+        except BaseException:
+            breaker.release()
+            raise
+        breaker.record_success()
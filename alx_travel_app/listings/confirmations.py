@@ -0,0 +1,39 @@
+"""
+Outbox of booking confirmation emails.
+
+Every path that creates or confirms a booking (the bookings endpoints,
+payment verification, the reconciler and the expiry sweeper) adds a
+PendingConfirmation row in its own transaction instead of queueing a task
+per email. send_pending_confirmations drains the table from Celery beat
+and hands the bookings to send_booking_confirmation_emails in chunks, so
+every email sent in a run shares one SMTP connection per chunk, whichever
+path queued it. A row only exists once its booking is committed, and one
+booking queued twice before a run gets one email.
+"""
+from django.db import connection, transaction
+
+from .models import PendingConfirmation
+
+
+def queue_confirmations(booking_ids):
+    """Add bookings to the outbox, in the caller's transaction"""
+    PendingConfirmation.objects.bulk_create(
+        [PendingConfirmation(booking_id=booking_id) for booking_id in booking_ids], ignore_conflicts=True,
+    )
+
+
+def claim_confirmations(limit):
+    """
+    Take up to `limit` of the oldest bookings out of the outbox.
+
+    Rows are deleted as they are claimed, so overlapping runs never send
+    the same confirmation twice; a caller that cannot hand them on puts
+    them back with queue_confirmations.
+    """
+    with transaction.atomic():
+        pending = PendingConfirmation.objects.order_by('created_at', 'booking_id')
+        if connection.features.has_select_for_update_skip_locked:
+            pending = pending.select_for_update(skip_locked=True)
+        booking_ids = list(pending.values_list('booking_id', flat=True)[:limit])
+        PendingConfirmation.objects.filter(booking_id__in=booking_ids).delete()
+    return booking_ids
@@ -0,0 +1,185 @@
+"""
+Expiry of abandoned PENDING bookings and payments.
+
+A PENDING booking holds its nights, so a guest who never pays keeps them
+from everyone else. The sweeper runs from Celery beat and cancels:
+
+- PENDING payments older than PENDING_PAYMENT_TTL minutes (abandoned
+  Chapa checkouts), together with their still-pending bookings. A guest
+  may still have paid at the last minute, so each one is verified with
+  Chapa first: paid or failed ones are settled as the reconciler would,
+  and ones Chapa cannot answer for wait for the next run.
+- PENDING bookings older than PENDING_BOOKING_TTL minutes that never got a
+  payment. A booking with a live checkout waits for its payment to expire.
+
+Candidates are read off the (status, created_at) indexes in batches,
+keyset-paged on (created_at, id), and at most max_batches of them per run.
+Each batch is re-read under row locks before bulk_update, so a payment
+settled or started meanwhile is left alone. bulk_update skips save() and
+its signals, so the sweeper stamps updated_at for the analytics rollups,
+counts payment transitions and releases occupancy nights itself.
+"""
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .chapa_service import verify_many
+from .confirmations import queue_confirmations
+from .idempotency import key_ttl
+from .metrics import SWEEP_RECLAIMED, record_payment_transition
+from .models import Booking, IdempotencyKey, Payment
+from .occupancy import record_saved
+from .payments import apply_verification
+
+
+def keyset_batches(queryset, batch_size, max_batches):
+    """Ids from `queryset` in (created_at, id) order, batch_size at a time, for at most max_batches batches"""
+    queryset = queryset.order_by('created_at', 'id')
+    last = None
+    for _ in range(max_batches):
+        page = queryset
+        if last is not None:
+            page = page.filter(Q(created_at__gt=last[0]) | Q(created_at=last[0], id__gt=last[1]))
+        rows = list(page.values_list('created_at', 'id')[:batch_size])
+        if not rows:
+            return
+        last = rows[-1]
+        yield [pk for _, pk in rows]
+        if len(rows) < batch_size:
+            return
+
+
+def cancel_bookings(bookings, now):
+    """Cancel locked PENDING bookings in one statement; returns the nights released"""
+    for booking in bookings:
+        booking.status = 'CANCELLED'
+        # bulk_update bypasses save(), so auto_now is not applied
+        booking.updated_at = now
+    Booking.objects.bulk_update(bookings, ['status', 'updated_at'])
+    record_saved(bookings)
+    return sum((booking.end_date - booking.start_date).days for booking in bookings)
+
+
+def expire_payments(cutoff, batch_size, max_batches, concurrency):
+    """
+    Close PENDING payments created before `cutoff` after a last check with Chapa.
+
+    Ones Chapa reports paid or failed are settled as the reconciler would
+    (paid ones counted as `paid`); the rest are cancelled together with
+    their pending bookings.
+    """
+    reclaimed = {'payments': 0, 'bookings': 0, 'nights': 0, 'paid': 0}
+    candidates = Payment.objects.filter(status='PENDING', created_at__lt=cutoff)
+    for ids in keyset_batches(candidates, batch_size, max_batches):
+        # Asked before the rows are locked, so no lock is held across gateway calls
+        results = verify_many(list(Payment.objects.filter(id__in=ids).values_list('chapa_tx_ref', flat=True)), concurrency)
+
+        with transaction.atomic():
+            payments = list(
+                Payment.objects.select_for_update().select_related('booking').filter(id__in=ids, status='PENDING')
+            )
+            now = timezone.now()
+            closed, bookings = [], []
+            for payment in payments:
+                response = results.get(payment.chapa_tx_ref)
+                if not response:
+                    # Chapa could not say whether it was paid; checked again next run
+                    continue
+                booking = payment.booking
+                held = booking.status
+                if not apply_verification(payment, response.get('data') or {}):
+                    # Still unpaid at the gateway: the checkout was abandoned
+                    payment.status = 'CANCELLED'
+                    if booking.status == 'PENDING':
+                        booking.status = 'CANCELLED'
+                # bulk_update bypasses save(), so auto_now is not applied
+                payment.updated_at = now
+                closed.append(payment)
+                if booking.status != held:
+                    booking.updated_at = now
+                    bookings.append(booking)
+
+            Payment.objects.bulk_update(closed, ['status', 'paid_at', 'chapa_reference', 'payment_method', 'updated_at'])
+            Booking.objects.bulk_update(bookings, ['status', 'updated_at'])
+            record_saved(bookings)
+            transitions = Counter(payment.status for payment in closed)
+            transaction.on_commit(lambda: record_transitions(transitions))
+            queue_confirmations([booking.id for booking in bookings if booking.status == 'CONFIRMED'])
+
+        cancelled = [booking for booking in bookings if booking.status == 'CANCELLED']
+        reclaimed['payments'] += len(closed) - transitions['COMPLETED']
+        reclaimed['paid'] += transitions['COMPLETED']
+        reclaimed['bookings'] += len(cancelled)
+        reclaimed['nights'] += sum((booking.end_date - booking.start_date).days for booking in cancelled)
+    return reclaimed
+
+
+def record_transitions(transitions):
+    for status, count in transitions.items():
+        record_payment_transition('PENDING', status, count)
+
+
+def expire_bookings(cutoff, batch_size, max_batches):
+    """Cancel PENDING bookings created before `cutoff` that have no payment"""
+    reclaimed = {'bookings': 0, 'nights': 0}
+    candidates = Booking.objects.filter(status='PENDING', created_at__lt=cutoff, payment__isnull=True)
+    for ids in keyset_batches(candidates, batch_size, max_batches):
+        with transaction.atomic():
+            # Locked without the payment join, which PostgreSQL refuses to lock through
+            bookings = list(
+                Booking.objects.select_for_update().filter(id__in=ids, status='PENDING')
+                .only('id', 'listing', 'start_date', 'end_date', 'status', 'updated_at')
+            )
+            # initiate_payment locks the booking too, so no checkout can start after this read
+            started = set(Payment.objects.filter(booking_id__in=[booking.id for booking in bookings])
+                          .values_list('booking_id', flat=True))
+            bookings = [booking for booking in bookings if booking.id not in started]
+            nights = cancel_bookings(bookings, timezone.now())
+
+        reclaimed['bookings'] += len(bookings)
+        reclaimed['nights'] += nights
+    return reclaimed
+
+
+def purge_idempotency_keys(cutoff, batch_size, max_batches):
+    """Delete stored Idempotency-Key responses created before `cutoff`; lookups already ignore them"""
+    purged = 0
+    expired = IdempotencyKey.objects.filter(created_at__lt=cutoff)
+    for ids in keyset_batches(expired, batch_size, max_batches):
+        purged += IdempotencyKey.objects.filter(id__in=ids).delete()[0]
+    return purged
+
+
+def sweep_pending(batch_size=None, max_batches=None):
+    """
+    Expire stale payments, then bookings, then idempotency keys.
+
+    Returns how many rows of each kind were reclaimed, plus the booked
+    nights released, and adds the same to listings_pending_sweep_reclaimed_total.
+    `paid` counts expired payments Chapa turned out to have been paid.
+    """
+    batch_size = batch_size or getattr(settings, 'PENDING_SWEEP_BATCH_SIZE', 500)
+    max_batches = max_batches or getattr(settings, 'PENDING_SWEEP_MAX_BATCHES', 20)
+    concurrency = getattr(settings, 'PAYMENT_RECONCILE_CONCURRENCY', 8)
+    now = timezone.now()
+
+    from_payments = expire_payments(
+        now - timedelta(minutes=getattr(settings, 'PENDING_PAYMENT_TTL', 1440)), batch_size, max_batches, concurrency,
+    )
+    from_bookings = expire_bookings(
+        now - timedelta(minutes=getattr(settings, 'PENDING_BOOKING_TTL', 60)), batch_size, max_batches,
+    )
+    result = {
+        'payments': from_payments['payments'],
+        'bookings': from_payments['bookings'] + from_bookings['bookings'],
+        'nights': from_payments['nights'] + from_bookings['nights'],
+        'idempotency_keys': purge_idempotency_keys(now - timedelta(seconds=key_ttl()), batch_size, max_batches),
+    }
+    for kind, count in result.items():
+        SWEEP_RECLAIMED.labels(kind).inc(count)
+    result['paid'] = from_payments['paid']
+    return result
@@ -0,0 +1,137 @@
+"""
+"Near me" search over listing coordinates without GIS extensions.
+
+Every listing with coordinates stores geo_cell, the number of the
+CELL_DEGREES grid cell it falls in, counted row by row from the south-west
+corner of the map. Neighbouring cells in a grid row are consecutive
+integers, so the cells under a bounding box are one BETWEEN per grid row
+on the (geo_cell, latitude, longitude) index, which MySQL and SQLite both
+answer as range scans. The exact box is applied in the same statement from
+the index columns, and only (id, latitude, longitude) come back; haversine
+distances are computed in Python.
+
+A radius search starts from a small circle and widens it until it holds a
+full page of listings, so a query in a dense city never reads candidates
+from the whole radius.
+"""
+import heapq
+import math
+
+from django.db.models import Q
+
+CELL_DEGREES = 0.05  # about 5.5 km north to south; run rebuild_geo_cells after changing it
+ROWS = round(180 / CELL_DEGREES)
+COLUMNS = round(360 / CELL_DEGREES)
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+# Beyond this many BETWEENs, one range over the whole band of rows is cheaper to plan
+MAX_CELL_RANGES = 64
+INITIAL_RADIUS_KM = 5.0
+
+
+def cell_row(latitude):
+    return min(max(int((latitude + 90) / CELL_DEGREES), 0), ROWS - 1)
+
+
+def cell_column(longitude):
+    return min(max(int((longitude + 180) / CELL_DEGREES), 0), COLUMNS - 1)
+
+
+def grid_cell(latitude, longitude):
+    """The geo_cell of a point, or None without coordinates"""
+    if latitude is None or longitude is None:
+        return None
+    return cell_row(latitude) * COLUMNS + cell_column(longitude)
+
+
+def haversine_km(latitude1, longitude1, latitude2, longitude2):
+    phi1, phi2 = math.radians(latitude1), math.radians(latitude2)
+    a = (math.sin((phi2 - phi1) / 2) ** 2
+         + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(longitude2 - longitude1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """
+    (min_lat, max_lat, min_lng, max_lng) enclosing a circle.
+
+    Longitudes may run past +/-180 when the circle crosses the antimeridian;
+    a circle reaching a pole spans every longitude.
+    """
+    degrees = radius_km / KM_PER_DEGREE
+    min_lat, max_lat = max(latitude - degrees, -90.0), min(latitude + degrees, 90.0)
+    # Meridians converge, so the circle is widest at the latitude nearest a pole
+    widest = math.cos(math.radians(max(abs(min_lat), abs(max_lat))))
+    if widest < 1e-9 or degrees / widest >= 180:
+        return min_lat, max_lat, -180.0, 180.0
+    return min_lat, max_lat, longitude - degrees / widest, longitude + degrees / widest
+
+
+def box_size_km(min_lat, max_lat, min_lng, max_lng):
+    """
+    (height, width) of a box in km, its width taken at the latitude nearest
+    the equator, where it is widest. max_lng may run past 180 for a box
+    across the antimeridian.
+    """
+    nearest_equator = 0.0 if min_lat <= 0 <= max_lat else min(abs(min_lat), abs(max_lat))
+    width = (max_lng - min_lng) * KM_PER_DEGREE * math.cos(math.radians(nearest_equator))
+    return (max_lat - min_lat) * KM_PER_DEGREE, width
+
+
+def longitude_spans(min_lng, max_lng):
+    """Split a longitude range that runs past +/-180 into ranges inside [-180, 180]"""
+    if max_lng - min_lng >= 360:
+        return [(-180.0, 180.0)]
+    if min_lng < -180:
+        return [(min_lng + 360, 180.0), (-180.0, max_lng)]
+    if max_lng > 180:
+        return [(min_lng, 180.0), (-180.0, max_lng - 360)]
+    return [(min_lng, max_lng)]
+
+
+def box_filter(min_lat, max_lat, min_lng, max_lng):
+    """Q for listings inside a box, led by geo_cell ranges so the index does the pruning"""
+    first_row, last_row = cell_row(min_lat), cell_row(max_lat)
+    spans = longitude_spans(min_lng, max_lng)
+
+    if (last_row - first_row + 1) * len(spans) > MAX_CELL_RANGES:
+        cells = Q(geo_cell__range=(first_row * COLUMNS, last_row * COLUMNS + COLUMNS - 1))
+    else:
+        cells = Q()
+        for row in range(first_row, last_row + 1):
+            for west, east in spans:
+                cells |= Q(geo_cell__range=(row * COLUMNS + cell_column(west), row * COLUMNS + cell_column(east)))
+
+    longitudes = Q()
+    for west, east in spans:
+        longitudes |= Q(longitude__range=(west, east))
+    return cells & Q(latitude__range=(min_lat, max_lat)) & longitudes
+
+
+def candidates(queryset, box, latitude, longitude):
+    """(distance_km, id) of every listing in `box`, measured from the given point"""
+    rows = queryset.filter(box_filter(*box)).order_by().values_list('id', 'latitude', 'longitude')
+    return [
+        (haversine_km(latitude, longitude, listing_lat, listing_lng), listing_id)
+        for listing_id, listing_lat, listing_lng in rows.iterator()
+    ]
+
+
+def nearest_within(queryset, latitude, longitude, radius_km, limit):
+    """Up to `limit` (id, distance_km) pairs within radius_km of a point, nearest first"""
+    search_km = min(INITIAL_RADIUS_KM, radius_km)
+    while True:
+        hits = [
+            hit for hit in candidates(queryset, bounding_box(latitude, longitude, search_km), latitude, longitude)
+            if hit[0] <= search_km
+        ]
+        # Anything outside the current circle is farther than every hit inside it
+        if len(hits) >= limit or search_km >= radius_km:
+            return [(listing_id, distance) for distance, listing_id in heapq.nsmallest(limit, hits)]
+        search_km = min(search_km * 2, radius_km)
+
+
+def nearest_in_box(queryset, box, latitude, longitude, limit):
+    """Up to `limit` (id, distance_km) pairs inside a box, nearest to a point first"""
+    hits = candidates(queryset, box, latitude, longitude)
+    return [(listing_id, distance) for distance, listing_id in heapq.nsmallest(limit, hits)]
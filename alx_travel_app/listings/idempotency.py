@@ -0,0 +1,80 @@
+"""
+Idempotency-Key support for payment initiation.
+
+A client that retries a request with the same Idempotency-Key gets the
+first response back instead of a second gateway call. Completed responses
+are written to an IdempotencyKey row in the same transaction as the payment
+they describe, so the unique key is the source of truth; the cache in front
+of it answers repeats without touching the database. Only successful
+responses are stored, so a failed attempt can simply be retried.
+
+Each stored response carries a fingerprint of the request it answered.
+Reusing a key for a different request is an error rather than a replay.
+"""
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyKeyReused(Exception):
+    """The key was already used for a different request"""
+
+
+def key_ttl():
+    return getattr(settings, 'IDEMPOTENCY_KEY_TTL', 86400)
+
+
+def cache_key(key):
+    # Hashed so arbitrary client strings are safe as memcached keys
+    return f'idempotency:{hashlib.sha256(key.encode()).hexdigest()}'
+
+
+def fingerprint(scope, data):
+    """Stable hash of what a request asked for"""
+    payload = json.dumps([scope, data], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def lookup(key, request_fingerprint, use_database=False):
+    """
+    The stored (status, body) for `key`, or None if there is none yet.
+
+    The cache is always consulted; pass use_database=True once the caller
+    holds the lock that serializes writers, so a cold cache cannot cause a
+    second attempt. Raises IdempotencyKeyReused on a fingerprint mismatch.
+    """
+    stored = cache.get(cache_key(key))
+    if stored is None and use_database:
+        stored = IdempotencyKey.objects.filter(
+            key=key, created_at__gte=timezone.now() - timedelta(seconds=key_ttl()),
+        ).values_list('fingerprint', 'response_status', 'response_body').first()
+        if stored is not None:
+            cache.set(cache_key(key), stored, key_ttl())
+    if stored is None:
+        return None
+    if stored[0] != request_fingerprint:
+        raise IdempotencyKeyReused(key)
+    return stored[1], stored[2]
+
+
+def store(key, request_fingerprint, status_code, body):
+    """Record a response in the current transaction; the cache is filled once it commits"""
+    # An expired row would otherwise hold the key forever
+    IdempotencyKey.objects.filter(
+        key=key, created_at__lt=timezone.now() - timedelta(seconds=key_ttl()),
+    ).delete()
+    IdempotencyKey.objects.create(
+        key=key, fingerprint=request_fingerprint, response_status=status_code, response_body=body,
+    )
+    stored = (request_fingerprint, status_code, body)
+    transaction.on_commit(lambda: cache.set(cache_key(key), stored, key_ttl()))
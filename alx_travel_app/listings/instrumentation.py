@@ -0,0 +1,176 @@
+"""
+Per-request timing breakdown: database, external HTTP, serialization, total.
+
+RequestTimingMiddleware opens a RequestTimings for each sampled request and
+keeps it in a context variable, so the database execute wrapper, ChapaService
+and the serializer mixin can add to it from anywhere in the request, sync or
+async (asgiref copies the context into sync_to_async threads). Unsampled
+requests only pay for two clock reads, which keeps the middleware cheap
+enough to leave on in production.
+
+Results go out as a Server-Timing header and one structured log line per
+sampled request; requests over the slow threshold are always logged.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+import json
+import logging
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    __slots__ = ('db_count', 'db_ms', 'http_count', 'http_ms', 'serialize_ms', 'serializing')
+
+    def __init__(self):
+        self.db_count = 0
+        self.db_ms = 0.0
+        self.http_count = 0
+        self.http_ms = 0.0
+        self.serialize_ms = 0.0
+        self.serializing = False
+
+    def server_timing(self, total_ms):
+        return ', '.join([
+            f'db;dur={self.db_ms:.1f};desc="{self.db_count} queries"',
+            f'http;dur={self.http_ms:.1f};desc="{self.http_count} calls"',
+            f'serialize;dur={self.serialize_ms:.1f}',
+            f'total;dur={total_ms:.1f}',
+        ])
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Database execute_wrapper that adds each query's time to the request.
+
+    Installed on every connection when it opens (see signals), since async
+    views run their queries on other threads' connections.
+    """
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    began = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.db_count += 1
+        timings.db_ms += (time.perf_counter() - began) * 1000
+
+
+@contextmanager
+def external_call():
+    """Time an outbound HTTP call (e.g. to Chapa) against the current request"""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    began = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.http_count += 1
+        timings.http_ms += (time.perf_counter() - began) * 1000
+
+
+class TimedSerializerMixin:
+    """Counts to_representation time; nested serializers are not double counted"""
+
+    def to_representation(self, instance):
+        timings = _current.get()
+        if timings is None or timings.serializing:
+            return super().to_representation(instance)
+        timings.serializing = True
+        began = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            timings.serializing = False
+            timings.serialize_ms += (time.perf_counter() - began) * 1000
+
+
+class RequestTimingMiddleware:
+    """
+    Settings:
+      REQUEST_TIMING_SAMPLE_RATE  share of requests to break down (0.0-1.0)
+      REQUEST_TIMING_SLOW_MS      requests slower than this are always logged
+      REQUEST_TIMING_HEADER       emit Server-Timing on sampled responses
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'REQUEST_TIMING_SAMPLE_RATE', 0.01)
+        self.slow_ms = getattr(settings, 'REQUEST_TIMING_SLOW_MS', 1000)
+        self.header = getattr(settings, 'REQUEST_TIMING_HEADER', True)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = self.start()
+        began = time.perf_counter()
+        if timings is None:
+            response = self.get_response(request)
+        else:
+            token = _current.set(timings)
+            try:
+                response = self.get_response(request)
+            finally:
+                _current.reset(token)
+        return self.finish(request, response, timings, began)
+
+    async def __acall__(self, request):
+        timings = self.start()
+        began = time.perf_counter()
+        if timings is None:
+            response = await self.get_response(request)
+        else:
+            token = _current.set(timings)
+            try:
+                response = await self.get_response(request)
+            finally:
+                _current.reset(token)
+        return self.finish(request, response, timings, began)
+
+    def start(self):
+        if self.sample_rate >= 1 or random.random() < self.sample_rate:
+            return RequestTimings()
+        return None
+
+    def finish(self, request, response, timings, began):
+        # Streaming bodies are produced after this returns and are not included
+        total_ms = (time.perf_counter() - began) * 1000
+        slow = total_ms >= self.slow_ms
+        if timings is None and not slow:
+            return response
+
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': round(total_ms, 2),
+            'slow': slow,
+        }
+        if timings is not None:
+            record.update({
+                'db_queries': timings.db_count,
+                'db_ms': round(timings.db_ms, 2),
+                'http_calls': timings.http_count,
+                'http_ms': round(timings.http_ms, 2),
+                'serialize_ms': round(timings.serialize_ms, 2),
+            })
+            if self.header:
+                response['Server-Timing'] = timings.server_timing(total_ms)
+
+        level = logging.WARNING if slow else logging.INFO
+        logger.log(level, f'request_timing {json.dumps(record)}', extra={'request_timing': record})
+        return response
@@ -0,0 +1,400 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from urllib.parse import urlencode
+import hashlib
+import hmac
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import threading
+import time
+import tracemalloc
+import uuid
+
+import django
+from celery import current_app
+from decouple import config
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from listings import cache as listing_cache
+from listings.models import Listing, Booking, Payment
+from testing.chapa_stub import ChapaStubServer
+
+# Fixture bookings start this far out so they never clash with seeded stays
+FIXTURE_HORIZON_DAYS = 3650
+
+
+def percentile(timings, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not timings:
+        return None
+    rank = max(1, -(-len(timings) * pct // 100))
+    return round(timings[int(rank) - 1], 3)
+
+
+def latency_summary(timings):
+    timings = sorted(timings)
+    return {
+        'p50': percentile(timings, 50),
+        'p95': percentile(timings, 95),
+        'p99': percentile(timings, 99),
+        'mean': round(statistics.fmean(timings), 3) if timings else None,
+        'max': round(timings[-1], 3) if timings else None,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks every listings API route in-process, sequentially and under multi-threaded load'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--listings', type=int, default=2000)
+        parser.add_argument('--bookings', type=int, default=10000)
+        parser.add_argument('--payments', type=int, default=3000)
+        parser.add_argument('--reviews', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--skip-seed', action='store_true', help='Reuse the data already in the database')
+        parser.add_argument('--requests', type=int, default=50, help='Sequential requests per route')
+        parser.add_argument('--profile-requests', type=int, default=5, help='Requests per route traced for peak memory')
+        parser.add_argument('--load-requests', type=int, default=200, help='Requests per route under load (0 to skip)')
+        parser.add_argument('--threads', type=int, default=8, help='Load generator threads')
+        parser.add_argument('--chapa-latency', type=float, default=0.0, help='Artificial stub gateway latency in seconds')
+        parser.add_argument('--route', action='append', dest='routes', help='Only run these route names')
+        parser.add_argument('--output', help='Write results as JSON to this file')
+        parser.add_argument('--compare', help='Baseline JSON from a previous run to diff against')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Relative p95 increase over the baseline that counts as a regression')
+
+    def handle(self, *args, **options):
+        if not options['skip_seed']:
+            call_command(
+                'seed', users=options['users'], listings=options['listings'], bookings=options['bookings'],
+                payments=options['payments'], reviews=options['reviews'], seed=options['seed'], stdout=self.stdout,
+            )
+        if not Listing.objects.exists():
+            raise CommandError('No listings to benchmark; run without --skip-seed')
+
+        self.run_id = uuid.uuid4().hex[:8]
+        self.user, _ = User.objects.get_or_create(username='bench_api_user', defaults={'email': 'bench@example.com'})
+        self.listing_ids = list(Listing.objects.filter(is_available=True).values_list('id', flat=True)[:500])
+        self.booking_ids = list(Booking.objects.values_list('id', flat=True)[:500])
+        self.payment_ids = list(Payment.objects.values_list('id', flat=True)[:500])
+        self.fixture_counter = itertools.count()
+
+        per_route = options['requests'] + options['profile_requests'] + options['load_requests']
+        scenarios = self.scenarios(per_route)
+        if options['routes']:
+            scenarios = [scenario for scenario in scenarios if scenario[0] in options['routes']]
+
+        environ = {'CHAPA_BASE_URL': None, 'CHAPA_SECRET_KEY': config('CHAPA_SECRET_KEY', default='') or 'bench'}
+        eager = current_app.conf.task_always_eager
+        with ChapaStubServer(latency=options['chapa_latency']) as stub, override_settings(
+            ALLOWED_HOSTS=['testserver'],
+            EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+        ):
+            environ['CHAPA_BASE_URL'] = stub.base_url
+            saved = {key: os.environ.get(key) for key in environ}
+            os.environ.update(environ)
+            # Celery tasks run inline so verification hits the stub within the request
+            current_app.conf.task_always_eager = True
+            try:
+                results = [self.run_scenario(scenario, options) for scenario in scenarios]
+            finally:
+                current_app.conf.task_always_eager = eager
+                for key, value in saved.items():
+                    if value is None:
+                        os.environ.pop(key, None)
+                    else:
+                        os.environ[key] = value
+
+        report = {
+            'meta': {
+                'commit': git_commit(),
+                'timestamp': timezone.now().isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'dataset': {
+                    'listings': Listing.objects.count(),
+                    'bookings': Booking.objects.count(),
+                    'payments': Payment.objects.count(),
+                },
+                'options': {
+                    key: options[key]
+                    for key in ('requests', 'profile_requests', 'load_requests', 'threads', 'chapa_latency', 'seed')
+                },
+            },
+            'routes': results,
+        }
+
+        self.print_table(results)
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                json.dump(report, fh, indent=2)
+            self.stdout.write(f"Wrote {options['output']}")
+        if options['compare']:
+            self.compare(results, options['compare'], options['threshold'])
+
+    ### FIXTURES ###
+
+    def fixture_bookings(self, count, with_payments=False):
+        """Fresh bookings (optionally with PENDING payments) far beyond any seeded stay"""
+        horizon = date.today() + timedelta(days=FIXTURE_HORIZON_DAYS)
+        bookings = []
+        for _ in range(count):
+            n = next(self.fixture_counter)
+            start = horizon + timedelta(days=10 * (n // len(self.listing_ids)))
+            bookings.append(Booking(
+                listing_id=self.listing_ids[n % len(self.listing_ids)],
+                user=self.user,
+                start_date=start,
+                end_date=start + timedelta(days=3),
+                total_price=300,
+            ))
+        bookings = Booking.objects.bulk_create(bookings)
+        if bookings and bookings[0].pk is None:
+            bookings = list(Booking.objects.filter(user=self.user).order_by('-id')[:count])[::-1]
+        if not with_payments:
+            return bookings
+        payments = [
+            Payment(
+                booking=booking,
+                transaction_id=f'BENCH_TXN_{self.run_id}_{booking.id}',
+                chapa_tx_ref=f'BENCH_TX_REF_{self.run_id}_{booking.id}',
+                amount=booking.total_price,
+            )
+            for booking in bookings
+        ]
+        Payment.objects.bulk_create(payments)
+        return payments
+
+    def next_stay(self):
+        """A listing and dates no other benchmark request will ask for"""
+        n = next(self.fixture_counter)
+        start = date.today() + timedelta(days=2 * FIXTURE_HORIZON_DAYS + 10 * (n // len(self.listing_ids)))
+        return self.listing_ids[n % len(self.listing_ids)], start, start + timedelta(days=3)
+
+    ### SCENARIOS ###
+
+    def scenarios(self, per_route):
+        """(name, method, build) triples; build(i) returns (path, body, headers) for the i-th call"""
+        today = date.today()
+
+        def pick(ids, i):
+            return ids[i % len(ids)]
+
+        def with_query(name, params):
+            return f'{reverse(name)}?{urlencode(params)}'
+
+        def booking_body(i):
+            listing_id, start, end = self.next_stay()
+            return {'listing': listing_id, 'start_date': str(start), 'end_date': str(end)}
+
+        def webhook(tx_ref):
+            body = json.dumps({'tx_ref': tx_ref}).encode()
+            secret = config('CHAPA_WEBHOOK_SECRET', default='')
+            headers = {'HTTP_CHAPA_SIGNATURE': hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()} if secret else {}
+            return body, headers
+
+        scenarios = [
+            ('listing-list', 'GET', lambda i: (reverse('listing-list-create'), None, {})),
+            ('listing-list-rating', 'GET', lambda i: (with_query('listing-list-create', {'ordering': 'rating'}), None, {})),
+            ('listing-availability-search', 'GET', lambda i: (with_query('listing-availability-search', {
+                'start_date': str(today + timedelta(days=i % 60)),
+                'end_date': str(today + timedelta(days=i % 60 + 4)),
+            }), None, {})),
+            ('listing-search', 'GET', lambda i: (with_query('listing-search', {
+                'q': ['villa', 'mountain cabin', 'beachfront', 'city loft'][i % 4], 'is_available': 'true',
+            }), None, {})),
+            ('listing-detail', 'GET', lambda i: (reverse('listing-detail', args=[pick(self.listing_ids, i)]), None, {})),
+            ('booking-list', 'GET', lambda i: (reverse('booking-list-create'), None, {})),
+            ('booking-create', 'POST', lambda i: (reverse('booking-list-create'), booking_body(i), {})),
+            ('booking-bulk-create', 'POST', lambda i: (
+                reverse('booking-bulk-create'), [booking_body(i) for _ in range(20)], {}
+            )),
+            ('payment-list', 'GET', lambda i: (reverse('payment-list'), None, {})),
+        ]
+        if self.booking_ids:
+            scenarios.append(
+                ('booking-detail', 'GET', lambda i: (reverse('booking-detail', args=[pick(self.booking_ids, i)]), None, {}))
+            )
+        if self.payment_ids:
+            scenarios.append(
+                ('payment-detail', 'GET', lambda i: (reverse('payment-detail', args=[pick(self.payment_ids, i)]), None, {}))
+            )
+
+        # Payment routes each consume one fresh booking or PENDING payment per request
+        unpaid = [booking.id for booking in self.fixture_bookings(per_route)]
+        unpaid_async = [booking.id for booking in self.fixture_bookings(per_route)]
+        pending = [payment.chapa_tx_ref for payment in self.fixture_bookings(per_route, with_payments=True)]
+        pending_async = [payment.chapa_tx_ref for payment in self.fixture_bookings(per_route, with_payments=True)]
+        pending_webhook = [payment.chapa_tx_ref for payment in self.fixture_bookings(per_route, with_payments=True)]
+        return_url = 'https://example.com/return'
+
+        scenarios += [
+            ('initiate-payment', 'POST', lambda i: (
+                reverse('initiate-payment'), {'booking_id': unpaid[i], 'return_url': return_url}, {}
+            )),
+            ('verify-payment', 'POST', lambda i: (reverse('verify-payment', args=[pending[i]]), None, {})),
+            ('chapa-webhook', 'POST', lambda i: (reverse('chapa-webhook'), *webhook(pending_webhook[i]))),
+            ('initiate-payment-async', 'POST', lambda i: (
+                reverse('initiate-payment-async'), {'booking_id': unpaid_async[i], 'return_url': return_url}, {}
+            )),
+            ('verify-payment-async', 'POST', lambda i: (
+                reverse('verify-payment-async', args=[pending_async[i]]), None, {}
+            )),
+        ]
+        return scenarios
+
+    ### RUNNER ###
+
+    def client(self):
+        client = Client(raise_request_exception=False)
+        client.force_login(self.user)
+        return client
+
+    def call(self, client, method, build, i):
+        path, body, headers = build(i)
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body)
+        began = time.perf_counter()
+        response = client.generic(method, path, data=body or '', content_type='application/json', **headers)
+        # Streaming responses are only done once fully consumed
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return (time.perf_counter() - began) * 1000, response.status_code
+
+    def run_scenario(self, scenario, options):
+        name, method, build = scenario
+        self.stdout.write(f'{name}...', ending='\r')
+        statuses = {}
+        index = itertools.count()
+
+        # Start every route from a cold response cache
+        listing_cache.bump_version()
+
+        client = self.client()
+        timings, queries = [], []
+        for _ in range(options['requests']):
+            with CaptureQueriesContext(connection) as captured:
+                elapsed, code = self.call(client, method, build, next(index))
+            timings.append(elapsed)
+            queries.append(len(captured))
+            statuses[code] = statuses.get(code, 0) + 1
+
+        tracemalloc.start()
+        peak = 0
+        for _ in range(options['profile_requests']):
+            tracemalloc.reset_peak()
+            self.call(client, method, build, next(index))
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+        result = {
+            'name': name,
+            'method': method,
+            'requests': len(timings),
+            'status_codes': {str(code): n for code, n in sorted(statuses.items())},
+            'latency_ms': latency_summary(timings),
+            'queries': {
+                'mean': round(statistics.fmean(queries), 2) if queries else None,
+                'max': max(queries) if queries else None,
+            },
+            'peak_memory_kb': round(peak / 1024, 1),
+        }
+        if options['load_requests']:
+            result['load'] = self.run_load(method, build, index, options['load_requests'], options['threads'])
+        return result
+
+    def run_load(self, method, build, index, total, threads):
+        lock = threading.Lock()
+        timings, errors = [], []
+        remaining = itertools.count()
+
+        def worker():
+            client = self.client()
+            try:
+                while next(remaining) < total:
+                    try:
+                        elapsed, code = self.call(client, method, build, next(index))
+                    except Exception as e:  # keep the other threads going; count it
+                        with lock:
+                            errors.append(repr(e))
+                        continue
+                    with lock:
+                        timings.append(elapsed)
+                        if code >= 400:
+                            errors.append(code)
+            finally:
+                connections.close_all()
+
+        began = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            for future in [pool.submit(worker) for _ in range(threads)]:
+                future.result()
+        elapsed = time.perf_counter() - began
+
+        return {
+            'threads': threads,
+            'requests': len(timings),
+            'errors': len(errors),
+            'throughput_rps': round(len(timings) / elapsed, 1) if elapsed else None,
+            'latency_ms': latency_summary(timings),
+        }
+
+    ### REPORTING ###
+
+    def print_table(self, results):
+        self.stdout.write(
+            f"{'route':<28} {'p50':>8} {'p95':>8} {'p99':>8} {'queries':>8} {'peak KB':>9} {'load rps':>9} {'load p95':>9} {'errors':>7}"
+        )
+        for result in results:
+            latency, load = result['latency_ms'], result.get('load', {})
+            self.stdout.write(
+                f"{result['name']:<28} {latency['p50'] or 0:>8.2f} {latency['p95'] or 0:>8.2f} {latency['p99'] or 0:>8.2f} "
+                f"{result['queries']['mean'] or 0:>8.1f} {result['peak_memory_kb']:>9.1f} "
+                f"{load.get('throughput_rps') or 0:>9.1f} {(load.get('latency_ms') or {}).get('p95') or 0:>9.2f} "
+                f"{load.get('errors', 0):>7}"
+            )
+
+    def compare(self, results, baseline_path, threshold):
+        with open(baseline_path) as fh:
+            baseline = {route['name']: route for route in json.load(fh)['routes']}
+
+        regressions = []
+        for result in results:
+            before = baseline.get(result['name'])
+            if not before:
+                continue
+            old, new = before['latency_ms']['p95'], result['latency_ms']['p95']
+            change = (new - old) / old if old else 0
+            queries_before, queries_now = before['queries']['max'], result['queries']['max']
+            flag = change > threshold or (queries_now or 0) > (queries_before or 0)
+            self.stdout.write(
+                f"{result['name']:<28} p95 {old:.2f} -> {new:.2f}ms ({change:+.0%}) "
+                f"queries {queries_before} -> {queries_now}" + ('  REGRESSION' if flag else '')
+            )
+            if flag:
+                regressions.append(result['name'])
+
+        if regressions:
+            raise CommandError(f"Regressed against {baseline_path}: {', '.join(regressions)}")
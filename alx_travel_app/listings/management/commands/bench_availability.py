@@ -0,0 +1,96 @@
+from datetime import date, timedelta
+import random
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from listings.availability import available_listings
+from listings.models import Listing, Booking
+
+LOCATIONS = [
+    'Cape Town, South Africa',
+    'Drakensberg, South Africa',
+    'Johannesburg, South Africa',
+    'Durban, South Africa',
+    'Addis Ababa, Ethiopia',
+    'Nairobi, Kenya',
+]
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the availability search against a large synthetic booking table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--listings', type=int, default=10000)
+        parser.add_argument('--bookings', type=int, default=1000000)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--skip-seed', action='store_true', help='Reuse the data already in the database')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+
+        if not options['skip_seed']:
+            self.seed(rng, options['listings'], options['bookings'], options['batch_size'])
+
+        timings = []
+        horizon = date.today()
+        for _ in range(options['queries']):
+            start = horizon + timedelta(days=rng.randint(0, 365))
+            end = start + timedelta(days=rng.randint(1, 14))
+            location = rng.choice(LOCATIONS)
+
+            began = time.perf_counter()
+            list(available_listings(Listing.objects.all(), start, end, location=location).values_list('id', flat=True)[:50])
+            timings.append((time.perf_counter() - began) * 1000)
+
+        timings.sort()
+        self.stdout.write(
+            f"bookings={Booking.objects.count()} queries={len(timings)} "
+            f"p50={statistics.median(timings):.2f}ms "
+            f"p95={timings[int(len(timings) * 0.95) - 1]:.2f}ms "
+            f"max={timings[-1]:.2f}ms"
+        )
+
+    def seed(self, rng, listing_count, booking_count, batch_size):
+        user, _ = User.objects.get_or_create(username='benchuser')
+
+        with transaction.atomic():
+            Listing.objects.bulk_create(
+                [
+                    Listing(
+                        title=f'Bench listing {i}',
+                        description='Benchmark listing',
+                        location=rng.choice(LOCATIONS),
+                        price_per_night=rng.randint(40, 400),
+                        owner=user,
+                    )
+                    for i in range(listing_count)
+                ],
+                batch_size=batch_size,
+            )
+        listing_ids = list(Listing.objects.values_list('id', flat=True))
+
+        today = date.today()
+        created = 0
+        while created < booking_count:
+            batch = []
+            for _ in range(min(batch_size, booking_count - created)):
+                start = today + timedelta(days=rng.randint(-365, 365))
+                batch.append(Booking(
+                    listing_id=rng.choice(listing_ids),
+                    user=user,
+                    start_date=start,
+                    end_date=start + timedelta(days=rng.randint(1, 10)),
+                    total_price=100,
+                    status=rng.choice(['PENDING', 'CONFIRMED', 'CANCELLED']),
+                ))
+            with transaction.atomic():
+                Booking.objects.bulk_create(batch)
+            created += len(batch)
+            self.stdout.write(f'Seeded {created}/{booking_count} bookings', ending='\r')
+        self.stdout.write('')
@@ -0,0 +1,71 @@
+from datetime import timedelta
+import random
+import statistics
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from listings.availability import BATCH_MAX_LISTINGS, batch_availability, overlapping_bookings
+from listings.models import Listing
+from listings.pricing import quote_stays
+
+
+def per_listing(listing_ids, start_date, end_date):
+    """The one-listing-at-a-time lookup a client would otherwise make per result card"""
+    results = []
+    for listing_id in listing_ids:
+        listing = Listing.objects.filter(id=listing_id).values('id', 'is_available').first()
+        if listing is None:
+            continue
+        clashes = overlapping_bookings(start_date, end_date).filter(listing_id=listing_id).exists()
+        quote, = quote_stays([(listing_id, start_date, end_date)])
+        results.append((listing['is_available'] and not clashes, quote))
+    return results
+
+
+class Command(BaseCommand):
+    help = 'Shows the batch availability lookup keeps a fixed query count as the batch grows (run after seed)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1,10,50,100,250,500', help='Comma-separated batch sizes')
+        parser.add_argument('--repeat', type=int, default=20, help='Timed runs per batch size')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        if max(sizes) > BATCH_MAX_LISTINGS:
+            raise CommandError(f'Batches are limited to {BATCH_MAX_LISTINGS} listings')
+        listing_ids = list(Listing.objects.values_list('id', flat=True))
+        if len(listing_ids) < max(sizes):
+            raise CommandError(f'Need at least {max(sizes)} listings; run `manage.py seed` first')
+
+        rng = random.Random(options['seed'])
+        start = timezone.localdate() + timedelta(days=14)
+        end = start + timedelta(days=4)
+        for size in sizes:
+            ids = rng.sample(listing_ids, size)
+
+            cache.clear()
+            cold_queries, cold_ms = self.measure(batch_availability, ids, start, end)
+            warm_queries, _ = self.measure(batch_availability, ids, start, end)
+            timings = [self.measure(batch_availability, ids, start, end)[1] for _ in range(options['repeat'])]
+
+            cache.clear()
+            loop_queries, loop_ms = self.measure(per_listing, ids, start, end)
+
+            self.stdout.write(
+                f'size={size} queries cold={cold_queries} warm={warm_queries} '
+                f'cold={cold_ms:.2f}ms p50={statistics.median(timings):.2f}ms '
+                f'per-listing queries={loop_queries} per-listing={loop_ms:.2f}ms'
+            )
+
+    def measure(self, lookup, *args):
+        with CaptureQueriesContext(connection) as queries:
+            began = time.perf_counter()
+            lookup(*args)
+            elapsed = (time.perf_counter() - began) * 1000
+        return len(queries), elapsed
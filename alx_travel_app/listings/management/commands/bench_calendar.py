@@ -0,0 +1,73 @@
+from datetime import timedelta
+import random
+import statistics
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from listings.availability import BLOCKING_STATUSES
+from listings.models import Booking, Listing, ListingOccupancy
+from listings.occupancy import calendar_months, month_end
+
+
+def expand_bookings(listing_id, month, months):
+    """The calendar without a bitmap: every booking of the listing, expanded night by night"""
+    if not Listing.objects.filter(pk=listing_id).exists():
+        return None
+    booked = set()
+    for start_date, end_date in Booking.objects.filter(
+        listing_id=listing_id, status__in=BLOCKING_STATUSES,
+    ).values_list('start_date', 'end_date'):
+        booked.update(start_date + timedelta(days=i) for i in range((end_date - start_date).days))
+    end_date = month
+    for _ in range(months):
+        end_date = month_end(end_date)
+    return [month + timedelta(days=i) in booked for i in range((end_date - month).days)]
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks /listings/<pk>/calendar/ month views against expanding bookings (run after seed)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--listings', type=int, default=200, help='Busiest listings to sample')
+        parser.add_argument('--months', type=int, default=1)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        listing_ids = list(
+            Booking.objects.values('listing_id').annotate(bookings=Count('id'))
+            .order_by('-bookings').values_list('listing_id', flat=True)[:options['listings']]
+        )
+        if not listing_ids:
+            raise CommandError('No bookings; run `manage.py seed` first')
+        random.Random(options['seed']).shuffle(listing_ids)
+        month = timezone.localdate().replace(day=1)
+        months = options['months']
+
+        ListingOccupancy.objects.filter(listing_id__in=listing_ids).delete()
+        cache.clear()
+        self.report('bitmap build', [self.measure(calendar_months, pk, month, months) for pk in listing_ids])
+        cache.clear()
+        self.report('bitmap row', [self.measure(calendar_months, pk, month, months) for pk in listing_ids])
+        self.report('bitmap cached', [self.measure(calendar_months, pk, month, months) for pk in listing_ids])
+        self.report('expand', [self.measure(expand_bookings, pk, month, months) for pk in listing_ids])
+
+    def measure(self, lookup, *args):
+        with CaptureQueriesContext(connection) as queries:
+            began = time.perf_counter()
+            lookup(*args)
+            elapsed = (time.perf_counter() - began) * 1000
+        return elapsed, len(queries)
+
+    def report(self, label, samples):
+        timings = sorted(elapsed for elapsed, _ in samples)
+        self.stdout.write(
+            f"{label:<14} queries={max(count for _, count in samples)} "
+            f"p50={statistics.median(timings):.3f}ms "
+            f"p95={timings[int(len(timings) * 0.95) - 1]:.3f}ms"
+        )
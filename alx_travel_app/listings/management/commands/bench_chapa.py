@@ -0,0 +1,53 @@
+import statistics
+import time
+import uuid
+
+import requests
+from django.core.management.base import BaseCommand
+
+from listings.chapa_service import ChapaService
+from testing.chapa_stub import ChapaStubServer
+
+
+def summarize(label, timings):
+    timings = sorted(timings)
+    return (
+        f"{label:<10} calls={len(timings)} "
+        f"mean={statistics.fmean(timings):.2f}ms "
+        f"p50={statistics.median(timings):.2f}ms "
+        f"p95={timings[int(len(timings) * 0.95) - 1]:.2f}ms"
+    )
+
+
+class Command(BaseCommand):
+    help = 'Compares per-call Chapa latency with and without the pooled session against a local stub'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calls', type=int, default=500)
+        parser.add_argument('--latency', type=float, default=0.0, help='Artificial gateway latency in seconds')
+
+    def handle(self, *args, **options):
+        with ChapaStubServer(latency=options['latency']) as stub:
+            service = ChapaService()
+            service.base_url = stub.base_url
+
+            unpooled = self.run(options['calls'], lambda tx_ref: requests.get(
+                f'{stub.base_url}/transaction/verify/{tx_ref}', headers=service.headers, timeout=service.timeout
+            ))
+            pooled = self.run(options['calls'], service.verify_payment)
+
+        self.stdout.write(summarize('unpooled', unpooled))
+        self.stdout.write(summarize('pooled', pooled))
+        self.stdout.write(
+            f"speedup={statistics.fmean(unpooled) / statistics.fmean(pooled):.2f}x "
+            "(plain HTTP stub; TLS handshakes saved against the real gateway widen the gap)"
+        )
+
+    def run(self, calls, verify):
+        timings = []
+        for _ in range(calls):
+            tx_ref = f'ALX_TRAVEL_BENCH_{uuid.uuid4().hex[:8]}'
+            began = time.perf_counter()
+            verify(tx_ref)
+            timings.append((time.perf_counter() - began) * 1000)
+        return timings
@@ -0,0 +1,126 @@
+import socketserver
+import threading
+import time
+
+from django.conf import settings
+from django.core.mail import get_connection, send_mail
+from django.core.management.base import BaseCommand
+from django.utils.html import strip_tags
+
+from listings.tasks import build_confirmation_message
+
+
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP to accept and discard messages"""
+    disable_nagle_algorithm = True
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.reply('220 localhost ESMTP sink')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            if command == b'EHLO':
+                self.reply('250-localhost')
+                self.reply('250 8BITMIME')
+            elif command == b'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                self.reply('250 OK')
+            elif command == b'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('250 OK')
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def legacy_message(booking_id, user_name, listing_title, start_date, end_date, total_price):
+    """The f-string + strip_tags rendering send_booking_confirmation_email used before templates"""
+    html_message = f"""
+        <html>
+        <body>
+            <h2>Booking Confirmation</h2>
+            <p>Dear {user_name},</p>
+            <p>Your booking has been confirmed! Here are the details:</p>
+            <ul>
+                <li><strong>Property:</strong> {listing_title}</li>
+                <li><strong>Check-in:</strong> {start_date}</li>
+                <li><strong>Check-out:</strong> {end_date}</li>
+                <li><strong>Total Price:</strong> ${total_price}</li>
+                <li><strong>Booking ID:</strong> {booking_id}</li>
+            </ul>
+            <p>Thank you for choosing ALX Travel App!</p>
+            <p>Best regards,<br>ALX Travel Team</p>
+        </body>
+        </html>
+        """
+    return html_message, strip_tags(html_message)
+
+
+class Command(BaseCommand):
+    help = 'Measures confirmation email throughput: one connection per email vs one batched connection'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        rows = [
+            (i, f'guest{i}@example.com', f'Guest {i}', f'Listing {i % 50}', '2030-01-01', '2030-01-05', '400.00')
+            for i in range(options['count'])
+        ]
+
+        sink = SMTPSink(('127.0.0.1', 0), SMTPSinkHandler)
+        threading.Thread(target=sink.serve_forever, daemon=True).start()
+        smtp = {
+            'backend': 'django.core.mail.backends.smtp.EmailBackend',
+            'host': '127.0.0.1',
+            'port': sink.server_address[1],
+            'use_tls': False,
+            'username': '',
+            'password': '',
+        }
+
+        try:
+            for label, connection_kwargs in [
+                ('locmem', {'backend': 'django.core.mail.backends.locmem.EmailBackend'}),
+                ('local smtp', smtp),
+            ]:
+                per_message = self.per_message(rows, connection_kwargs)
+                batched = self.batched(rows, connection_kwargs)
+                self.stdout.write(
+                    f'{label:<11} per-message: {len(rows) / per_message:.0f} emails/s  '
+                    f'batched: {len(rows) / batched:.0f} emails/s'
+                )
+        finally:
+            sink.shutdown()
+            sink.server_close()
+
+    def per_message(self, rows, connection_kwargs):
+        began = time.perf_counter()
+        for booking_id, email, name, title, start_date, end_date, total_price in rows:
+            html_message, plain_message = legacy_message(booking_id, name, title, start_date, end_date, total_price)
+            send_mail(
+                subject=f'Booking Confirmation - {title}',
+                message=plain_message,
+                from_email=settings.DEFAULT_FROM_EMAIL,
+                recipient_list=[email],
+                html_message=html_message,
+                connection=get_connection(**connection_kwargs),
+            )
+        return time.perf_counter() - began
+
+    def batched(self, rows, connection_kwargs):
+        began = time.perf_counter()
+        with get_connection(**connection_kwargs) as connection:
+            connection.send_messages([build_confirmation_message(*row, connection=connection) for row in rows])
+        return time.perf_counter() - began
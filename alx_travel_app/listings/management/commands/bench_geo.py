@@ -0,0 +1,115 @@
+import heapq
+import random
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from listings.geo import bounding_box, grid_cell, haversine_km, nearest_within
+from listings.models import Listing
+
+# Cities listings cluster around, with how many degrees they spread
+CLUSTERS = [
+    ((-33.92, 18.42), 0.4),
+    ((-26.20, 28.05), 0.5),
+    ((-29.86, 31.02), 0.3),
+    ((9.03, 38.74), 0.4),
+    ((-1.29, 36.82), 0.4),
+    ((30.04, 31.24), 0.5),
+    ((6.52, 3.38), 0.5),
+]
+# Share of listings scattered over the whole continent instead
+RURAL_SHARE = 0.2
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks grid-indexed radius search against a plain latitude/longitude box scan'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--listings', type=int, default=1000000)
+        parser.add_argument('--queries', type=int, default=100)
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--skip-seed', action='store_true', help='Reuse the data already in the database')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+
+        if not options['skip_seed']:
+            self.seed(rng, options['listings'], options['batch_size'])
+
+        queries = []
+        for _ in range(options['queries']):
+            (latitude, longitude), spread = rng.choice(CLUSTERS)
+            queries.append((
+                latitude + rng.uniform(-spread, spread), longitude + rng.uniform(-spread, spread), rng.choice([2, 10, 50]),
+            ))
+
+        limit = options['page_size']
+        listings = Listing.objects.all()
+        grid = self.run(queries, lambda lat, lng, radius: nearest_within(listings, lat, lng, radius, limit))
+        scan = self.run(queries, lambda lat, lng, radius: self.box_scan(lat, lng, radius, limit))
+
+        self.stdout.write(f'listings={Listing.objects.filter(geo_cell__isnull=False).count()} queries={len(queries)}')
+        self.report('grid', grid)
+        self.report('box scan', scan)
+
+    def box_scan(self, latitude, longitude, radius_km, limit):
+        """What the search costs without geo_cell: the whole radius, filtered on raw coordinates"""
+        min_lat, max_lat, min_lng, max_lng = bounding_box(latitude, longitude, radius_km)
+        rows = Listing.objects.filter(
+            Q(latitude__range=(min_lat, max_lat)) & Q(longitude__range=(min_lng, max_lng))
+        ).values_list('id', 'latitude', 'longitude')
+        hits = (
+            (haversine_km(latitude, longitude, lat, lng), listing_id) for listing_id, lat, lng in rows.iterator()
+        )
+        return heapq.nsmallest(limit, (hit for hit in hits if hit[0] <= radius_km))
+
+    def run(self, queries, search):
+        timings = []
+        for query in queries:
+            began = time.perf_counter()
+            search(*query)
+            timings.append((time.perf_counter() - began) * 1000)
+        return sorted(timings)
+
+    def report(self, label, timings):
+        self.stdout.write(
+            f"{label:<10} p50={statistics.median(timings):.2f}ms "
+            f"p95={timings[int(len(timings) * 0.95) - 1]:.2f}ms "
+            f"max={timings[-1]:.2f}ms"
+        )
+
+    def seed(self, rng, listing_count, batch_size):
+        user, _ = User.objects.get_or_create(username='benchuser')
+
+        created = 0
+        while created < listing_count:
+            batch = []
+            for i in range(created, min(created + batch_size, listing_count)):
+                if rng.random() < RURAL_SHARE:
+                    latitude, longitude = rng.uniform(-35, 35), rng.uniform(-17, 51)
+                else:
+                    (latitude, longitude), spread = rng.choice(CLUSTERS)
+                    latitude += rng.gauss(0, spread / 2)
+                    longitude += rng.gauss(0, spread / 2)
+                batch.append(Listing(
+                    title=f'Geo bench listing {i}',
+                    description='Benchmark listing',
+                    location='Africa',
+                    price_per_night=rng.randint(40, 400),
+                    owner=user,
+                    latitude=latitude,
+                    longitude=longitude,
+                    # bulk_create skips Listing.save()
+                    geo_cell=grid_cell(latitude, longitude),
+                ))
+            with transaction.atomic():
+                Listing.objects.bulk_create(batch)
+            created += len(batch)
+            self.stdout.write(f'Seeded {created}/{listing_count} listings', ending='\r')
+        self.stdout.write('')
@@ -0,0 +1,99 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from listings.models import Listing
+from listings.search import ContainsBackend, get_backend, search_listings, search_terms
+
+LOCATIONS = [
+    'Cape Town, South Africa',
+    'Drakensberg, South Africa',
+    'Johannesburg, South Africa',
+    'Durban, South Africa',
+    'Addis Ababa, Ethiopia',
+    'Nairobi, Kenya',
+]
+KINDS = ['villa', 'cottage', 'loft', 'cabin', 'apartment', 'lodge', 'bungalow', 'studio', 'farmhouse', 'treehouse']
+FEATURES = [
+    'ocean', 'mountain', 'lake', 'garden', 'pool', 'fireplace', 'balcony', 'vineyard', 'safari', 'beach',
+    'quiet', 'central', 'rustic', 'modern', 'spacious', 'cosy', 'family', 'luxury', 'budget', 'historic',
+]
+FILLER = ['views', 'stay', 'walk', 'near', 'with', 'and', 'the', 'of', 'for', 'guests', 'kitchen', 'wifi', 'parking']
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks full-text listing search against icontains filters on a large synthetic catalogue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--listings', type=int, default=500000)
+        parser.add_argument('--queries', type=int, default=100)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--skip-seed', action='store_true', help='Reuse the data already in the database')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+
+        if not options['skip_seed']:
+            self.seed(rng, options['listings'], options['batch_size'])
+
+        queries = []
+        for _ in range(options['queries']):
+            words = rng.sample(FEATURES, rng.randint(1, 2)) + rng.sample(KINDS, rng.randint(0, 1))
+            low = rng.randint(40, 300)
+            queries.append((' '.join(words), low, low + rng.randint(50, 200)))
+
+        self.stdout.write(f'listings={Listing.objects.count()} queries={len(queries)} backend={type(get_backend(connection)).__name__}')
+        self.report('fulltext', self.run(queries, self.fulltext))
+        self.report('icontains', self.run(queries, self.icontains))
+
+    def run(self, queries, search):
+        timings = []
+        for text, min_price, max_price in queries:
+            began = time.perf_counter()
+            search(text, min_price, max_price)
+            timings.append((time.perf_counter() - began) * 1000)
+        return sorted(timings)
+
+    def fulltext(self, text, min_price, max_price):
+        return search_listings(
+            Listing.objects.all(), text, is_available=True, min_price=min_price, max_price=max_price, limit=20
+        )
+
+    def icontains(self, text, min_price, max_price):
+        # The ranked fallback, which is what search costs without an inverted index
+        return ContainsBackend().ranked_ids(connection, search_terms(text), (True, min_price, max_price), 20, 0)
+
+    def report(self, label, timings):
+        self.stdout.write(
+            f"{label:<10} p50={statistics.median(timings):.2f}ms "
+            f"p95={timings[int(len(timings) * 0.95) - 1]:.2f}ms "
+            f"max={timings[-1]:.2f}ms"
+        )
+
+    def seed(self, rng, listing_count, batch_size):
+        user, _ = User.objects.get_or_create(username='benchuser')
+
+        created = 0
+        while created < listing_count:
+            batch = []
+            for i in range(created, min(created + batch_size, listing_count)):
+                kind = rng.choice(KINDS)
+                features = rng.sample(FEATURES, 3)
+                batch.append(Listing(
+                    title=f'{features[0].title()} {kind} {i}',
+                    description=' '.join(rng.choices(FILLER + features, k=25)),
+                    location=rng.choice(LOCATIONS),
+                    price_per_night=rng.randint(40, 400),
+                    is_available=rng.random() < 0.9,
+                    owner=user,
+                ))
+            with transaction.atomic():
+                Listing.objects.bulk_create(batch)
+            created += len(batch)
+            self.stdout.write(f'Seeded {created}/{listing_count} listings', ending='\r')
+        self.stdout.write('')
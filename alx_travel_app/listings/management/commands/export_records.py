@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from listings.exports import EXPORTS, iter_export
+from listings.streaming import DEFAULT_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Streams payments or bookings (with listing and user fields) to a CSV or NDJSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(EXPORTS))
+        parser.add_argument('--output-format', choices=['csv', 'ndjson'], default='csv')
+        parser.add_argument('--output', '-o', help='File to write (default: stdout)')
+        parser.add_argument('--created-from', type=parse_date)
+        parser.add_argument('--created-to', type=parse_date)
+        parser.add_argument('--paid-from', type=parse_date, help='Payments only')
+        parser.add_argument('--paid-to', type=parse_date, help='Payments only')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        filters = {
+            key: options[key]
+            for key in ('created_from', 'created_to', 'paid_from', 'paid_to')
+            if options[key]
+        }
+        if options['kind'] != 'payments' and ('paid_from' in filters or 'paid_to' in filters):
+            raise CommandError('--paid-from/--paid-to only apply to payments')
+        chunks = iter_export(options['kind'], options['output_format'], chunk_size=options['chunk_size'], **filters)
+
+        began = time.perf_counter()
+        if options['output']:
+            with open(options['output'], 'w', newline='') as fh:
+                fh.writelines(chunks)
+            self.stderr.write(self.style.SUCCESS(
+                f"Exported {options['kind']} to {options['output']} in {time.perf_counter() - began:.2f}s"
+            ))
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
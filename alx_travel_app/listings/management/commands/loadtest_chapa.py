@@ -0,0 +1,82 @@
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import statistics
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+
+from listings.chapa_service import ChapaService, AsyncChapaService, build_gateway
+from listings.circuit import CallRejected
+from testing.chapa_stub import ChapaStubProcess
+
+
+class Command(BaseCommand):
+    help = 'Load-tests sync workers against a single async event loop calling a slow local Chapa stub'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calls', type=int, default=400)
+        parser.add_argument('--workers', type=int, default=8, help='Sync worker threads (stand-in for WSGI workers)')
+        parser.add_argument('--concurrency', type=int, default=20, help='In-flight calls on the async loop')
+        parser.add_argument('--latency', type=float, default=0.2, help='Artificial gateway latency in seconds')
+
+    def handle(self, *args, **options):
+        # Sized for the run: the shared CHAPA_MAX_CONCURRENT_CALLS bulkhead
+        # would turn most of the async calls away and measure nothing
+        gateway = build_gateway(max_concurrent=max(options['workers'], options['concurrency']))
+        with ChapaStubProcess(latency=options['latency']) as stub:
+            sync_result = self.run_sync(stub.base_url, gateway, options['calls'], options['workers'])
+            async_result = asyncio.run(self.run_async(stub.base_url, gateway, options['calls'], options['concurrency']))
+
+        self.report(f"sync ({options['workers']} workers)", *sync_result)
+        self.report(f"async (concurrency {options['concurrency']})", *async_result)
+
+    def report(self, label, elapsed, timings):
+        # Rejected calls come back as None and are reported, not timed
+        rejected = timings.count(None)
+        timings = sorted(timing for timing in timings if timing is not None)
+        line = f"{label:<28} calls={len(timings)} rejected={rejected} elapsed={elapsed:.2f}s"
+        if timings:
+            line += (
+                f" throughput={len(timings) / elapsed:.1f}/s "
+                f"p50={statistics.median(timings):.1f}ms "
+                f"p95={timings[max(0, int(len(timings) * 0.95) - 1)]:.1f}ms"
+            )
+        self.stdout.write(line)
+
+    def run_sync(self, base_url, gateway, calls, workers):
+        service = ChapaService()
+        service.base_url = base_url
+        service.gateway = gateway
+
+        def verify(_):
+            began = time.perf_counter()
+            try:
+                service.verify_payment(f'ALX_TRAVEL_LOAD_{uuid.uuid4().hex[:8]}')
+            except CallRejected:
+                return None
+            return (time.perf_counter() - began) * 1000
+
+        began = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            timings = list(pool.map(verify, range(calls)))
+        return time.perf_counter() - began, timings
+
+    async def run_async(self, base_url, gateway, calls, concurrency):
+        service = AsyncChapaService()
+        service.base_url = base_url
+        service.gateway = gateway
+        gate = asyncio.Semaphore(concurrency)
+
+        async def verify():
+            async with gate:
+                began = time.perf_counter()
+                try:
+                    await service.verify_payment(f'ALX_TRAVEL_LOAD_{uuid.uuid4().hex[:8]}')
+                except CallRejected:
+                    return None
+                return (time.perf_counter() - began) * 1000
+
+        began = time.perf_counter()
+        timings = await asyncio.gather(*(verify() for _ in range(calls)))
+        return time.perf_counter() - began, timings
@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from listings.geo import grid_cell
+from listings.models import Listing
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the geo_cell of every listing, e.g. after an import that skipped save() or a grid change'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        began = time.perf_counter()
+        batch_size = options['batch_size']
+        checked = updated = 0
+        last_id = 0
+        while True:
+            # Keyset walk by id, so each batch is an index range however far in
+            batch = list(
+                Listing.objects.filter(id__gt=last_id).order_by('id')
+                .only('id', 'latitude', 'longitude', 'geo_cell')[:batch_size]
+            )
+            if not batch:
+                break
+            last_id = batch[-1].id
+            stale = []
+            for listing in batch:
+                cell = grid_cell(listing.latitude, listing.longitude)
+                if cell != listing.geo_cell:
+                    listing.geo_cell = cell
+                    stale.append(listing)
+            with transaction.atomic():
+                Listing.objects.bulk_update(stale, ['geo_cell'])
+            checked += len(batch)
+            updated += len(stale)
+            self.stdout.write(f'Checked {checked} listings', ending='\r')
+        self.stdout.write('')
+        self.stdout.write(self.style.SUCCESS(
+            f'Updated geo_cell on {updated} of {checked} listings in {time.perf_counter() - began:.2f}s'
+        ))
@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from listings.ratings import rebuild_rating_aggregates
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the denormalized rating aggregates on every listing from its reviews'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        began = time.perf_counter()
+        rebuilt = rebuild_rating_aggregates(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt rating aggregates for {rebuilt} listings in {time.perf_counter() - began:.2f}s'
+        ))
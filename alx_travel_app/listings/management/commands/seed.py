@@ -1,12 +1,242 @@
-from django.core.management.base import BaseCommand
-from django.contrib.auth.models import User
-from listings.models import Listing
+from datetime import date, timedelta
+from decimal import Decimal
+import multiprocessing
 import random
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.contrib.auth.models import User
+from django.db import connection, connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+from listings import cache as listing_cache
+from listings.geo import grid_cell
+from listings.models import Listing, Booking, Payment, Review
+from listings.ratings import rebuild_rating_aggregates
+
+# Location and the (latitude, longitude) listings there scatter around
+LOCATIONS = {
+    'Cape Town, South Africa': (-33.92, 18.42),
+    'Drakensberg, South Africa': (-29.13, 29.40),
+    'Johannesburg, South Africa': (-26.20, 28.05),
+    'Durban, South Africa': (-29.86, 31.02),
+    'Addis Ababa, Ethiopia': (9.03, 38.74),
+    'Nairobi, Kenya': (-1.29, 36.82),
+}
+# Listings fall within this many degrees of their location's centre
+SCATTER_DEGREES = 0.3
+KINDS = ['Villa', 'Cottage', 'Loft', 'Cabin', 'Apartment', 'Lodge', 'Bungalow', 'Studio', 'Farmhouse']
+FEATURES = ['Beachfront', 'Mountain', 'Lakeside', 'Garden', 'City', 'Safari', 'Vineyard', 'Historic', 'Modern']
+BOOKING_STATUSES = (['CONFIRMED'] * 6) + (['PENDING'] * 2) + ['CANCELLED']
+PAYMENT_STATUS = {'CONFIRMED': 'COMPLETED', 'PENDING': 'PENDING', 'CANCELLED': 'CANCELLED'}
+
+
+def share(total, parts, index):
+    """Rows of `total` that fall to part `index` when spread evenly, and the rows before it"""
+    base, extra = divmod(total, parts)
+    return base + (index < extra), index * base + min(index, extra)
+
+
+def job_rng(plan, kind, chunk):
+    # Seeding per chunk keeps output identical whatever the worker count
+    return random.Random(f"{plan['seed']}:{kind}:{chunk}")
+
+
+def seed_users(plan, chunk):
+    first = chunk * plan['chunk_size']
+    last = min(first + plan['chunk_size'], plan['users'])
+    users = [
+        User(
+            id=plan['user_base'] + i,
+            username=f"seed_user_{plan['user_base'] + i}",
+            email=f"seed_user_{plan['user_base'] + i}@example.com",
+            password=plan['password'],
+        )
+        for i in range(first, last)
+    ]
+    with transaction.atomic():
+        User.objects.bulk_create(users)
+    return {'users': len(users)}
+
+
+def seed_listings(plan, chunk):
+    """A chunk of listings together with their bookings, payments and reviews"""
+    rng = job_rng(plan, 'listings', chunk)
+    first = chunk * plan['chunk_size']
+    last = min(first + plan['chunk_size'], plan['listings'])
+    now = timezone.now()
+
+    listings, bookings, payments, reviews = [], [], [], []
+    for i in range(first, last):
+        price = Decimal(rng.randint(40, 400))
+        location = rng.choice(list(LOCATIONS))
+        latitude, longitude = (
+            round(centre + rng.uniform(-SCATTER_DEGREES, SCATTER_DEGREES), 6) for centre in LOCATIONS[location]
+        )
+        listing = Listing(
+            id=plan['listing_base'] + i,
+            title=f'{rng.choice(FEATURES)} {rng.choice(KINDS)} {plan["listing_base"] + i}',
+            description=f'Synthetic listing {i} for capacity planning.',
+            location=location,
+            price_per_night=price,
+            owner_id=plan['user_base'] + rng.randrange(plan['users']),
+            is_available=rng.random() < 0.9,
+            latitude=latitude,
+            longitude=longitude,
+            # bulk_create skips Listing.save()
+            geo_cell=grid_cell(latitude, longitude),
+        )
+        listings.append(listing)
+
+        # Back-to-back stays with random gaps never overlap within a listing
+        count, offset = share(plan['bookings'], plan['listings'], i)
+        day = plan['start_date'] + timedelta(days=rng.randint(0, 7))
+        for n in range(count):
+            index = offset + n
+            nights = rng.randint(1, 7)
+            booking = Booking(
+                id=plan['booking_base'] + index,
+                listing_id=listing.id,
+                user_id=plan['user_base'] + rng.randrange(plan['users']),
+                start_date=day,
+                end_date=day + timedelta(days=nights),
+                total_price=price * nights,
+                status=rng.choice(BOOKING_STATUSES),
+            )
+            bookings.append(booking)
+            day = booking.end_date + timedelta(days=rng.randint(0, 5))
+
+            # Exactly `payments` of the bookings get one, spread evenly
+            if (index + 1) * plan['payments'] // plan['bookings'] > index * plan['payments'] // plan['bookings']:
+                payment_status = PAYMENT_STATUS[booking.status]
+                payments.append(Payment(
+                    booking_id=booking.id,
+                    transaction_id=f'SEED_TXN_{booking.id}',
+                    chapa_tx_ref=f'SEED_TX_REF_{booking.id}',
+                    amount=booking.total_price,
+                    status=payment_status,
+                    payment_method='telebirr' if payment_status == 'COMPLETED' else None,
+                    paid_at=now if payment_status == 'COMPLETED' else None,
+                ))
+
+        count, _ = share(plan['reviews'], plan['listings'], i)
+        for reviewer in rng.sample(range(plan['users']), min(count, plan['users'])):
+            reviews.append(Review(
+                listing_id=listing.id,
+                user_id=plan['user_base'] + reviewer,
+                rating=rng.choices([1, 2, 3, 4, 5], weights=[1, 1, 3, 6, 6])[0],
+                comment='Synthetic review',
+            ))
+
+    batch_size = plan['batch_size']
+    with transaction.atomic():
+        Listing.objects.bulk_create(listings, batch_size=batch_size)
+        Booking.objects.bulk_create(bookings, batch_size=batch_size)
+        Payment.objects.bulk_create(payments, batch_size=batch_size)
+        # Bypasses Review.save(); aggregates are rebuilt once at the end
+        Review.objects.bulk_create(reviews, batch_size=batch_size)
+    return {'listings': len(listings), 'bookings': len(bookings), 'payments': len(payments), 'reviews': len(reviews)}
+
+
+def run_job(job):
+    func, plan, chunk = job
+    return func(plan, chunk)
+
+
+def close_connections():
+    # Forked workers must not share the parent's database sockets
+    connections.close_all()
+
 
 class Command(BaseCommand):
-    help = 'Seeds the database with sample listings'
+    help = 'Seeds the database with sample listings, or a large deterministic synthetic dataset'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=0)
+        parser.add_argument('--listings', type=int, default=0)
+        parser.add_argument('--bookings', type=int, default=0)
+        parser.add_argument('--payments', type=int, default=0, help='At most one per booking')
+        parser.add_argument('--reviews', type=int, default=0, help='At most one per user per listing')
+        parser.add_argument('--seed', type=int, default=42, help='Same seed and volumes give the same rows')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Users or listings per transaction')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per INSERT statement')
+        parser.add_argument('--workers', type=int, default=1, help='Parallel worker processes (not used on SQLite)')
+        parser.add_argument('--start-date', type=date.fromisoformat, default=None,
+                            help='First booking date (default: one year ago today)')
+
+    def handle(self, *args, **options):
+        if not any(options[kind] for kind in ('users', 'listings', 'bookings', 'payments', 'reviews')):
+            return self.seed_samples()
+        self.seed_volume(options)
+
+    def seed_volume(self, options):
+        if options['listings'] and not options['users']:
+            raise CommandError('--listings needs at least one --users to own them')
+        if (options['bookings'] or options['reviews']) and not options['listings']:
+            raise CommandError('--bookings and --reviews need --listings')
+        if options['payments'] > options['bookings']:
+            raise CommandError('--payments cannot exceed --bookings')
+        if options['reviews'] > options['listings'] * options['users']:
+            raise CommandError('--reviews cannot exceed one per user per listing')
+
+        workers = options['workers']
+        if workers > 1 and connection.vendor == 'sqlite':
+            self.stdout.write(self.style.WARNING('SQLite allows a single writer; seeding with one process'))
+            workers = 1
+
+        plan = {
+            key: options[key]
+            for key in ('users', 'listings', 'bookings', 'payments', 'reviews', 'seed', 'chunk_size', 'batch_size')
+        }
+        plan['start_date'] = options['start_date'] or date.today() - timedelta(days=365)
+        # Everyone gets the same hash; hashing per user would dominate the run
+        plan['password'] = make_password('testpass123')
+        # Explicit primary keys let workers insert related rows without reading ids back
+        plan['user_base'] = (User.objects.aggregate(m=Max('id'))['m'] or 0) + 1
+        plan['listing_base'] = (Listing.objects.aggregate(m=Max('id'))['m'] or 0) + 1
+        plan['booking_base'] = (Booking.objects.aggregate(m=Max('id'))['m'] or 0) + 1
+
+        began = time.perf_counter()
+        totals = {}
+        for func, rows in ((seed_users, plan['users']), (seed_listings, plan['listings'])):
+            jobs = [(func, plan, chunk) for chunk in range(-(-rows // plan['chunk_size']))]
+            for counts in self.run_jobs(jobs, workers):
+                for kind, n in counts.items():
+                    totals[kind] = totals.get(kind, 0) + n
+                self.stdout.write(f'Seeded {totals}', ending='\r')
+        self.stdout.write('')
+
+        self.reset_sequences()
+        if plan['reviews']:
+            rebuild_rating_aggregates()
+        listing_cache.bump_version()
+
+        rows = sum(totals.values())
+        elapsed = time.perf_counter() - began
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {rows} rows in {elapsed:.1f}s ({rows / elapsed:.0f} rows/s) with {workers} worker(s)'
+        ))
+
+    def run_jobs(self, jobs, workers):
+        if workers <= 1:
+            yield from map(run_job, jobs)
+            return
+        close_connections()
+        context = multiprocessing.get_context('fork')
+        with context.Pool(workers, initializer=close_connections) as pool:
+            yield from pool.imap_unordered(run_job, jobs)
+
+    def reset_sequences(self):
+        # Inserting explicit ids does not advance sequences on PostgreSQL/Oracle
+        statements = connection.ops.sequence_reset_sql(no_style(), [User, Listing, Booking])
+        if statements:
+            with connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
 
-    def handle(self, *args, **kwargs):
+    def seed_samples(self):
         # Ensure at least one user exists
         if not User.objects.filter(username='testuser').exists():
             User.objects.create_user(username='testuser', password='testpass123')
@@ -49,4 +279,3 @@ class Command(BaseCommand):
             )
 
         self.stdout.write(self.style.SUCCESS('Successfully seeded the database with sample listings'))
-      
@@ -0,0 +1,165 @@
+"""
+Prometheus metrics for the listings app.
+
+Under gunicorn or Celery prefork every worker process keeps its own
+counters. Set PROMETHEUS_MULTIPROC_DIR to an empty, writable directory
+before the workers start and prometheus_client writes each process's
+samples to memory-mapped files there; the /metrics view then aggregates
+all of them. Gunicorn should call ``mark_process_dead(worker.pid)`` from
+its ``child_exit`` hook so gauges of dead workers are dropped.
+"""
+from contextlib import contextmanager
+import os
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from celery.signals import task_postrun, task_prerun, task_retry
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess,
+)
+
+VIEW_LATENCY = Histogram(
+    'listings_view_latency_seconds',
+    'Time spent in listings API views',
+    ['view', 'method', 'status'],
+)
+CHAPA_LATENCY = Histogram(
+    'listings_chapa_request_latency_seconds',
+    'Round-trip time of Chapa API calls',
+    ['operation'],
+)
+CHAPA_ERRORS = Counter(
+    'listings_chapa_errors_total',
+    'Chapa API calls that failed, by exception type',
+    ['operation', 'error'],
+)
+CIRCUIT_STATE = Gauge(
+    'listings_circuit_state',
+    'Circuit breaker state (0 closed, 1 half-open, 2 open)',
+    ['circuit'],
+    # Breakers are per process; report the worst live worker
+    multiprocess_mode='livemax',
+)
+CIRCUIT_REJECTIONS = Counter(
+    'listings_circuit_rejections_total',
+    'Calls rejected by a circuit breaker or bulkhead without being attempted',
+    ['circuit', 'reason'],
+)
+TASK_DURATION = Histogram(
+    'listings_celery_task_duration_seconds',
+    'Run time of listings Celery tasks',
+    ['task', 'state'],
+)
+TASK_RETRIES = Counter(
+    'listings_celery_task_retries_total',
+    'Retries scheduled by listings Celery tasks',
+    ['task'],
+)
+PAYMENT_TRANSITIONS = Counter(
+    'listings_payment_status_transitions_total',
+    'Payment status changes, including creation (from "none")',
+    ['from_status', 'to_status'],
+)
+LATE_CAPTURES = Counter(
+    'listings_payment_late_captures_total',
+    'Payments Chapa reported paid after they were cancelled; each needs a refund or manual confirmation',
+)
+CACHE_LOOKUPS = Counter(
+    'listings_cache_lookups_total',
+    'Listing cache reads, by entry kind and whether they hit',
+    ['kind', 'result'],
+)
+SWEEP_RECLAIMED = Counter(
+    'listings_pending_sweep_reclaimed_total',
+    'Stale PENDING rows the expiry sweeper cancelled or purged, and booked nights it released',
+    ['kind'],
+)
+
+
+@contextmanager
+def chapa_call(operation):
+    """Time one Chapa request and count it as an error if it raises"""
+    began = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        CHAPA_ERRORS.labels(operation, type(e).__name__).inc()
+        raise
+    finally:
+        CHAPA_LATENCY.labels(operation).observe(time.perf_counter() - began)
+
+
+def record_payment_transition(old_status, new_status, count=1):
+    if old_status != new_status:
+        PAYMENT_TRANSITIONS.labels(old_status or 'none', new_status).inc(count)
+
+
+### CELERY ###
+
+_task_started = {}
+
+
+def is_listings_task(sender):
+    return sender is not None and sender.name.startswith('listings.')
+
+
+@task_prerun.connect
+def start_task_timer(sender=None, task_id=None, **kwargs):
+    if is_listings_task(sender):
+        _task_started[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def observe_task_duration(sender=None, task_id=None, state=None, **kwargs):
+    began = _task_started.pop(task_id, None)
+    if began is not None:
+        TASK_DURATION.labels(sender.name, state or 'UNKNOWN').observe(time.perf_counter() - began)
+
+
+@task_retry.connect
+def count_task_retry(sender=None, **kwargs):
+    if is_listings_task(sender):
+        TASK_RETRIES.labels(sender.name).inc()
+
+
+### HTTP ###
+
+class MetricsMiddleware:
+    """Observes each request's latency under the name of the URL pattern it resolved to"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        began = time.perf_counter()
+        response = self.get_response(request)
+        self.observe(request, response, began)
+        return response
+
+    async def __acall__(self, request):
+        began = time.perf_counter()
+        response = await self.get_response(request)
+        self.observe(request, response, began)
+        return response
+
+    def observe(self, request, response, began):
+        match = getattr(request, 'resolver_match', None)
+        # Unmatched paths share one label so scanners cannot blow up cardinality
+        view = match.url_name or match.view_name if match else 'unmatched'
+        VIEW_LATENCY.labels(view, request.method, response.status_code).observe(time.perf_counter() - began)
+
+
+def render_metrics():
+    """Every metric in the Prometheus text format, as (body, content_type)"""
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -1,7 +1,14 @@
-from django.db import models
+from django.core.validators import MaxValueValidator, MinValueValidator
+from django.db import models, transaction
 from django.contrib.auth.models import User
 import uuid
 
+
+def empty_rating_histogram():
+    """Review counts for ratings 1 through 5"""
+    return [0, 0, 0, 0, 0]
+
+
 class Listing(models.Model):
     title = models.CharField(max_length=200)
     description = models.TextField()
@@ -11,13 +18,38 @@ class Listing(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_available = models.BooleanField(default=True)
+    # Denormalized from Review; maintained by listings.ratings
+    rating_avg = models.DecimalField(max_digits=3, decimal_places=2, default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_histogram = models.JSONField(default=empty_rating_histogram)
+    latitude = models.FloatField(null=True, blank=True, validators=[MinValueValidator(-90), MaxValueValidator(90)])
+    longitude = models.FloatField(null=True, blank=True, validators=[MinValueValidator(-180), MaxValueValidator(180)])
+    # Grid cell of the coordinates, set in save(); see listings.geo
+    geo_cell = models.BigIntegerField(null=True, blank=True, editable=False)
 
     class Meta:
-        ordering = ['-created_at']
+        ordering = ['-created_at', '-id']
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='listing_created_id_idx'),
+            models.Index(fields=['location', 'is_available', 'price_per_night'], name='listing_search_idx'),
+            models.Index(fields=['-rating_avg', '-rating_count', '-id'], name='listing_rating_idx'),
+            models.Index(fields=['geo_cell', 'latitude', 'longitude'], name='listing_geo_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        from .geo import grid_cell
+
+        # Writes that bypass save() (bulk_create, update) must set geo_cell themselves
+        if not {'latitude', 'longitude'} & self.get_deferred_fields():
+            self.geo_cell = grid_cell(self.latitude, self.longitude)
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None and {'latitude', 'longitude'} & set(update_fields):
+                kwargs['update_fields'] = {*update_fields, 'geo_cell'}
+        super().save(*args, **kwargs)
+
 class Booking(models.Model):
     listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name='bookings')
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='bookings')
@@ -25,6 +57,7 @@ class Booking(models.Model):
     end_date = models.DateField()
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     status = models.CharField(
         max_length=20,
         choices=[
@@ -37,6 +70,14 @@ class Booking(models.Model):
 
     class Meta:
         ordering = ['-start_date']
+        indexes = [
+            models.Index(fields=['listing', 'start_date', 'end_date', 'status'], name='booking_overlap_idx'),
+            models.Index(fields=['created_at', 'id'], name='booking_created_id_idx'),
+            # The expiry sweeper finds stale PENDING bookings by these
+            models.Index(fields=['status', 'created_at'], name='booking_status_created_idx'),
+            # Analytics rollups pick up changed rows by these
+            models.Index(fields=['updated_at'], name='booking_updated_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.listing.title} ({self.start_date} to {self.end_date})"
@@ -64,6 +105,13 @@ class Payment(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='payment_status_created_idx'),
+            # Finance exports range-scan and keyset-page on these
+            models.Index(fields=['created_at', 'id'], name='payment_created_id_idx'),
+            models.Index(fields=['paid_at', 'id'], name='payment_paid_id_idx'),
+            models.Index(fields=['updated_at'], name='payment_updated_idx'),
+        ]
     
     def __str__(self):
         return f"Payment {self.transaction_id} - {self.status}"
@@ -90,3 +138,125 @@ class Review(models.Model):
 
     def __str__(self):
         return f"{self.user.username} - {self.listing.title} ({self.rating}/5)"
+
+    def save(self, *args, **kwargs):
+        from .ratings import apply_rating_change
+
+        # The review and its listing's aggregates are written together
+        with transaction.atomic():
+            previous = None
+            if self.pk:
+                previous = Review.objects.filter(pk=self.pk).values_list('listing_id', 'rating').first()
+            super().save(*args, **kwargs)
+            if previous is None:
+                apply_rating_change(self.listing_id, added=self.rating)
+            elif previous[0] != self.listing_id:
+                apply_rating_change(previous[0], removed=previous[1])
+                apply_rating_change(self.listing_id, added=self.rating)
+            elif previous[1] != self.rating:
+                apply_rating_change(self.listing_id, removed=previous[1], added=self.rating)
+
+
+class PricingRule(models.Model):
+    """
+    Adjusts a listing's nightly rate; see listings.pricing.
+
+    SEASON applies to nights from start_date to end_date inclusive (the
+    latest-starting matching season wins), WEEKEND to Friday and Saturday
+    nights, and LENGTH_OF_STAY to the whole stay once it reaches min_nights
+    (the largest qualifying threshold wins).
+    """
+    SEASON = 'SEASON'
+    WEEKEND = 'WEEKEND'
+    LENGTH_OF_STAY = 'LENGTH_OF_STAY'
+    KIND_CHOICES = [
+        (SEASON, 'Season'),
+        (WEEKEND, 'Weekend'),
+        (LENGTH_OF_STAY, 'Length of stay'),
+    ]
+
+    listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name='pricing_rules')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    # +25.00 is a 25% surcharge, -10.00 a 10% discount
+    adjustment_percent = models.DecimalField(max_digits=5, decimal_places=2)
+    start_date = models.DateField(blank=True, null=True)
+    end_date = models.DateField(blank=True, null=True)
+    min_nights = models.PositiveSmallIntegerField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['listing', 'kind', 'id']
+        constraints = [
+            models.CheckConstraint(
+                check=models.Q(adjustment_percent__gt=-100),
+                name='pricing_adjustment_above_minus_100'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.listing_id} {self.kind} {self.adjustment_percent:+}%"
+
+class IdempotencyKey(models.Model):
+    """A completed response, replayed for repeats of the same Idempotency-Key; see listings.idempotency"""
+    key = models.CharField(max_length=255, unique=True)
+    fingerprint = models.CharField(max_length=64)
+    response_status = models.PositiveSmallIntegerField()
+    response_body = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at'], name='idempotency_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.key} -> {self.response_status}"
+
+class ListingDailyStat(models.Model):
+    """Precomputed revenue and occupancy for one occupied night; see listings.analytics"""
+    listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name='daily_stats')
+    date = models.DateField()
+    check_ins = models.PositiveSmallIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        ordering = ['listing', 'date']
+        constraints = [
+            models.UniqueConstraint(fields=['listing', 'date'], name='unique_listing_daily_stat'),
+        ]
+
+    def __str__(self):
+        return f"{self.listing_id} on {self.date}: {self.revenue}"
+
+
+class ListingOccupancy(models.Model):
+    """Bitmap of the nights held by bookings over a rolling horizon; see listings.occupancy"""
+    listing = models.OneToOneField(Listing, on_delete=models.CASCADE, primary_key=True, related_name='occupancy')
+    origin = models.DateField()
+    bits = models.BinaryField()
+
+    def __str__(self):
+        return f"{self.listing_id} from {self.origin}"
+
+
+class PendingConfirmation(models.Model):
+    """A booking whose confirmation email has not been sent yet; see listings.confirmations"""
+    booking = models.OneToOneField(Booking, on_delete=models.CASCADE, primary_key=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at'], name='confirmation_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"Confirmation for booking {self.booking_id}"
+
+
+class RollupWatermark(models.Model):
+    """How far an incremental rollup has processed, by updated_at"""
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.value}"
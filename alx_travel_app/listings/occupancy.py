@@ -0,0 +1,218 @@
+"""
+Per-listing occupancy bitmaps behind the availability calendar.
+
+Bit i of ListingOccupancy.bits is set when a PENDING or CONFIRMED booking
+holds the night of origin + i. The origin is the first of the current
+month and the bitmap covers OCCUPANCY_HORIZON_DAYS nights (400 fit in 50
+bytes), so a month view is a slice of one cached row rather than every
+booking of the listing expanded into dates.
+
+Booking writes flip the nights they take or release in their own
+transaction: save() and delete() through signals, bulk writers by calling
+record_saved or update_occupancy themselves. Every flip runs with the
+listing row locked, as booking writers already do, so flips never
+interleave. A bitmap that does not exist yet, or whose origin a new month
+has left behind, is rebuilt from bookings, also under the lock.
+"""
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .availability import BLOCKING_STATUSES, overlapping_bookings
+from .bookings import lock_listings
+from .models import ListingOccupancy
+
+# held_span() of a booking whose fields were not all loaded
+UNKNOWN = object()
+
+
+def horizon_days():
+    return getattr(settings, 'OCCUPANCY_HORIZON_DAYS', 400)
+
+
+def current_origin():
+    return timezone.localdate().replace(day=1)
+
+
+def cache_key(listing_id):
+    return f'occupancy:{listing_id}'
+
+
+def held_span(booking):
+    """(listing_id, start_date, end_date) of the nights a booking holds, or None"""
+    # Read from __dict__ so deferred fields are not fetched one by one
+    fields = booking.__dict__
+    if any(name not in fields for name in ('listing_id', 'start_date', 'end_date', 'status')):
+        return UNKNOWN
+    if fields['status'] not in BLOCKING_STATUSES:
+        return None
+    return fields['listing_id'], fields['start_date'], fields['end_date']
+
+
+def set_nights(bits, origin, start_date, end_date, held):
+    """Set or clear the nights [start_date, end_date) that fall inside the bitmap"""
+    first = max((start_date - origin).days, 0)
+    last = min((end_date - origin).days, len(bits) * 8)
+    for night in range(first, last):
+        if held:
+            bits[night >> 3] |= 1 << (night & 7)
+        else:
+            bits[night >> 3] &= ~(1 << (night & 7))
+
+
+def build_bitmaps(listing_ids, origin, days):
+    """Bitmaps of at least `days` nights from `origin` for `listing_ids`, from one query over their bookings"""
+    size = (days + 7) // 8
+    bitmaps = {listing_id: bytearray(size) for listing_id in listing_ids}
+    # The whole last byte is filled in, so every bit in the bitmap is accurate
+    spans = overlapping_bookings(origin, origin + timedelta(days=size * 8)).filter(
+        listing_id__in=listing_ids,
+    ).values_list('listing_id', 'start_date', 'end_date')
+    for listing_id, start_date, end_date in spans:
+        set_nights(bitmaps[listing_id], origin, start_date, end_date, True)
+    return bitmaps
+
+
+def update_occupancy(added=(), removed=(), stale=()):
+    """
+    Flip the nights of (listing_id, start_date, end_date) spans.
+
+    `removed` spans are cleared before `added` ones are set, so a booking
+    that moved can pass both. Listings in `stale` are rebuilt from their
+    bookings instead. Listings without a bitmap yet are skipped; theirs is
+    built on first read.
+    """
+    listing_ids = {span[0] for span in (*added, *removed)} | set(stale)
+    if not listing_ids:
+        return
+    origin = current_origin()
+    with transaction.atomic():
+        lock_listings(listing_ids)
+        rows = {row.listing_id: row for row in ListingOccupancy.objects.filter(listing_id__in=listing_ids)}
+        rebuild = [
+            listing_id for listing_id, row in rows.items()
+            if listing_id in stale or row.origin != origin
+        ]
+        bitmaps = {listing_id: bytearray(row.bits) for listing_id, row in rows.items()}
+        for spans, held in ((removed, False), (added, True)):
+            for listing_id, start_date, end_date in spans:
+                if listing_id in bitmaps:
+                    set_nights(bitmaps[listing_id], rows[listing_id].origin, start_date, end_date, held)
+        # The rebuild reads this transaction's own booking writes
+        bitmaps.update(build_bitmaps(rebuild, origin, horizon_days()))
+
+        for listing_id, row in rows.items():
+            if listing_id in rebuild:
+                row.origin = origin
+            row.bits = bytes(bitmaps[listing_id])
+        ListingOccupancy.objects.bulk_update(rows.values(), ['origin', 'bits'])
+        keys = [cache_key(listing_id) for listing_id in rows]
+        cache.delete_many(keys)
+        # Again once committed, for readers that cached the old row in between
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def record_saved(bookings):
+    """Apply what saving `bookings` changed about the nights they hold, e.g. after a bulk_update"""
+    added, removed, stale = [], [], set()
+    for booking in bookings:
+        before, after = getattr(booking, '_held_span', None), held_span(booking)
+        if before == after:
+            continue
+        if before is UNKNOWN or after is UNKNOWN:
+            stale.add(booking.listing_id)
+        else:
+            if before is not None:
+                removed.append(before)
+            if after is not None:
+                added.append(after)
+        booking._held_span = after
+    update_occupancy(added, removed, stale)
+
+
+def record_deleted(bookings):
+    """Release the nights held by deleted `bookings`"""
+    removed, stale = [], set()
+    for booking in bookings:
+        span = getattr(booking, '_held_span', None)
+        if span is UNKNOWN:
+            stale.add(booking.listing_id)
+        elif span is not None:
+            removed.append(span)
+    update_occupancy(removed=removed, stale=stale)
+
+
+def get_bitmap(listing_id):
+    """(origin, bits) for a listing, built on first use; None if the listing does not exist"""
+    origin = current_origin()
+    entry = cache.get(cache_key(listing_id))
+    if entry is not None and entry[0] == origin:
+        return entry
+
+    entry = ListingOccupancy.objects.filter(listing_id=listing_id, origin=origin).values_list('origin', 'bits').first()
+    if entry is None:
+        with transaction.atomic():
+            # Locked like any booking writer, so no flip lands between the read and the write
+            if not lock_listings([listing_id]):
+                return None
+            bits = bytes(build_bitmaps([listing_id], origin, horizon_days())[listing_id])
+            # The lock already excludes a concurrent insert, so update_or_create's savepoints are not needed
+            if not ListingOccupancy.objects.filter(listing_id=listing_id).update(origin=origin, bits=bits):
+                ListingOccupancy.objects.create(listing_id=listing_id, origin=origin, bits=bits)
+        entry = (origin, bits)
+    entry = (entry[0], bytes(entry[1]))
+    cache.set(cache_key(listing_id), entry, getattr(settings, 'OCCUPANCY_CACHE_TIMEOUT', 300))
+    return entry
+
+
+def booked_nights(listing_id, start_date, end_date):
+    """
+    One bool per night of [start_date, end_date), True where it is held.
+
+    Ranges inside the horizon are read from the bitmap; others cost one
+    query over the listing's bookings. None if the listing does not exist.
+    """
+    entry = get_bitmap(listing_id)
+    if entry is None:
+        return None
+    origin, bits = entry
+    days = (end_date - start_date).days
+    if origin <= start_date and (end_date - origin).days <= len(bits) * 8:
+        first = (start_date - origin).days
+    else:
+        origin, bits, first = start_date, build_bitmaps([listing_id], start_date, days)[listing_id], 0
+    return [bool(bits[night >> 3] & (1 << (night & 7))) for night in range(first, first + days)]
+
+
+def month_end(month):
+    """First day of the month after `month`"""
+    return (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def calendar_months(listing_id, month, months):
+    """Day-by-day occupancy of `months` months from the first of `month`; None if the listing does not exist"""
+    start_date = date(month.year, month.month, 1)
+    end_date = start_date
+    for _ in range(months):
+        end_date = month_end(end_date)
+    nights = booked_nights(listing_id, start_date, end_date)
+    if nights is None:
+        return None
+
+    result = []
+    day = start_date
+    while day < end_date:
+        following = month_end(day)
+        offset = (day - start_date).days
+        result.append({
+            'month': day.strftime('%Y-%m'),
+            'days': [
+                {'date': day + timedelta(days=i), 'booked': nights[offset + i]}
+                for i in range((following - day).days)
+            ],
+        })
+        day = following
+    return result
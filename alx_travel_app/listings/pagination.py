@@ -0,0 +1,95 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def encode_cursor(values):
+    """Encode a keyset position (one value per ordering field) as an opaque cursor"""
+    raw = json.dumps([str(value) for value in values]).encode()
+    return urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, model, fields):
+    """Decode a cursor back into typed values for the given ordering fields"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = json.loads(urlsafe_b64decode(padded.encode()).decode())
+        if not isinstance(raw, list) or len(raw) != len(fields):
+            raise ValueError(cursor)
+        return [model._meta.get_field(field).to_python(value) for field, value in zip(fields, raw)]
+    except (TypeError, ValueError, UnicodeDecodeError, ValidationError):
+        raise NotFound('Invalid cursor')
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset pagination over a descending ordering, (created_at, id) by default.
+
+    Each page is a single indexed range scan regardless of how deep the
+    client has paged, unlike OFFSET which re-reads every skipped row. The
+    ordering must end in a unique field and be backed by a matching index.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = 50
+    max_page_size = 500
+    ordering = ('created_at', 'id')
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def after(self, values):
+        """Rows strictly after `values` in descending (a, b, ...) order"""
+        condition = Q()
+        for i, field in enumerate(self.ordering):
+            step = Q(**{f'{field}__lt': values[i]})
+            for prior, value in zip(self.ordering[:i], values[:i]):
+                step &= Q(**{prior: value})
+            condition |= step
+        return condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+
+        queryset = queryset.order_by(*[f'-{field}' for field in self.ordering])
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            queryset = queryset.filter(self.after(decode_cursor(cursor, queryset.model, self.ordering)))
+
+        # Fetch one extra row to know whether another page exists
+        rows = list(queryset[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        self.next_cursor = (
+            encode_cursor([getattr(rows[-1], field) for field in self.ordering]) if self.has_next else None
+        )
+        return rows
+
+    def get_next_link(self):
+        url = self.request.build_absolute_uri()
+        if not self.next_cursor:
+            return None
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'next_cursor': self.next_cursor,
+            'results': data,
+        })
+
+
+class RatingKeysetPagination(KeysetPagination):
+    """Best-rated first, ties broken by number of reviews"""
+    ordering = ('rating_avg', 'rating_count', 'id')
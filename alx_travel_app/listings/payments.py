@@ -0,0 +1,66 @@
+"""
+Payment bookkeeping shared by the sync and async payment views.
+
+Everything here is pure model manipulation; callers decide how to talk to
+Chapa and how to persist, so both code paths stay in step.
+"""
+import uuid
+
+from django.utils import timezone
+
+CURRENCY = 'ETB'
+
+
+def new_tx_ref(booking):
+    """Generate unique transaction reference"""
+    return f"ALX_TRAVEL_{booking.id}_{uuid.uuid4().hex[:8]}"
+
+
+def initiation_kwargs(booking, tx_ref, callback_url=None, return_url=None):
+    """Arguments for ChapaService.initiate_payment for a booking"""
+    return {
+        'amount': booking.total_price,
+        'currency': CURRENCY,
+        'email': booking.user.email,
+        'first_name': booking.user.first_name or booking.user.username,
+        'last_name': booking.user.last_name or '',
+        'tx_ref': tx_ref,
+        'callback_url': callback_url,
+        'return_url': return_url,
+    }
+
+
+def payment_defaults(booking, tx_ref, checkout_url):
+    """Field values for a freshly initiated Payment"""
+    return {
+        'transaction_id': tx_ref,
+        'chapa_tx_ref': tx_ref,
+        'amount': booking.total_price,
+        'currency': CURRENCY,
+        'status': 'PENDING',
+        'checkout_url': checkout_url,
+    }
+
+
+def apply_verification(payment, chapa_data):
+    """
+    Update payment and booking status from Chapa verification data.
+
+    Returns True when the booking status changed and must be saved too.
+    """
+    chapa_status = (chapa_data.get('status') or '').lower()
+
+    if chapa_status == 'success':
+        payment.status = 'COMPLETED'
+        payment.paid_at = timezone.now()
+        payment.chapa_reference = chapa_data.get('reference')
+        payment.payment_method = chapa_data.get('method')
+        payment.booking.status = 'CONFIRMED'
+        return True
+
+    if chapa_status in ['failed', 'cancelled']:
+        payment.status = 'FAILED' if chapa_status == 'failed' else 'CANCELLED'
+        payment.booking.status = 'CANCELLED'
+        return True
+
+    return False
@@ -0,0 +1,254 @@
+"""
+Server-side stay pricing.
+
+A night costs the listing's price_per_night adjusted by its PricingRules:
+the latest-starting SEASON covering that date and, on Friday and Saturday
+nights, the WEEKEND rule. Nightly rates are precomputed into a price
+calendar of running totals in cents from the day it was built, so pricing
+any stay inside it is one subtraction rather than a walk over its nights.
+The best LENGTH_OF_STAY discount the stay qualifies for comes off last,
+then the total is converted to the requested currency.
+
+Calendars are cached per listing and deleted whenever the listing's price
+or one of its rules changes (see signals); writes that bypass save() must
+call invalidate_calendars themselves. A batch of quotes costs one cache
+get_many plus, for calendars not cached yet, one query for listings and
+one for their rules; callers that already loaded the listings skip the
+former (see quote_listings).
+"""
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal, ROUND_HALF_UP
+from itertools import accumulate
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import Listing, PricingRule
+from .payments import CURRENCY as BASE_CURRENCY
+
+CENT = Decimal('0.01')
+# date.weekday() of the nights WEEKEND rules apply to
+WEEKEND_NIGHTS = (4, 5)
+
+
+class QuoteError(Exception):
+    """A stay that cannot be priced"""
+
+
+def calendar_key(listing_id):
+    return f'pricing:calendar:{listing_id}'
+
+
+def calendar_days():
+    return getattr(settings, 'PRICING_CALENDAR_DAYS', 730)
+
+
+def exchange_rates():
+    """Units of each currency per unit of BASE_CURRENCY, from "CODE=rate" entries"""
+    rates = {BASE_CURRENCY: Decimal(1)}
+    for entry in getattr(settings, 'PRICING_EXCHANGE_RATES', []):
+        code, rate = entry.split('=')
+        rates[code.strip().upper()] = Decimal(rate.strip())
+    return rates
+
+
+def percent_factor(percent):
+    return (Decimal(100) + percent) / 100
+
+
+class PriceCalendar:
+    """Running nightly totals for one listing over [origin, origin + len(totals) - 1)"""
+    __slots__ = ('origin', 'totals', 'discounts')
+
+    def __init__(self, origin, totals, discounts):
+        self.origin = origin
+        self.totals = totals
+        # (min_nights, percent) pairs, largest threshold first
+        self.discounts = discounts
+
+    def covers(self, start_date, end_date):
+        return self.origin <= start_date and (end_date - self.origin).days < len(self.totals)
+
+    def price(self, start_date, end_date):
+        """(subtotal, discount) in base currency for the nights from start_date up to end_date"""
+        first = (start_date - self.origin).days
+        last = (end_date - self.origin).days
+        subtotal = Decimal(self.totals[last] - self.totals[first]) / 100
+        nights = last - first
+        for min_nights, percent in self.discounts:
+            if nights >= min_nights:
+                return subtotal, (subtotal * -percent / 100).quantize(CENT, rounding=ROUND_HALF_UP)
+        return subtotal, Decimal('0.00')
+
+
+def build_calendar(price_per_night, rules, origin, days):
+    """
+    Price every night of [origin, origin + days) at once.
+
+    Each season overwrites its slice of the per-night surcharge list in
+    start order, so later seasons win, and weekend nights are stepped
+    slices seven days apart; no night is visited once per rule.
+    """
+    season = [Decimal(0)] * days
+    weekend = [Decimal(0)] * days
+    discounts = []
+    for rule in sorted(rules, key=lambda rule: (rule.start_date or date.min, rule.id or 0)):
+        if rule.kind == PricingRule.SEASON:
+            first = max((rule.start_date - origin).days, 0)
+            last = min((rule.end_date - origin).days + 1, days)
+            if first < last:
+                season[first:last] = [rule.adjustment_percent] * (last - first)
+        elif rule.kind == PricingRule.WEEKEND:
+            for weekday in WEEKEND_NIGHTS:
+                first = (weekday - origin.weekday()) % 7
+                weekend[first::7] = [rule.adjustment_percent] * len(range(first, days, 7))
+        elif rule.kind == PricingRule.LENGTH_OF_STAY:
+            discounts.append((rule.min_nights, rule.adjustment_percent))
+
+    # Few distinct (season, weekend) pairs occur, so each rate is computed once
+    base = Decimal(price_per_night)
+    rates = {}
+    nightly = []
+    for pair in zip(season, weekend):
+        cents = rates.get(pair)
+        if cents is None:
+            amount = base * percent_factor(pair[0]) * percent_factor(pair[1])
+            cents = rates[pair] = int(amount.quantize(CENT, rounding=ROUND_HALF_UP) * 100)
+        nightly.append(cents)
+    discounts.sort(reverse=True)
+    return PriceCalendar(origin, list(accumulate(nightly, initial=0)), discounts)
+
+
+def load_pricing(listing_ids, prices=None):
+    """
+    ({id: price_per_night}, {id: [rules]}) for existing listings among
+    `listing_ids`, in two queries.
+
+    Callers that already loaded the listings pass {id: price_per_night} as
+    `prices`, which saves the first query.
+    """
+    if prices is None:
+        prices = dict(Listing.objects.filter(id__in=listing_ids).values_list('id', 'price_per_night'))
+    else:
+        prices = {listing_id: prices[listing_id] for listing_id in listing_ids}
+    rules = defaultdict(list)
+    for rule in PricingRule.objects.filter(listing_id__in=prices):
+        rules[rule.listing_id].append(rule)
+    return prices, rules
+
+
+def build_calendars(listing_ids, origin, days, prices=None):
+    """Calendars for existing listings among `listing_ids`, in two queries (see load_pricing)"""
+    prices, rules = load_pricing(listing_ids, prices)
+    return {
+        listing_id: build_calendar(price, rules[listing_id], origin, days)
+        for listing_id, price in prices.items()
+    }
+
+
+def get_calendars(listing_ids, prices=None):
+    """Today's calendar for each existing listing, built and cached on a miss (see build_calendars)"""
+    today = timezone.localdate()
+    keys = {calendar_key(listing_id): listing_id for listing_id in set(listing_ids)}
+    calendars = {}
+    for key, calendar in cache.get_many(keys).items():
+        # Yesterday's calendar is one night short of the horizon; rebuild it
+        if calendar.origin == today:
+            calendars[keys[key]] = calendar
+
+    missing = [listing_id for listing_id in keys.values() if listing_id not in calendars]
+    if missing:
+        built = build_calendars(missing, today, calendar_days(), prices)
+        cache.set_many(
+            {calendar_key(listing_id): calendar for listing_id, calendar in built.items()},
+            getattr(settings, 'PRICING_CALENDAR_TIMEOUT', 3600),
+        )
+        calendars.update(built)
+    return calendars
+
+
+def invalidate_calendars(listing_ids):
+    cache.delete_many([calendar_key(listing_id) for listing_id in listing_ids])
+
+
+def exchange_rate(currency):
+    """(code, rate) for a quote currency, BASE_CURRENCY by default"""
+    currency = (currency or BASE_CURRENCY).upper()
+    rate = exchange_rates().get(currency)
+    if rate is None:
+        raise QuoteError(f'Unsupported currency {currency}')
+    return currency, rate
+
+
+def quote_stays(stays, currency=None):
+    """
+    Price (listing_id, start_date, end_date) stays.
+
+    Returns one quote dict or QuoteError per stay, in order. Stays outside
+    the cached horizon (in the past or too far ahead) get a calendar of
+    their own, built from prices and rules loaded once for all of them.
+    """
+    currency, rate = exchange_rate(currency)
+    calendars = get_calendars([listing_id for listing_id, _, _ in stays])
+    outside = {
+        listing_id for listing_id, start_date, end_date in stays
+        if listing_id in calendars and not calendars[listing_id].covers(start_date, end_date)
+    }
+    if outside:
+        prices, rules = load_pricing(outside)
+    results = []
+    for listing_id, start_date, end_date in stays:
+        calendar = calendars.get(listing_id)
+        if calendar is None:
+            results.append(QuoteError('Listing not found'))
+            continue
+        if not calendar.covers(start_date, end_date):
+            if listing_id not in prices:
+                # Deleted since its cached calendar was read
+                results.append(QuoteError('Listing not found'))
+                continue
+            calendar = build_calendar(prices[listing_id], rules[listing_id], start_date, (end_date - start_date).days)
+        results.append(priced(calendar, listing_id, start_date, end_date, currency, rate))
+    return results
+
+
+def quote_listings(prices, start_date, end_date, currency=None):
+    """
+    Quote the same stay at many listings already loaded by the caller.
+
+    `prices` maps listing id to price_per_night. Costs no query when every
+    calendar is cached and one (pricing rules) otherwise, however many
+    listings there are; a range outside the horizon is priced from
+    calendars built for just that range, all at once.
+    """
+    currency, rate = exchange_rate(currency)
+    today = timezone.localdate()
+    if today <= start_date and (end_date - today).days <= calendar_days():
+        calendars = get_calendars(prices, prices)
+    else:
+        calendars = build_calendars(list(prices), start_date, (end_date - start_date).days, prices)
+    return {
+        listing_id: priced(calendar, listing_id, start_date, end_date, currency, rate)
+        for listing_id, calendar in calendars.items()
+    }
+
+
+def priced(calendar, listing_id, start_date, end_date, currency, rate):
+    subtotal, discount = calendar.price(start_date, end_date)
+    subtotal, discount = convert(subtotal, rate), convert(discount, rate)
+    return {
+        'listing': listing_id,
+        'start_date': start_date,
+        'end_date': end_date,
+        'nights': (end_date - start_date).days,
+        'currency': currency,
+        'subtotal': subtotal,
+        'discount': discount,
+        'total': subtotal - discount,
+    }
+
+
+def convert(amount, rate):
+    return (amount * rate).quantize(CENT, rounding=ROUND_HALF_UP)
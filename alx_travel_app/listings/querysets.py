@@ -0,0 +1,39 @@
+"""
+Queryset builders for the API views.
+
+Each builder joins exactly the relations its serializer reads and projects
+only the columns it renders, so list endpoints cost a constant number of
+queries however many rows they return.
+"""
+from .models import Listing, Booking, Payment
+
+LISTING_FIELDS = (
+    'id', 'title', 'description', 'location', 'price_per_night',
+    'owner', 'owner__username', 'created_at', 'updated_at', 'is_available',
+    'rating_avg', 'rating_count', 'rating_histogram', 'latitude', 'longitude',
+    # Not rendered, but saved alongside the coordinates
+    'geo_cell',
+)
+
+BOOKING_FIELDS = (
+    'id', 'listing', 'user', 'user__username', 'start_date', 'end_date',
+    'total_price', 'status', 'created_at',
+    # Not rendered, but a deferred instance only saves loaded fields and
+    # analytics rollups depend on updated_at moving
+    'updated_at',
+)
+
+
+def listing_queryset():
+    """Listings with their owner joined for ListingSerializer"""
+    return Listing.objects.select_related('owner').only(*LISTING_FIELDS)
+
+
+def booking_queryset():
+    """Bookings with their user joined for BookingSerializer"""
+    return Booking.objects.select_related('user').only(*BOOKING_FIELDS)
+
+
+def payment_queryset():
+    """Payments for PaymentSerializer; the booking is rendered from booking_id alone"""
+    return Payment.objects.all()
@@ -0,0 +1,89 @@
+"""
+Incremental maintenance of the rating aggregates stored on Listing.
+
+Each review write adjusts its listing's histogram under a row lock, and
+the average and count are derived from that histogram, so they never need
+an AVG/COUNT scan over Review.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from . import cache as listing_cache
+from .models import Listing, Review, empty_rating_histogram
+
+RATING_FIELDS = ['rating_avg', 'rating_count', 'rating_histogram', 'updated_at']
+
+
+def set_rating_fields(listing, histogram):
+    """Derive count and average from a 5-bucket histogram"""
+    count = sum(histogram)
+    total = sum(rating * n for rating, n in enumerate(histogram, start=1))
+    listing.rating_histogram = histogram
+    listing.rating_count = count
+    listing.rating_avg = (Decimal(total) / count).quantize(Decimal('0.01')) if count else Decimal('0')
+
+
+def apply_rating_change(listing_id, removed=None, added=None):
+    """Move one review out of bucket `removed` and/or into bucket `added`"""
+    with transaction.atomic():
+        try:
+            listing = Listing.objects.select_for_update().only(*RATING_FIELDS).get(pk=listing_id)
+        except Listing.DoesNotExist:
+            # The listing is being deleted along with its reviews
+            return
+        histogram = list(listing.rating_histogram or empty_rating_histogram())
+        if removed:
+            histogram[removed - 1] = max(histogram[removed - 1] - 1, 0)
+        if added:
+            histogram[added - 1] += 1
+        set_rating_fields(listing, histogram)
+        listing.save(update_fields=RATING_FIELDS)
+
+
+def _write_batch(histograms):
+    now = timezone.now()
+    listings = list(Listing.objects.filter(id__in=histograms.keys()).only(*RATING_FIELDS))
+    for listing in listings:
+        set_rating_fields(listing, histograms[listing.id])
+        # bulk_update bypasses save(), so auto_now is not applied
+        listing.updated_at = now
+    Listing.objects.bulk_update(listings, RATING_FIELDS)
+    listing_cache.invalidate_listings(histograms.keys())
+
+
+def rebuild_rating_aggregates(batch_size=1000):
+    """
+    Recompute every listing's aggregates from Review in bulk.
+
+    A single grouped query, streamed in listing order, feeds bulk_update one
+    batch of listings at a time. Returns the number of listings with reviews.
+    """
+    grouped = (
+        Review.objects.values_list('listing_id', 'rating')
+        .annotate(n=Count('id'))
+        .order_by('listing_id')
+    )
+    rebuilt = 0
+
+    with transaction.atomic():
+        reset = Listing.objects.filter(rating_count__gt=0).update(
+            rating_avg=0, rating_count=0, rating_histogram=empty_rating_histogram()
+        )
+        if reset:
+            listing_cache.bump_version()
+
+        histograms = {}
+        for listing_id, rating, n in grouped.iterator(chunk_size=batch_size):
+            if listing_id not in histograms and len(histograms) >= batch_size:
+                _write_batch(histograms)
+                rebuilt += len(histograms)
+                histograms = {}
+            histograms.setdefault(listing_id, empty_rating_histogram())[rating - 1] = n
+        if histograms:
+            _write_batch(histograms)
+            rebuilt += len(histograms)
+
+    return rebuilt
@@ -0,0 +1,193 @@
+"""
+Full-text search over listing title, description and location.
+
+MySQL answers queries from a FULLTEXT index on the three columns. SQLite
+(tests, local development) uses an FTS5 external-content table that
+triggers keep in step with listings_listing. Any other database, or a
+SQLite build without FTS5, falls back to ranked icontains filters.
+
+Backends only return (id, relevance) pairs for one page, with the price
+and availability filters applied in the same statement; the listings
+themselves are then loaded with a single IN query.
+"""
+import re
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.db.utils import DatabaseError
+
+from .models import Listing
+
+FULLTEXT_INDEX_NAME = 'listing_fulltext_idx'
+FTS_TABLE = f'{Listing._meta.db_table}_fts'
+SEARCH_COLUMNS = ('title', 'description', 'location')
+# Relative weight of a hit in each column, in SEARCH_COLUMNS order
+COLUMN_WEIGHTS = (10.0, 1.0, 5.0)
+MAX_TERMS = 10
+# Relevance ordering has no stable keyset, so deep OFFSET paging is capped
+SEARCH_MAX_PAGES = 50
+SEARCH_MAX_PAGE_SIZE = 100
+
+_fts_ready = {}
+
+
+def search_terms(query):
+    """Split free text into lowercase word tokens, dropping FTS operators"""
+    return re.findall(r'\w+', query.lower())[:MAX_TERMS]
+
+
+def ensure_search_index(using=DEFAULT_DB_ALIAS):
+    """Create the full-text index for this database if it does not exist yet"""
+    connection = connections[using]
+    table = Listing._meta.db_table
+
+    if connection.vendor == 'mysql':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT 1 FROM information_schema.statistics '
+                'WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s',
+                [table, FULLTEXT_INDEX_NAME],
+            )
+            if cursor.fetchone() is None:
+                cursor.execute(
+                    f'CREATE FULLTEXT INDEX {FULLTEXT_INDEX_NAME} ON {table} ({", ".join(SEARCH_COLUMNS)})'
+                )
+
+    elif connection.vendor == 'sqlite':
+        columns = ', '.join(SEARCH_COLUMNS)
+        new_values = ', '.join(f'new.{column}' for column in SEARCH_COLUMNS)
+        old_values = ', '.join(f'old.{column}' for column in SEARCH_COLUMNS)
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1 FROM sqlite_master WHERE name = %s', [FTS_TABLE])
+                created = cursor.fetchone() is None
+                cursor.execute(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                    f"{columns}, content='{table}', content_rowid='id')"
+                )
+                cursor.execute(
+                    f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON {table} BEGIN '
+                    f'INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES (new.id, {new_values}); END'
+                )
+                cursor.execute(
+                    f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON {table} BEGIN '
+                    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns}) VALUES ('delete', old.id, {old_values}); END"
+                )
+                cursor.execute(
+                    f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF {columns} ON {table} BEGIN '
+                    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns}) VALUES ('delete', old.id, {old_values}); "
+                    f'INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES (new.id, {new_values}); END'
+                )
+                if created:
+                    # Index listings that existed before the table did
+                    cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        except DatabaseError:
+            # SQLite compiled without FTS5
+            _fts_ready[using] = False
+            return
+        _fts_ready[using] = True
+
+
+def _filters_sql(alias, is_available, min_price, max_price):
+    clauses, params = [], []
+    if is_available is not None:
+        clauses.append(f'{alias}.is_available = %s')
+        params.append(is_available)
+    if min_price is not None:
+        clauses.append(f'{alias}.price_per_night >= %s')
+        params.append(min_price)
+    if max_price is not None:
+        clauses.append(f'{alias}.price_per_night <= %s')
+        params.append(max_price)
+    return ''.join(f' AND {clause}' for clause in clauses), params
+
+
+class MySQLFullTextBackend:
+    def ranked_ids(self, connection, terms, filters, limit, offset):
+        table = Listing._meta.db_table
+        columns = ', '.join(SEARCH_COLUMNS)
+        # Boolean mode with every term required, matching the SQLite backend's AND semantics
+        match = f'MATCH({columns}) AGAINST (%s IN BOOLEAN MODE)'
+        query = ' '.join(f'+{term}' for term in terms)
+        where, params = _filters_sql('l', *filters)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT l.id, {match} AS relevance FROM {table} l '
+                f'WHERE {match}{where} ORDER BY relevance DESC, l.id DESC LIMIT %s OFFSET %s',
+                [query, query, *params, limit, offset],
+            )
+            return cursor.fetchall()
+
+
+class SQLiteFTSBackend:
+    def ranked_ids(self, connection, terms, filters, limit, offset):
+        table = Listing._meta.db_table
+        weights = ', '.join(str(weight) for weight in COLUMN_WEIGHTS)
+        # Quoted tokens are matched literally and implicitly AND-ed
+        query = ' '.join(f'"{term}"' for term in terms)
+        where, params = _filters_sql('l', *filters)
+        with connection.cursor() as cursor:
+            # bm25() is lower for better matches
+            cursor.execute(
+                f'SELECT l.id, -bm25({FTS_TABLE}, {weights}) AS relevance FROM {FTS_TABLE} '
+                f'JOIN {table} l ON l.id = {FTS_TABLE}.rowid '
+                f'WHERE {FTS_TABLE} MATCH %s{where} ORDER BY relevance DESC, l.id DESC LIMIT %s OFFSET %s',
+                [query, *params, limit, offset],
+            )
+            return cursor.fetchall()
+
+
+class ContainsBackend:
+    """Unindexed fallback: every term must appear somewhere, ranked by where it appears"""
+
+    def ranked_ids(self, connection, terms, filters, limit, offset):
+        is_available, min_price, max_price = filters
+        listings = Listing.objects.using(connection.alias)
+        if is_available is not None:
+            listings = listings.filter(is_available=is_available)
+        if min_price is not None:
+            listings = listings.filter(price_per_night__gte=min_price)
+        if max_price is not None:
+            listings = listings.filter(price_per_night__lte=max_price)
+
+        score = Value(0)
+        for term in terms:
+            listings = listings.filter(
+                Q(title__icontains=term) | Q(description__icontains=term) | Q(location__icontains=term)
+            )
+            for column, weight in zip(SEARCH_COLUMNS, COLUMN_WEIGHTS):
+                score += Case(
+                    When(**{f'{column}__icontains': term}, then=Value(int(weight))),
+                    default=Value(0),
+                    output_field=IntegerField(),
+                )
+        ranked = listings.annotate(relevance=score).order_by('-relevance', '-id')
+        return list(ranked.values_list('id', 'relevance')[offset:offset + limit])
+
+
+def get_backend(connection):
+    if connection.vendor == 'mysql':
+        return MySQLFullTextBackend()
+    if connection.vendor == 'sqlite':
+        if connection.alias not in _fts_ready:
+            ensure_search_index(connection.alias)
+        if _fts_ready[connection.alias]:
+            return SQLiteFTSBackend()
+    return ContainsBackend()
+
+
+def search_listings(queryset, query, is_available=None, min_price=None, max_price=None, limit=20, offset=0):
+    """
+    Rank listings matching every word of `query`, best first.
+
+    Returns a list of (listing, relevance) pairs loaded through `queryset`.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return []
+    connection = connections[queryset.db]
+    ranked = get_backend(connection).ranked_ids(
+        connection, terms, (is_available, min_price, max_price), limit, offset
+    )
+    listings = queryset.in_bulk([listing_id for listing_id, _ in ranked])
+    return [(listings[listing_id], float(relevance)) for listing_id, relevance in ranked if listing_id in listings]
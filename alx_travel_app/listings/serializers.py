@@ -1,22 +1,99 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
 from rest_framework import serializers
-from .models import Listing, Booking, Payment
+from .models import Listing, Booking, Payment, PricingRule
+from .availability import BATCH_MAX_LISTINGS
+from .bookings import BookingConflict, save_booking
+from .geo import box_size_km
+from .instrumentation import TimedSerializerMixin
+from .pricing import QuoteError, quote_stays
+from .search import SEARCH_MAX_PAGES, SEARCH_MAX_PAGE_SIZE
 
-class ListingSerializer(serializers.ModelSerializer):
+class ListingSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     owner = serializers.ReadOnlyField(source='owner.username')
 
     class Meta:
         model = Listing
-        fields = ['id', 'title', 'description', 'location', 'price_per_night', 'owner', 'created_at', 'updated_at', 'is_available']
+        fields = ['id', 'title', 'description', 'location', 'price_per_night', 'owner', 'created_at', 'updated_at', 'is_available',
+                  'rating_avg', 'rating_count', 'rating_histogram', 'latitude', 'longitude']
+        read_only_fields = ['rating_avg', 'rating_count', 'rating_histogram']
+
+    def validate(self, data):
+        latitude = data.get('latitude', getattr(self.instance, 'latitude', None))
+        longitude = data.get('longitude', getattr(self.instance, 'longitude', None))
+        if (latitude is None) != (longitude is None):
+            raise serializers.ValidationError("latitude and longitude must be given together")
+        return data
 
-class BookingSerializer(serializers.ModelSerializer):
+class BookingSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     listing = serializers.PrimaryKeyRelatedField(queryset=Listing.objects.all())
     user = serializers.ReadOnlyField(source='user.username')
 
     class Meta:
         model = Booking
         fields = ['id', 'listing', 'user', 'start_date', 'end_date', 'total_price', 'status', 'created_at']
+        # Charged to the guest through Chapa, so only ever the server-side quote
+        read_only_fields = ['total_price']
+
+    def validate(self, data):
+        listing = data.get('listing', getattr(self.instance, 'listing', None))
+        start_date = data.get('start_date', getattr(self.instance, 'start_date', None))
+        end_date = data.get('end_date', getattr(self.instance, 'end_date', None))
+        if start_date and end_date and start_date >= end_date:
+            raise serializers.ValidationError("end_date must be after start_date")
+        max_nights = getattr(settings, 'PRICING_MAX_NIGHTS', 365)
+        if (end_date - start_date).days > max_nights:
+            raise serializers.ValidationError(f"Stays are limited to {max_nights} nights")
+        stay = (listing.id, start_date, end_date)
+        if self.instance is None or stay != (self.instance.listing_id, self.instance.start_date, self.instance.end_date):
+            # New or moved stays are repriced; unchanged ones keep the price already charged
+            quote = quote_stays([stay])[0]
+            if isinstance(quote, QuoteError):
+                raise serializers.ValidationError(str(quote))
+            data['total_price'] = quote['total']
+        return data
+
+    def create(self, validated_data):
+        return self.save_locked(Booking(**validated_data))
 
-class PaymentSerializer(serializers.ModelSerializer):
+    def update(self, instance, validated_data):
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        return self.save_locked(instance)
+
+    def save_locked(self, booking):
+        # Overlap is checked under a per-listing lock, so it cannot race
+        try:
+            return save_booking(booking)
+        except BookingConflict as e:
+            raise serializers.ValidationError({'non_field_errors': [str(e)]})
+
+class PricingRuleSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = PricingRule
+        fields = ['id', 'listing', 'kind', 'adjustment_percent', 'start_date', 'end_date', 'min_nights', 'created_at']
+        read_only_fields = ['listing']
+
+    def validate(self, data):
+        kind = data.get('kind', getattr(self.instance, 'kind', None))
+        start_date = data.get('start_date', getattr(self.instance, 'start_date', None))
+        end_date = data.get('end_date', getattr(self.instance, 'end_date', None))
+        min_nights = data.get('min_nights', getattr(self.instance, 'min_nights', None))
+        adjustment = data.get('adjustment_percent', getattr(self.instance, 'adjustment_percent', None))
+        if adjustment is not None and adjustment <= -100:
+            raise serializers.ValidationError("adjustment_percent must be greater than -100")
+        if kind == PricingRule.SEASON:
+            if not start_date or not end_date:
+                raise serializers.ValidationError("SEASON rules need start_date and end_date")
+            if start_date > end_date:
+                raise serializers.ValidationError("start_date must not be after end_date")
+        if kind == PricingRule.LENGTH_OF_STAY and not min_nights:
+            raise serializers.ValidationError("LENGTH_OF_STAY rules need min_nights")
+        return data
+
+class PaymentSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     booking = serializers.PrimaryKeyRelatedField(queryset=Booking.objects.all())
     
     class Meta:
@@ -30,3 +107,130 @@ class PaymentInitiationSerializer(serializers.Serializer):
     booking_id = serializers.IntegerField()
     return_url = serializers.URLField()
     callback_url = serializers.URLField(required=False)
+
+class AvailabilitySearchSerializer(serializers.Serializer):
+    start_date = serializers.DateField()
+    end_date = serializers.DateField()
+    location = serializers.CharField(required=False, max_length=100)
+    min_price = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+    max_price = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+
+    def validate(self, data):
+        if data['start_date'] >= data['end_date']:
+            raise serializers.ValidationError("end_date must be after start_date")
+        return data
+
+class NearbySearchSerializer(serializers.Serializer):
+    latitude = serializers.FloatField(required=False, min_value=-90, max_value=90)
+    longitude = serializers.FloatField(required=False, min_value=-180, max_value=180)
+    radius_km = serializers.FloatField(required=False, min_value=0.1, default=10)
+    # A box whose min_lng exceeds max_lng wraps across the antimeridian
+    min_lat = serializers.FloatField(required=False, min_value=-90, max_value=90)
+    max_lat = serializers.FloatField(required=False, min_value=-90, max_value=90)
+    min_lng = serializers.FloatField(required=False, min_value=-180, max_value=180)
+    max_lng = serializers.FloatField(required=False, min_value=-180, max_value=180)
+    is_available = serializers.BooleanField(required=False, allow_null=True)
+    page = serializers.IntegerField(required=False, min_value=1, max_value=SEARCH_MAX_PAGES, default=1)
+    page_size = serializers.IntegerField(required=False, min_value=1, max_value=SEARCH_MAX_PAGE_SIZE, default=20)
+
+    def validate(self, data):
+        max_radius = getattr(settings, 'GEO_MAX_RADIUS_KM', 200)
+        box = [data.get(name) for name in ('min_lat', 'max_lat', 'min_lng', 'max_lng')]
+        if any(value is not None for value in box):
+            if any(value is None for value in box):
+                raise serializers.ValidationError("min_lat, max_lat, min_lng and max_lng must be given together")
+            min_lat, max_lat, min_lng, max_lng = box
+            if min_lat > max_lat:
+                raise serializers.ValidationError("min_lat must not exceed max_lat")
+            if min_lng > max_lng:
+                max_lng += 360
+            # Each side on its own: a diagonal measured around the globe lets a box wrap most of it
+            if max(box_size_km(min_lat, max_lat, min_lng, max_lng)) > 2 * max_radius:
+                raise serializers.ValidationError(f"Boxes are limited to {2 * max_radius} km a side")
+            data['box'] = (min_lat, max_lat, min_lng, max_lng)
+            if data.get('latitude') is None or data.get('longitude') is None:
+                # Without a point, distances are measured from the middle of the box
+                data['latitude'], data['longitude'] = (min_lat + max_lat) / 2, (min_lng + max_lng) / 2
+        elif data.get('latitude') is None or data.get('longitude') is None:
+            raise serializers.ValidationError("Give latitude and longitude, or a min_lat/max_lat/min_lng/max_lng box")
+        elif data['radius_km'] > max_radius:
+            raise serializers.ValidationError(f"radius_km is limited to {max_radius}")
+        return data
+
+class CalendarSerializer(serializers.Serializer):
+    month = serializers.DateField(required=False, input_formats=['%Y-%m'], help_text='YYYY-MM; defaults to this month')
+    months = serializers.IntegerField(required=False, min_value=1, max_value=12, default=1)
+
+class ListingSearchSerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=200)
+    is_available = serializers.BooleanField(required=False, allow_null=True)
+    min_price = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+    max_price = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+    page = serializers.IntegerField(required=False, min_value=1, max_value=SEARCH_MAX_PAGES, default=1)
+    page_size = serializers.IntegerField(required=False, min_value=1, max_value=SEARCH_MAX_PAGE_SIZE, default=20)
+
+    def validate(self, data):
+        if data.get('min_price') is not None and data.get('max_price') is not None and data['min_price'] > data['max_price']:
+            raise serializers.ValidationError("min_price must not exceed max_price")
+        return data
+
+class ExportSerializer(serializers.Serializer):
+    output = serializers.ChoiceField(choices=['csv', 'ndjson'], default='csv')
+    created_from = serializers.DateField(required=False)
+    created_to = serializers.DateField(required=False)
+    paid_from = serializers.DateField(required=False)
+    paid_to = serializers.DateField(required=False)
+
+    def validate(self, data):
+        for start, end in (('created_from', 'created_to'), ('paid_from', 'paid_to')):
+            if data.get(start) and data.get(end) and data[start] > data[end]:
+                raise serializers.ValidationError(f"{start} must not be after {end}")
+        if self.context.get('kind') != 'payments' and (data.get('paid_from') or data.get('paid_to')):
+            raise serializers.ValidationError("paid_from/paid_to only apply to payments")
+        return data
+
+class AnalyticsRangeSerializer(serializers.Serializer):
+    start_date = serializers.DateField(required=False)
+    end_date = serializers.DateField(required=False)
+
+    def validate(self, data):
+        end_date = data.get('end_date') or timezone.localdate()
+        start_date = data.get('start_date') or end_date - timedelta(days=29)
+        if start_date > end_date:
+            raise serializers.ValidationError("start_date must not be after end_date")
+        max_days = getattr(settings, 'ANALYTICS_MAX_RANGE_DAYS', 366)
+        if (end_date - start_date).days >= max_days:
+            raise serializers.ValidationError(f"Date range is limited to {max_days} days")
+        return {'start_date': start_date, 'end_date': end_date}
+
+class BatchAvailabilitySerializer(serializers.Serializer):
+    listings = serializers.ListField(
+        child=serializers.IntegerField(), allow_empty=False, max_length=BATCH_MAX_LISTINGS,
+    )
+    start_date = serializers.DateField()
+    end_date = serializers.DateField()
+    currency = serializers.CharField(required=False, max_length=3)
+
+    def validate(self, data):
+        if data['start_date'] >= data['end_date']:
+            raise serializers.ValidationError("end_date must be after start_date")
+        max_nights = getattr(settings, 'PRICING_MAX_NIGHTS', 365)
+        if (data['end_date'] - data['start_date']).days > max_nights:
+            raise serializers.ValidationError(f"Stays are limited to {max_nights} nights")
+        return data
+
+class QuoteItemSerializer(serializers.Serializer):
+    listing = serializers.IntegerField()
+    start_date = serializers.DateField()
+    end_date = serializers.DateField()
+
+    def validate(self, data):
+        if data['start_date'] >= data['end_date']:
+            raise serializers.ValidationError("end_date must be after start_date")
+        max_nights = getattr(settings, 'PRICING_MAX_NIGHTS', 365)
+        if (data['end_date'] - data['start_date']).days > max_nights:
+            raise serializers.ValidationError(f"Stays are limited to {max_nights} nights")
+        return data
+
+class BulkBookingItemSerializer(QuoteItemSerializer):
+    """One item of a bulk booking; its total_price is quoted by the view, as for single bookings"""
@@ -0,0 +1,101 @@
+import logging
+
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_init, post_save, post_delete, post_migrate
+from django.dispatch import receiver
+
+from .cache import invalidate_listing
+from .instrumentation import record_query
+from .metrics import record_payment_transition
+from .occupancy import held_span, record_deleted, record_saved
+from .models import Booking, Listing, Payment, PricingRule, Review
+from .pricing import invalidate_calendars
+from .ratings import apply_rating_change
+from .search import ensure_search_index
+from .tasks import rebuild_listing_rollups
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender=Listing)
+@receiver(post_delete, sender=Listing)
+def invalidate_listing_cache(sender, instance, **kwargs):
+    """Drop cached payloads for a listing whenever it is written or deleted"""
+    invalidate_listing(instance.pk)
+
+
+@receiver(post_save, sender=Listing)
+@receiver(post_delete, sender=Listing)
+def invalidate_price_calendar(sender, instance, update_fields=None, **kwargs):
+    """Rating and other writes that leave the price alone keep the calendar"""
+    if update_fields is None or 'price_per_night' in update_fields:
+        invalidate_calendars([instance.pk])
+
+
+@receiver(post_save, sender=PricingRule)
+@receiver(post_delete, sender=PricingRule)
+def invalidate_rule_calendar(sender, instance, **kwargs):
+    invalidate_calendars([instance.listing_id])
+
+
+@receiver(post_delete, sender=Review)
+def remove_review_rating(sender, instance, **kwargs):
+    """Take a deleted review out of its listing's rating aggregates"""
+    apply_rating_change(instance.listing_id, removed=instance.rating)
+
+
+@receiver(post_migrate)
+def create_search_index(sender, using, **kwargs):
+    """Full-text indexes are not expressible as model indexes, so add them after migrate"""
+    if sender.name == 'listings':
+        ensure_search_index(using)
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    """Let RequestTimingMiddleware see every query; a no-op outside sampled requests"""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@receiver(post_init, sender=Payment)
+def remember_payment_status(sender, instance, **kwargs):
+    # Read from __dict__ so a deferred status is not fetched just for metrics
+    instance._saved_status = instance.__dict__.get('status') if instance.pk else None
+
+
+@receiver(post_save, sender=Payment)
+def count_payment_transition(sender, instance, created, **kwargs):
+    """Feed listings_payment_status_transitions_total"""
+    record_payment_transition(None if created else instance._saved_status, instance.status)
+    instance._saved_status = instance.status
+
+
+@receiver(post_init, sender=Booking)
+def remember_held_span(sender, instance, **kwargs):
+    instance._held_span = held_span(instance) if instance.pk else None
+
+
+@receiver(post_save, sender=Booking)
+def update_booking_occupancy(sender, instance, **kwargs):
+    """Keep the listing's occupancy bitmap in step with the nights the booking holds"""
+    record_saved([instance])
+
+
+@receiver(post_delete, sender=Booking)
+def release_booking_occupancy(sender, instance, **kwargs):
+    record_deleted([instance])
+
+
+@receiver(post_delete, sender=Booking)
+def queue_rollup_rebuild(sender, instance, **kwargs):
+    """A deleted booking leaves no updated_at behind, so rebuild its listing's rollup explicitly"""
+    def enqueue():
+        try:
+            rebuild_listing_rollups.delay([listing_id])
+        except Exception as e:
+            logger.error(f'Failed to queue rollup rebuild for listing {listing_id}: {str(e)}')
+
+    listing_id = instance.listing_id
+    transaction.on_commit(enqueue)
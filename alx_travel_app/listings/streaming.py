@@ -0,0 +1,28 @@
+from django.http import StreamingHttpResponse
+from rest_framework.utils.encoders import JSONEncoder
+
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+DEFAULT_CHUNK_SIZE = 2000
+
+
+def iter_ndjson(queryset, serializer_class, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yield one JSON document per row using a server-side cursor.
+
+    A single serializer instance is reused for every row so memory stays
+    flat no matter how many rows the queryset matches.
+    """
+    serializer = serializer_class()
+    encoder = JSONEncoder()
+    for obj in queryset.iterator(chunk_size=chunk_size):
+        yield encoder.encode(serializer.to_representation(obj)) + '\n'
+
+
+def ndjson_response(queryset, serializer_class, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Stream a queryset as newline-delimited JSON"""
+    response = StreamingHttpResponse(
+        iter_ndjson(queryset, serializer_class, chunk_size=chunk_size),
+        content_type=NDJSON_CONTENT_TYPE,
+    )
+    response['X-Accel-Buffering'] = 'no'
+    return response
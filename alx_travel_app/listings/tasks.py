@@ -1,50 +1,66 @@
 from celery import shared_task
-from django.core.mail import send_mail
+from datetime import timedelta
+from django.core.mail import EmailMultiAlternatives, get_connection
 from django.conf import settings
-from django.template.loader import render_to_string
-from django.utils.html import strip_tags
+from django.db import transaction
+from django.utils import timezone
+from django.template.loader import get_template
+from functools import lru_cache
 import logging
+from .chapa_service import ChapaService, verify_many
+from .circuit import CallRejected
+from .confirmations import claim_confirmations, queue_confirmations
+from .analytics import rebuild_daily_stats, refresh_daily_stats
+from .expiry import sweep_pending
+from .metrics import LATE_CAPTURES
+from .models import Booking, Payment
+from .occupancy import record_saved
+from .payments import apply_verification
 
 logger = logging.getLogger(__name__)
 
+@lru_cache(maxsize=None)
+def confirmation_templates():
+    """Compile the confirmation templates once per worker process"""
+    return (
+        get_template('listings/emails/booking_confirmation.txt'),
+        get_template('listings/emails/booking_confirmation.html'),
+    )
+
+
+def build_confirmation_message(booking_id, user_email, user_name, listing_title, start_date, end_date, total_price, connection=None):
+    """
+    Render a booking confirmation as a multipart (text + HTML) message
+    """
+    context = {
+        'booking_id': booking_id,
+        'user_name': user_name,
+        'listing_title': listing_title,
+        'start_date': start_date,
+        'end_date': end_date,
+        'total_price': total_price,
+    }
+    text_template, html_template = confirmation_templates()
+    message = EmailMultiAlternatives(
+        subject=f'Booking Confirmation - {listing_title}',
+        body=text_template.render(context),
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[user_email],
+        connection=connection,
+    )
+    message.attach_alternative(html_template.render(context), 'text/html')
+    return message
+
+
 @shared_task(bind=True, max_retries=3)
 def send_booking_confirmation_email(self, booking_id, user_email, user_name, listing_title, start_date, end_date, total_price):
     """
     Send booking confirmation email asynchronously
     """
     try:
-        subject = f'Booking Confirmation - {listing_title}'
-        
-        # Create email content
-        html_message = f"""
-        <html>
-        <body>
-            <h2>Booking Confirmation</h2>
-            <p>Dear {user_name},</p>
-            <p>Your booking has been confirmed! Here are the details:</p>
-            <ul>
-                <li><strong>Property:</strong> {listing_title}</li>
-                <li><strong>Check-in:</strong> {start_date}</li>
-                <li><strong>Check-out:</strong> {end_date}</li>
-                <li><strong>Total Price:</strong> ${total_price}</li>
-                <li><strong>Booking ID:</strong> {booking_id}</li>
-            </ul>
-            <p>Thank you for choosing ALX Travel App!</p>
-            <p>Best regards,<br>ALX Travel Team</p>
-        </body>
-        </html>
-        """
-        
-        plain_message = strip_tags(html_message)
-        
-        send_mail(
-            subject=subject,
-            message=plain_message,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[user_email],
-            html_message=html_message,
-            fail_silently=False,
-        )
+        build_confirmation_message(
+            booking_id, user_email, user_name, listing_title, start_date, end_date, total_price
+        ).send(fail_silently=False)
         
         logger.info(f'Booking confirmation email sent successfully to {user_email} for booking {booking_id}')
         return f'Email sent successfully to {user_email}'
@@ -52,4 +68,225 @@ def send_booking_confirmation_email(self, booking_id, user_email, user_name, lis
     except Exception as exc:
         logger.error(f'Failed to send booking confirmation email to {user_email}: {str(exc)}')
         # Retry the task
-        raise self.retry(exc=exc, countdown=60, max_retries=3)
\ No newline at end of file
+        raise self.retry(exc=exc, countdown=60, max_retries=3)
+
+
+@shared_task(bind=True, max_retries=3)
+def send_booking_confirmation_emails(self, booking_ids):
+    """
+    Send confirmations for many bookings over a single SMTP connection
+    """
+    bookings = (
+        Booking.objects.filter(id__in=booking_ids)
+        .select_related('user', 'listing')
+        .only('id', 'start_date', 'end_date', 'total_price', 'user__email', 'user__username',
+              'user__first_name', 'user__last_name', 'listing__title')
+    )
+
+    try:
+        with get_connection(fail_silently=False) as connection:
+            messages = [
+                build_confirmation_message(
+                    booking.id, booking.user.email, booking.user.get_full_name() or booking.user.username,
+                    booking.listing.title, str(booking.start_date), str(booking.end_date),
+                    str(booking.total_price), connection=connection,
+                )
+                for booking in bookings
+            ]
+            sent = connection.send_messages(messages)
+    except Exception as exc:
+        logger.error(f'Failed to send {len(booking_ids)} booking confirmation emails: {str(exc)}')
+        raise self.retry(exc=exc, countdown=60, max_retries=3)
+
+    logger.info(f'Sent {sent} booking confirmation emails in one batch')
+    return sent
+
+
+@shared_task
+def send_pending_confirmations(chunk_size=None, max_chunks=None):
+    """
+    Drain the confirmation outbox into send_booking_confirmation_emails
+    tasks of chunk_size bookings each, at most max_chunks per run.
+    """
+    chunk_size = chunk_size or getattr(settings, 'CONFIRMATION_EMAIL_CHUNK_SIZE', 100)
+    max_chunks = max_chunks or getattr(settings, 'CONFIRMATION_EMAIL_MAX_CHUNKS', 50)
+    queued = 0
+    for _ in range(max_chunks):
+        booking_ids = claim_confirmations(chunk_size)
+        if not booking_ids:
+            break
+        try:
+            send_booking_confirmation_emails.delay(booking_ids)
+        except Exception as e:
+            logger.error(f'Failed to queue {len(booking_ids)} booking confirmation emails: {str(e)}')
+            # Back in the outbox for the next run
+            queue_confirmations(booking_ids)
+            break
+        queued += len(booking_ids)
+        if len(booking_ids) < chunk_size:
+            break
+
+    logger.info(f'Queued {queued} booking confirmation emails from the outbox')
+    return queued
+
+
+class GatewayUnavailable(Exception):
+    """Chapa did not return a usable verification response"""
+
+
+@shared_task(bind=True, max_retries=5)
+def verify_payment_task(self, tx_ref):
+    """
+    Verify one payment with Chapa and record the outcome.
+
+    Triggered by the Chapa webhook/callback and by verify_payment, so the
+    gateway round trip never happens on a user-facing request. The webhook
+    queues any tx_ref it is sent, so refs without a PENDING payment are
+    answered from the database and never reach the gateway. CANCELLED ones
+    are the exception: the expiry sweeper may have cancelled a checkout the
+    guest paid just after, and that capture has to be flagged.
+    """
+    current = Payment.objects.filter(chapa_tx_ref=tx_ref).values_list('status', flat=True).first()
+    if current is None:
+        logger.warning(f'Verification requested for unknown payment {tx_ref}')
+        return None
+    if current not in ('PENDING', 'CANCELLED'):
+        return current
+
+    try:
+        verification_response = ChapaService().verify_payment(tx_ref)
+    except CallRejected as exc:
+        # Not a failed attempt: wait out the open circuit rather than backing off
+        raise self.retry(exc=exc, countdown=max(1, round(exc.retry_after)))
+    if not verification_response:
+        # Back off exponentially; the reconciler picks up anything still stuck
+        raise self.retry(exc=GatewayUnavailable(tx_ref), countdown=30 * (2 ** self.request.retries))
+
+    payment = record_verification(tx_ref, verification_response.get('data') or {})
+    if payment is None:
+        logger.warning(f'Verification result for unknown payment {tx_ref}')
+        return None
+    return payment.status
+
+
+def record_verification(tx_ref, chapa_data):
+    """
+    Apply a Chapa verification result to the payment it answers.
+
+    The payment is re-read under its row lock, since another worker or the
+    expiry sweeper may have settled it during the gateway call; only a
+    still-PENDING payment is updated. Shared by verify_payment_task and the
+    async verify view. Returns the payment, or None if there is none.
+    """
+    with transaction.atomic():
+        try:
+            payment = Payment.objects.select_for_update().select_related('booking').get(chapa_tx_ref=tx_ref)
+        except Payment.DoesNotExist:
+            return None
+
+        if payment.status == 'CANCELLED':
+            if (chapa_data.get('status') or '').lower() == 'success':
+                LATE_CAPTURES.inc()
+                logger.error(
+                    f'Payment {tx_ref} was captured by Chapa after it was cancelled; '
+                    f'booking {payment.booking_id} needs a refund or manual confirmation'
+                )
+            return payment
+        if payment.status != 'PENDING':
+            return payment
+
+        if apply_verification(payment, chapa_data):
+            booking = payment.booking
+            booking.save(update_fields=['status', 'updated_at'])
+            if booking.status == 'CONFIRMED':
+                queue_confirmations([booking.id])
+        payment.save()
+
+    logger.info(f'Payment {tx_ref} verified as {payment.status}')
+    return payment
+
+
+@shared_task
+def reconcile_pending_payments(batch_size=None, concurrency=None, stale_after_minutes=None):
+    """
+    Verify PENDING payments that no webhook has settled, in bulk batches.
+
+    Gateway calls run with bounded concurrency and each batch is written
+    back with two bulk_update statements (payments, then bookings).
+    """
+    batch_size = batch_size or getattr(settings, 'PAYMENT_RECONCILE_BATCH_SIZE', 200)
+    concurrency = concurrency or getattr(settings, 'PAYMENT_RECONCILE_CONCURRENCY', 8)
+    if stale_after_minutes is None:
+        stale_after_minutes = getattr(settings, 'PAYMENT_RECONCILE_STALE_AFTER', 15)
+    stale_after = timedelta(minutes=stale_after_minutes)
+    cutoff = timezone.now() - stale_after
+
+    stale = Payment.objects.filter(status='PENDING', created_at__lt=cutoff)
+    last_id = 0
+    settled = 0
+    checked = 0
+
+    while True:
+        batch = list(stale.filter(id__gt=last_id).order_by('id').values_list('id', 'chapa_tx_ref')[:batch_size])
+        if not batch:
+            break
+        last_id = batch[-1][0]
+        checked += len(batch)
+
+        results = verify_many([tx_ref for _, tx_ref in batch], concurrency)
+
+        with transaction.atomic():
+            payments = list(
+                Payment.objects.select_for_update()
+                .select_related('booking')
+                .filter(id__in=[pk for pk, _ in batch], status='PENDING')
+            )
+            changed_payments = []
+            changed_bookings = []
+            now = timezone.now()
+            for payment in payments:
+                response = results.get(payment.chapa_tx_ref)
+                if response and apply_verification(payment, response.get('data') or {}):
+                    # bulk_update bypasses save(), so auto_now is not applied
+                    payment.updated_at = now
+                    payment.booking.updated_at = now
+                    changed_payments.append(payment)
+                    changed_bookings.append(payment.booking)
+
+            Payment.objects.bulk_update(
+                changed_payments,
+                ['status', 'paid_at', 'chapa_reference', 'payment_method', 'updated_at'],
+            )
+            Booking.objects.bulk_update(changed_bookings, ['status', 'updated_at'])
+            # Cancelled bookings release their nights; bulk_update sends no post_save
+            record_saved(changed_bookings)
+            queue_confirmations([booking.id for booking in changed_bookings if booking.status == 'CONFIRMED'])
+        settled += len(changed_payments)
+
+    logger.info(f'Reconciled pending payments: checked={checked} settled={settled}')
+    return {'checked': checked, 'settled': settled}
+
+
+@shared_task
+def refresh_daily_rollups():
+    """Fold bookings and payments written since the last run into ListingDailyStat"""
+    result = refresh_daily_stats()
+    logger.info(f"Refreshed daily rollups: listings={result['listings']} rows={result['rows']}")
+    return result
+
+
+@shared_task
+def rebuild_listing_rollups(listing_ids):
+    """Recompute ListingDailyStat for specific listings, e.g. after a booking is deleted"""
+    return rebuild_daily_stats(listing_ids)
+
+
+@shared_task
+def expire_stale_pending():
+    """Cancel abandoned PENDING payments and bookings, and purge expired idempotency keys"""
+    result = sweep_pending()
+    logger.info(
+        f"Expired stale pending rows: payments={result['payments']} bookings={result['bookings']} "
+        f"nights={result['nights']} idempotency_keys={result['idempotency_keys']} paid={result['paid']}"
+    )
+    return result
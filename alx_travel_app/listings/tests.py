@@ -1,3 +1,1743 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from prometheus_client import REGISTRY
+from testing.chapa_stub import ChapaStubHandler, ChapaStubServer
+
+from .bookings import BookingConflict, bulk_create_bookings, save_booking
+from .chapa_service import AsyncChapaService, ChapaService, get_gateway
+from .circuit import Bulkhead, CallRejected, CircuitBreaker, guarded_call
+from .confirmations import queue_confirmations
+from .analytics import nightly_revenue, refresh_daily_stats
+from .exports import export_batches
+from .expiry import sweep_pending
+from .models import (
+    Listing, Booking, IdempotencyKey, ListingDailyStat, Payment, PendingConfirmation, PricingRule, Review,
+)
+from .pricing import quote_stays
+from .ratings import rebuild_rating_aggregates
+from .tasks import (
+    verify_payment_task, reconcile_pending_payments, send_booking_confirmation_email, send_booking_confirmation_emails,
+    send_pending_confirmations, rebuild_listing_rollups,
+)
+
+
+class APITestCase(TestCase):
+    def setUp(self):
+        # The locmem cache outlives each test's transaction rollback
+        cache.clear()
+
+
+class ListingPaginationTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='owner', password='testpass123')
+        Listing.objects.bulk_create([
+            Listing(
+                title=f'Listing {i}',
+                description='desc',
+                location='Cape Town',
+                price_per_night=100,
+                owner=cls.owner,
+            )
+            for i in range(7)
+        ])
+
+    def test_cursor_pages_cover_every_listing_once(self):
+        url = reverse('listing-list-create')
+        seen = []
+        response = self.client.get(url, {'page_size': 3})
+        while True:
+            self.assertEqual(response.status_code, 200)
+            seen.extend(row['id'] for row in response.data['results'])
+            if not response.data['next_cursor']:
+                break
+            response = self.client.get(url, {'page_size': 3, 'cursor': response.data['next_cursor']})
+
+        expected = list(Listing.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_invalid_cursor_returns_404(self):
+        response = self.client.get(reverse('listing-list-create'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_ndjson_stream(self):
+        response = self.client.get(reverse('listing-list-create'), {'stream': 'ndjson'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 7)
+        self.assertEqual(json.loads(lines[0])['owner'], 'owner')
+
+
+class AvailabilitySearchTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='owner', password='testpass123')
+        cls.booked = Listing.objects.create(
+            title='Booked', description='d', location='Cape Town', price_per_night=100, owner=cls.owner
+        )
+        cls.free = Listing.objects.create(
+            title='Free', description='d', location='Cape Town', price_per_night=100, owner=cls.owner
+        )
+        cls.cancelled = Listing.objects.create(
+            title='Cancelled', description='d', location='Cape Town', price_per_night=100, owner=cls.owner
+        )
+        Booking.objects.create(
+            listing=cls.booked, user=cls.owner, start_date=date(2030, 1, 5),
+            end_date=date(2030, 1, 10), total_price=500, status='CONFIRMED'
+        )
+        Booking.objects.create(
+            listing=cls.cancelled, user=cls.owner, start_date=date(2030, 1, 5),
+            end_date=date(2030, 1, 10), total_price=500, status='CANCELLED'
+        )
+
+    def search(self, **params):
+        return self.client.get(reverse('listing-availability-search'), params)
+
+    def test_overlapping_booking_excludes_listing(self):
+        response = self.search(location='Cape Town', start_date='2030-01-08', end_date='2030-01-12')
+        ids = {row['id'] for row in response.data['results']}
+        self.assertEqual(ids, {self.free.id, self.cancelled.id})
+
+    def test_checkout_day_is_bookable(self):
+        response = self.search(location='Cape Town', start_date='2030-01-10', end_date='2030-01-12')
+        self.assertEqual(len(response.data['results']), 3)
+
+    def test_invalid_range_rejected(self):
+        response = self.search(start_date='2030-01-10', end_date='2030-01-10')
+        self.assertEqual(response.status_code, 400)
+
+    def batch(self, listings, start_date, end_date, **extra):
+        return self.client.post(reverse('listing-batch-availability'), {
+            'listings': listings, 'start_date': start_date, 'end_date': end_date, **extra,
+        }, content_type='application/json')
+
+    def test_batch_reports_availability_and_price(self):
+        ids = [self.free.id, self.booked.id, 999999, self.cancelled.id, self.free.id]
+        response = self.batch(ids, '2030-01-08', '2030-01-10')
+        self.assertEqual(response.status_code, 200)
+        rows = [(row['listing'], row['available'], row['total']) for row in response.data['results']]
+        self.assertEqual(rows, [
+            (self.free.id, True, '200.00'), (self.booked.id, False, '200.00'), (self.cancelled.id, True, '200.00'),
+        ])
+        self.assertEqual(response.data['missing'], [999999])
+        self.assertEqual(self.batch([self.free.id], '2030-01-08', '2030-01-08').status_code, 400)
+        self.assertEqual(self.batch([self.free.id], '2030-01-08', '2030-01-10', currency='XYZ').status_code, 400)
+
+    def test_batch_query_count_is_constant(self):
+        ids = [self.free.id, self.booked.id, self.cancelled.id] + [
+            Listing.objects.create(
+                title=f'Extra {i}', description='d', location='Nairobi', price_per_night=80, owner=self.owner
+            ).id
+            for i in range(20)
+        ]
+        start = timezone.localdate() + timedelta(days=7)
+        end = start + timedelta(days=3)
+        for size in (1, len(ids)):
+            cache.clear()
+            # Listings, grouped overlaps, then pricing rules for the cold calendars
+            with self.assertNumQueries(3):
+                self.batch(ids[:size], str(start), str(end))
+            with self.assertNumQueries(2):
+                self.batch(ids[:size], str(start), str(end))
+        # Past the cached horizon, calendars for just this stay are built instead
+        with self.assertNumQueries(3):
+            self.batch(ids, '2030-01-08', '2030-01-10')
+
+
+class OccupancyCalendarTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.guest = User.objects.create_user(username='guest', email='guest@example.com', password='testpass123')
+        cls.listing = Listing.objects.create(
+            title='Villa', description='d', location='Cape Town', price_per_night=100, owner=cls.guest
+        )
+        cls.month = (timezone.localdate().replace(day=1) + timedelta(days=40)).replace(day=1)
+        cls.booking = Booking.objects.create(
+            listing=cls.listing, user=cls.guest, start_date=cls.month + timedelta(days=2),
+            end_date=cls.month + timedelta(days=5), total_price=300, status='CONFIRMED'
+        )
+        Booking.objects.create(
+            listing=cls.listing, user=cls.guest, start_date=cls.month + timedelta(days=10),
+            end_date=cls.month + timedelta(days=12), total_price=200, status='CANCELLED'
+        )
+
+    def booked(self, month=None, **params):
+        month = month or self.month
+        response = self.client.get(reverse('listing-calendar', args=[self.listing.pk]), {'month': month.strftime('%Y-%m'), **params})
+        self.assertEqual(response.status_code, 200, response.data)
+        return [day['date'].day for day in response.data['months'][0]['days'] if day['booked']]
+
+    def test_month_view(self):
+        self.assertEqual(self.booked(), [3, 4, 5])
+        response = self.client.get(reverse('listing-calendar', args=[self.listing.pk]), {'month': self.month.strftime('%Y-%m'), 'months': 3})
+        first, second, _ = response.data['months']
+        self.assertEqual(first['days'][0]['date'], self.month)
+        self.assertEqual(second['days'][0]['date'], first['days'][-1]['date'] + timedelta(days=1))
+        # Cached after the first read
+        with self.assertNumQueries(0):
+            self.booked()
+        self.assertEqual(self.client.get(reverse('listing-calendar', args=[999999])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('listing-calendar', args=[self.listing.pk]), {'month': '2030-13'}).status_code, 400)
+
+    def test_writes_flip_nights(self):
+        self.booked()
+        self.client.force_login(self.guest)
+        response = self.client.post(reverse('booking-list-create'), {
+            'listing': self.listing.pk, 'start_date': str(self.month + timedelta(days=19)),
+            'end_date': str(self.month + timedelta(days=21)), 'total_price': '200.00',
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(self.booked(), [3, 4, 5, 20, 21])
+
+        # Cancelled the way verify_payment_task writes it
+        booking = Booking.objects.get(pk=response.data['id'])
+        booking.status = 'CANCELLED'
+        booking.save(update_fields=['status', 'updated_at'])
+        self.assertEqual(self.booked(), [3, 4, 5])
+
+        self.client.delete(reverse('booking-detail', args=[self.booking.pk]))
+        self.assertEqual(self.booked(), [])
+
+        created, _ = bulk_create_bookings(self.guest, [(0, {
+            'listing': self.listing.pk, 'start_date': self.month, 'end_date': self.month + timedelta(days=1),
+            'total_price': Decimal('100.00'),
+        })])
+        self.assertEqual(self.booked(), [1])
+
+    def test_reconciler_releases_cancelled_nights(self):
+        self.booked()
+        payment = Payment.objects.create(
+            booking=Booking.objects.create(
+                listing=self.listing, user=self.guest, start_date=self.month + timedelta(days=6),
+                end_date=self.month + timedelta(days=7), total_price=100
+            ),
+            transaction_id='ALX_OCC', chapa_tx_ref='ALX_OCC', amount=100,
+        )
+        self.assertEqual(self.booked(), [3, 4, 5, 7])
+        Payment.objects.filter(pk=payment.pk).update(created_at=timezone.now() - timedelta(hours=1))
+
+        with ChapaStubServer(verify_status='failed') as stub, \
+                mock.patch.dict(os.environ, {'CHAPA_BASE_URL': stub.base_url}):
+            reconcile_pending_payments(stale_after_minutes=15)
+        self.assertEqual(self.booked(), [3, 4, 5])
+
+    def test_months_past_the_horizon(self):
+        far = (self.month + timedelta(days=800)).replace(day=1)
+        Booking.objects.create(
+            listing=self.listing, user=self.guest, start_date=far + timedelta(days=1),
+            end_date=far + timedelta(days=2), total_price=100
+        )
+        self.assertEqual(self.booked(far), [2])
+
+
+class QueryBudgetTests(APITestCase):
+    """List endpoints must cost a fixed number of queries regardless of row count"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='owner', password='testpass123')
+
+    def add_rows(self, count):
+        for i in range(count):
+            user = User.objects.create_user(username=f'guest{User.objects.count()}')
+            listing = Listing.objects.create(
+                title=f'Listing {i}', description='d', location='Cape Town',
+                price_per_night=100, owner=user
+            )
+            booking = Booking.objects.create(
+                listing=listing, user=user, start_date=date(2030, 1, 1),
+                end_date=date(2030, 1, 3), total_price=200
+            )
+            Payment.objects.create(
+                booking=booking, transaction_id=f'tx-{booking.id}', chapa_tx_ref=f'tx-{booking.id}', amount=200
+            )
+
+    def assertConstantQueries(self, url, budget):
+        self.add_rows(3)
+        with self.assertNumQueries(budget):
+            self.client.get(url)
+        self.add_rows(20)
+        with self.assertNumQueries(budget):
+            self.client.get(url)
+
+    def test_listing_list(self):
+        self.assertConstantQueries(reverse('listing-list-create'), 1)
+
+    def test_booking_list(self):
+        self.assertConstantQueries(reverse('booking-list-create'), 1)
+
+    def test_payment_list(self):
+        self.assertConstantQueries(reverse('payment-list'), 1)
+
+    def test_detail_views(self):
+        self.add_rows(1)
+        booking = Booking.objects.get()
+        payment = Payment.objects.get()
+        with self.assertNumQueries(1):
+            self.client.get(reverse('listing-detail', args=[booking.listing_id]))
+        with self.assertNumQueries(1):
+            self.client.get(reverse('booking-detail', args=[booking.id]))
+        with self.assertNumQueries(1):
+            self.client.get(reverse('payment-detail', args=[payment.id]))
+
+
+class ListingCacheTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='owner', password='testpass123')
+        cls.listing = Listing.objects.create(
+            title='Villa', description='d', location='Cape Town', price_per_night=150, owner=cls.owner
+        )
+
+    def test_detail_served_from_cache_after_first_read(self):
+        url = reverse('listing-detail', args=[self.listing.id])
+        hits = REGISTRY.get_sample_value('listings_cache_lookups_total', {'kind': 'detail', 'result': 'hit'}) or 0
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.data['title'], 'Villa')
+        after = REGISTRY.get_sample_value('listings_cache_lookups_total', {'kind': 'detail', 'result': 'hit'})
+        self.assertEqual(after - hits, 1)
+        self.assertIn(b'listings_cache_lookups_total', self.client.get(reverse('metrics')).content)
+
+    def test_conditional_get_returns_304(self):
+        url = reverse('listing-detail', args=[self.listing.id])
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        list_url = reverse('listing-list-create')
+        list_response = self.client.get(list_url)
+        self.assertFalse(list_response.has_header('Last-Modified'))
+        response = self.client.get(list_url, HTTP_IF_NONE_MATCH=list_response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        # Deleting a listing leaves no newer updated_at behind, but the page still changes
+        Listing.objects.create(title='Flat', description='d', location='Cape Town', price_per_night=90, owner=self.owner)
+        etag = self.client.get(list_url)['ETag']
+        Listing.objects.get(title='Flat').delete()
+        self.assertEqual(self.client.get(list_url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_save_invalidates_detail_and_list(self):
+        detail_url = reverse('listing-detail', args=[self.listing.id])
+        list_url = reverse('listing-list-create')
+        self.client.get(detail_url)
+        self.client.get(list_url)
+
+        self.listing.title = 'Renamed Villa'
+        self.listing.save()
+
+        self.assertEqual(self.client.get(detail_url).data['title'], 'Renamed Villa')
+        self.assertEqual(self.client.get(list_url).data['results'][0]['title'], 'Renamed Villa')
+
+    def test_delete_invalidates_detail(self):
+        url = reverse('listing-detail', args=[self.listing.id])
+        self.client.get(url)
+        Listing.objects.filter(pk=self.listing.pk).get().delete()
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class FlakyChapaHandler(ChapaStubHandler):
+    """Fails the first request of each method with a 503"""
+
+    def handle_flaky(self, method, handler):
+        seen = self.server.failures_seen
+        if method not in seen:
+            seen.add(method)
+            return self.send_json(503, {'status': 'failed'})
+        return handler(self)
+
+    def do_GET(self):
+        self.server.calls.append('GET')
+        return self.handle_flaky('GET', ChapaStubHandler.do_GET)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.calls.append('POST')
+        return self.handle_flaky('POST', lambda handler: handler.send_json(200, {'status': 'success', 'data': {}}))
+
+
+class ChapaServiceTests(TestCase):
+    def setUp(self):
+        self.stub = ChapaStubServer(handler=FlakyChapaHandler)
+        self.stub.failures_seen = set()
+        self.stub.calls = []
+        self.stub.start()
+        self.addCleanup(self.stub.stop)
+        self.service = ChapaService()
+        self.service.base_url = self.stub.base_url
+
+    def test_session_is_shared(self):
+        self.assertIs(ChapaService().session, self.service.session)
+
+    def test_verify_is_retried(self):
+        response = self.service.verify_payment('ALX_TRAVEL_1_abc')
+        self.assertEqual(response['data']['status'], 'success')
+        self.assertEqual(self.stub.calls, ['GET', 'GET'])
+
+    def test_initiate_is_not_retried(self):
+        response = self.service.initiate_payment(
+            amount=100, currency='ETB', email='guest@example.com', first_name='Guest',
+            last_name='', tx_ref='ALX_TRAVEL_1_abc'
+        )
+        self.assertIsNone(response)
+        self.assertEqual(self.stub.calls, ['POST'])
+
+
+class HtmlChapaHandler(ChapaStubHandler):
+    """Answers 200 with an HTML page, as a proxy in front of the gateway might"""
+
+    def send_html(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        body = b'<html>Bad gateway</html>'
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = send_html
+
+
+class ChapaInvalidBodyTests(TestCase):
+    def setUp(self):
+        self.stub = ChapaStubServer(handler=HtmlChapaHandler).start()
+        self.addCleanup(self.stub.stop)
+        patcher = mock.patch.dict(os.environ, {'CHAPA_BASE_URL': self.stub.base_url})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_both_clients_report_none(self):
+        kwargs = {'amount': 100, 'currency': 'ETB', 'email': 'guest@example.com', 'first_name': 'Guest',
+                  'last_name': '', 'tx_ref': 'ALX_TRAVEL_1_abc'}
+        self.assertIsNone(await sync_to_async(ChapaService().initiate_payment)(**kwargs))
+        self.assertIsNone(await sync_to_async(ChapaService().verify_payment)('ALX_TRAVEL_1_abc'))
+        self.assertIsNone(await AsyncChapaService().initiate_payment(**kwargs))
+        self.assertIsNone(await AsyncChapaService().verify_payment('ALX_TRAVEL_1_abc'))
+
+
+class PaymentViewTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.guest = User.objects.create_user(username='guest', email='guest@example.com', password='testpass123')
+        cls.listing = Listing.objects.create(
+            title='Villa', description='d', location='Cape Town', price_per_night=150, owner=cls.guest
+        )
+        cls.booking = Booking.objects.create(
+            listing=cls.listing, user=cls.guest, start_date=date(2030, 1, 1),
+            end_date=date(2030, 1, 3), total_price=300
+        )
+
+    def setUp(self):
+        super().setUp()
+        self.stub = ChapaStubServer().start()
+        self.addCleanup(self.stub.stop)
+        patcher = mock.patch.dict(os.environ, {'CHAPA_BASE_URL': self.stub.base_url})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def initiate_payload(self):
+        return {'booking_id': self.booking.id, 'return_url': 'https://example.com/done'}
+
+    def test_initiate_and_verify(self):
+        response = self.client.post(reverse('initiate-payment'), self.initiate_payload(), content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        tx_ref = response.data['chapa_tx_ref']
+
+        # Verification is queued rather than done inline
+        with mock.patch('listings.views.verify_payment_task.delay') as delay:
+            response = self.client.post(reverse('verify-payment', args=[tx_ref]))
+        self.assertEqual(response.status_code, 202)
+        delay.assert_called_once_with(tx_ref)
+
+        self.assertEqual(verify_payment_task(tx_ref), 'COMPLETED')
+        self.booking.refresh_from_db()
+        self.assertEqual(self.booking.status, 'CONFIRMED')
+        with mock.patch('listings.tasks.send_booking_confirmation_emails.delay', side_effect=send_booking_confirmation_emails):
+            self.assertEqual(send_pending_confirmations(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('Villa', mail.outbox[0].subject)
+
+        # Settled payments are answered without queueing another check
+        with mock.patch('listings.views.verify_payment_task.delay') as delay:
+            response = self.client.post(reverse('verify-payment', args=[tx_ref]))
+        self.assertEqual(response.status_code, 200)
+        delay.assert_not_called()
+
+    def test_webhook_queues_verification(self):
+        with mock.patch('listings.views.verify_payment_task.delay') as delay:
+            response = self.client.get(reverse('chapa-webhook'), {'trx_ref': 'ALX_TRAVEL_1_abc', 'status': 'success'})
+        self.assertEqual(response.status_code, 200)
+        delay.assert_called_once_with('ALX_TRAVEL_1_abc')
+
+    def test_unknown_refs_never_reach_the_gateway(self):
+        with mock.patch('listings.tasks.ChapaService.verify_payment') as verify:
+            self.assertIsNone(verify_payment_task('ALX_TRAVEL_1_forged'))
+        verify.assert_not_called()
+
+    def test_webhook_rejects_bad_signature(self):
+        with mock.patch.dict(os.environ, {'CHAPA_WEBHOOK_SECRET': 'shh'}), \
+                mock.patch('listings.views.verify_payment_task.delay') as delay:
+            response = self.client.post(
+                reverse('chapa-webhook'), {'tx_ref': 'ALX_TRAVEL_1_abc'},
+                content_type='application/json', HTTP_CHAPA_SIGNATURE='forged'
+            )
+        self.assertEqual(response.status_code, 403)
+        delay.assert_not_called()
+
+    def test_reconciler_settles_stale_pending_payments(self):
+        guest = self.guest
+        payments = []
+        for i in range(5):
+            booking = Booking.objects.create(
+                listing=self.listing, user=guest, start_date=date(2031, 1, 1 + i * 2),
+                end_date=date(2031, 1, 2 + i * 2), total_price=150
+            )
+            payments.append(Payment.objects.create(
+                booking=booking, transaction_id=f'ALX_R_{i}', chapa_tx_ref=f'ALX_R_{i}', amount=150
+            ))
+        fresh = payments.pop()
+        Payment.objects.filter(pk__in=[p.pk for p in payments]).update(
+            created_at=timezone.now() - timedelta(hours=1)
+        )
+
+        result = reconcile_pending_payments(batch_size=2, concurrency=2, stale_after_minutes=15)
+
+        self.assertEqual(result, {'checked': 4, 'settled': 4})
+        self.assertEqual(Payment.objects.filter(status='COMPLETED').count(), 4)
+        self.assertEqual(Booking.objects.filter(status='CONFIRMED').count(), 4)
+        fresh.refresh_from_db()
+        self.assertEqual(fresh.status, 'PENDING')
+
+    async def test_async_initiate_and_verify(self):
+        response = await self.async_client.post(
+            reverse('initiate-payment-async'), self.initiate_payload(), content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 201)
+        tx_ref = response.json()['chapa_tx_ref']
+
+        response = await self.async_client.post(reverse('verify-payment-async', args=[tx_ref]))
+        self.assertEqual(response.json()['status'], 'COMPLETED')
+        booking = await Booking.objects.aget(pk=self.booking.pk)
+        self.assertEqual(booking.status, 'CONFIRMED')
+
+    async def test_async_initiate_unknown_booking(self):
+        response = await self.async_client.post(
+            reverse('initiate-payment-async'),
+            {'booking_id': 0, 'return_url': 'https://example.com/done'},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class CountingChapaHandler(ChapaStubHandler):
+    """Records every gateway request on server.calls"""
+
+    def do_POST(self):
+        self.server.calls.append('POST')
+        return super().do_POST()
+
+
+class IdempotentPaymentTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.guest = User.objects.create_user(username='guest', email='guest@example.com')
+        cls.listing = Listing.objects.create(
+            title='Villa', description='d', location='Cape Town', price_per_night=150, owner=cls.guest
+        )
+        cls.booking = Booking.objects.create(
+            listing=cls.listing, user=cls.guest, start_date=date(2030, 1, 1),
+            end_date=date(2030, 1, 3), total_price=300
+        )
+
+    def setUp(self):
+        super().setUp()
+        self.stub = ChapaStubServer(handler=CountingChapaHandler)
+        self.stub.calls = []
+        self.stub.start()
+        self.addCleanup(self.stub.stop)
+        patcher = mock.patch.dict(os.environ, {'CHAPA_BASE_URL': self.stub.base_url})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def initiate(self, key, return_url='https://example.com/done'):
+        return self.client.post(
+            reverse('initiate-payment'), {'booking_id': self.booking.id, 'return_url': return_url},
+            content_type='application/json', HTTP_IDEMPOTENCY_KEY=key
+        )
+
+    def test_repeat_replays_stored_response(self):
+        first = self.initiate('key-1')
+        self.assertEqual(first.status_code, 201)
+        repeat = self.initiate('key-1')
+        self.assertEqual(repeat.status_code, 201)
+        self.assertEqual(repeat.data, first.data)
+        self.assertEqual(repeat['Idempotent-Replayed'], 'true')
+        self.assertEqual(self.stub.calls, ['POST'])
+
+    def test_database_row_answers_when_cache_is_cold(self):
+        first = self.initiate('key-1')
+        cache.clear()
+        repeat = self.initiate('key-1')
+        self.assertEqual((repeat.status_code, repeat.data), (201, first.data))
+        self.assertEqual(self.stub.calls, ['POST'])
+
+    def test_key_reuse_for_other_request_is_rejected(self):
+        self.initiate('key-1')
+        self.assertEqual(self.initiate('key-1', return_url='https://example.com/other').status_code, 422)
+        self.assertEqual(self.initiate('x' * 256).status_code, 400)
+
+    def test_new_key_for_pending_payment_skips_gateway(self):
+        first = self.initiate('key-1')
+        second = self.initiate('key-2')
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.data['chapa_tx_ref'], first.data['chapa_tx_ref'])
+        self.assertEqual(self.stub.calls, ['POST'])
+
+    async def test_async_initiate_shares_the_key_store(self):
+        async def initiate(key, return_url='https://example.com/done'):
+            return await self.async_client.post(
+                reverse('initiate-payment-async'), {'booking_id': self.booking.id, 'return_url': return_url},
+                content_type='application/json', headers={'Idempotency-Key': key}
+            )
+
+        first = await initiate('key-1')
+        self.assertEqual(first.status_code, 201)
+        repeat = await initiate('key-1')
+        self.assertEqual((repeat.status_code, repeat.json()), (201, first.json()))
+        self.assertEqual(repeat['Idempotent-Replayed'], 'true')
+        self.assertEqual((await initiate('key-1', return_url='https://example.com/other')).status_code, 422)
+        self.assertEqual((await initiate('x' * 256)).status_code, 400)
+
+        # Keys and the booking lock are shared with the sync endpoint
+        synced = await sync_to_async(self.initiate)('key-1')
+        self.assertEqual((synced.status_code, synced.data), (201, first.json()))
+        second = await initiate('key-2')
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.json()['chapa_tx_ref'], first.json()['chapa_tx_ref'])
+        self.assertEqual(self.stub.calls, ['POST'])
+
+
+class IdempotentPaymentRaceTests(TransactionTestCase):
+    """Concurrent retries of one initiation"""
+    THREADS = 8
+
+    def setUp(self):
+        cache.clear()
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('Shared-cache in-memory SQLite reports lock conflicts instead of waiting')
+        guest = User.objects.create_user(username='guest', email='guest@example.com')
+        listing = Listing.objects.create(
+            title='Villa', description='d', location='Cape Town', price_per_night=150, owner=guest
+        )
+        self.booking = Booking.objects.create(
+            listing=listing, user=guest, start_date=date(2030, 1, 1), end_date=date(2030, 1, 3), total_price=300
+        )
+        self.stub = ChapaStubServer(latency=0.05, handler=CountingChapaHandler)
+        self.stub.calls = []
+        self.stub.start()
+        self.addCleanup(self.stub.stop)
+        patcher = mock.patch.dict(os.environ, {'CHAPA_BASE_URL': self.stub.base_url})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def attempt(self, barrier):
+        barrier.wait()
+        try:
+            response = Client().post(
+                reverse('initiate-payment'),
+                {'booking_id': self.booking.id, 'return_url': 'https://example.com/done'},
+                content_type='application/json', HTTP_IDEMPOTENCY_KEY='retry-1'
+            )
+            return response.status_code, response.json()['chapa_tx_ref']
+        finally:
+            connection.close()
+
+    def test_one_gateway_call_per_booking(self):
+        barrier = threading.Barrier(self.THREADS)
+        with ThreadPoolExecutor(max_workers=self.THREADS) as pool:
+            results = list(pool.map(lambda _: self.attempt(barrier), range(self.THREADS)))
+        self.assertEqual(self.stub.calls, ['POST'])
+        self.assertEqual({status_code for status_code, _ in results}, {201})
+        self.assertEqual(len({tx_ref for _, tx_ref in results}), 1)
+        self.assertEqual(Payment.objects.count(), 1)
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class CircuitBreakerTests(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker('test', failure_threshold=3, recovery_timeout=10, clock=self.clock)
+        self.bulkhead = Bulkhead('test', max_concurrent=2)
+
+    def call(self, exc=None):
+        with guarded_call(self.breaker, self.bulkhead, lambda e: not isinstance(e, ValueError)):
+            if exc:
+                raise exc
+
+    def test_opens_after_consecutive_failures_then_probes(self):
+        for _ in range(2):
+            with self.assertRaises(ConnectionError):
+                self.call(ConnectionError())
+        self.call()  # a success resets the count
+        for _ in range(3):
+            with self.assertRaises(ConnectionError):
+                self.call(ConnectionError())
+        self.assertEqual(self.breaker.state, 'open')
+
+        self.clock.now = 4
+        with self.assertRaises(CallRejected) as rejected:
+            self.call()
+        self.assertEqual((rejected.exception.reason, rejected.exception.retry_after), ('circuit_open', 6))
+
+        # Half-open: one probe at a time; its failure reopens the circuit
+        self.clock.now = 10
+        self.breaker.allow()
+        with self.assertRaises(CallRejected):
+            self.breaker.allow()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, 'open')
+
+        self.clock.now = 20
+        self.call()
+        self.assertEqual(self.breaker.state, 'closed')
+
+    def test_client_errors_do_not_count(self):
+        for _ in range(5):
+            with self.assertRaises(ValueError):
+                self.call(ValueError())
+        self.assertEqual(self.breaker.state, 'closed')
+
+    def test_bulkhead_rejects_beyond_capacity(self):
+        with self.bulkhead.slot(), self.bulkhead.slot():
+            with self.assertRaises(CallRejected) as rejected:
+                with self.bulkhead.slot():
+                    pass
+        self.assertEqual(rejected.exception.reason, 'bulkhead_full')
+        with self.bulkhead.slot():
+            pass
+
+
+class ChapaCircuitTests(APITestCase):
+    """ChapaService and the payment views against a fault-injecting stub"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.guest = User.objects.create_user(username='guest', email='guest@example.com')
+        cls.listing = Listing.objects.create(
+            title='Villa', description='d', location='Cape Town', price_per_night=150, owner=cls.guest
+        )
+        cls.booking = Booking.objects.create(
+            listing=cls.listing, user=cls.guest, start_date=date(2030, 1, 1),
+            end_date=date(2030, 1, 3), total_price=300
+        )
+
+    def setUp(self):
+        super().setUp()
+        self.stub = ChapaStubServer(handler=CountingChapaHandler, fault_status=502)
+        self.stub.calls = []
+        self.stub.start()
+        self.addCleanup(self.stub.stop)
+        for patcher in (
+            mock.patch.dict(os.environ, {
+                'CHAPA_BASE_URL': self.stub.base_url,
+                'CHAPA_BREAKER_FAILURE_THRESHOLD': '2',
+                'CHAPA_BREAKER_RECOVERY_TIMEOUT': '0.3',
+                'CHAPA_MAX_CONCURRENT_CALLS': '1',
+                'CHAPA_BULKHEAD_TIMEOUT': '0',
+            }),
+            # A fresh breaker per test, built from the settings above
+            mock.patch('listings.chapa_service._gateway', None),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def initiate(self):
+        return self.client.post(
+            reverse('initiate-payment'), {'booking_id': self.booking.id, 'return_url': 'https://example.com/done'},
+            content_type='application/json'
+        )
+
+    def test_open_circuit_fails_fast_until_probe_succeeds(self):
+        self.assertEqual([self.initiate().status_code for _ in range(2)], [500, 500])
+
+        began = time.perf_counter()
+        response = self.initiate()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertLess(time.perf_counter() - began, 0.2)
+        self.assertEqual(self.stub.calls, ['POST', 'POST'])
+
+        self.stub.fault_status = None
+        time.sleep(0.3)
+        self.assertEqual(self.initiate().status_code, 201)
+        self.assertEqual(get_gateway()[0].state, 'closed')
+
+    def test_bulkhead_caps_in_flight_calls(self):
+        self.stub.fault_status = None
+        self.stub.latency = 0.3
+        service = ChapaService()
+        barrier = threading.Barrier(3)
+
+        def verify(tx_ref):
+            barrier.wait()
+            try:
+                return service.verify_payment(tx_ref)['data']['status']
+            except CallRejected as e:
+                return e.reason
+
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            outcomes = sorted(pool.map(verify, ['TX_1', 'TX_2', 'TX_3']))
+        self.assertEqual(outcomes, ['bulkhead_full', 'bulkhead_full', 'success'])
+
+    def test_loadtest_sizes_its_own_bulkhead(self):
+        # The shared bulkhead above admits one call; the load test must not be held to it
+        out = StringIO()
+        call_command('loadtest_chapa', calls=12, workers=3, concurrency=6, latency=0.05, stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        for line in lines:
+            self.assertIn('calls=12 rejected=0', line)
+
+class PricingTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='host')
+        cls.listing = Listing.objects.create(
+            title='Villa', description='d', location='Cape Town', price_per_night=100, owner=cls.owner
+        )
+        # A Monday a few weeks out, inside the cached horizon
+        today = timezone.localdate()
+        cls.monday = today + timedelta(days=28 - today.weekday())
+        PricingRule.objects.create(listing=cls.listing, kind='WEEKEND', adjustment_percent=10)
+        PricingRule.objects.create(
+            listing=cls.listing, kind='SEASON', adjustment_percent=50,
+            start_date=cls.monday + timedelta(days=7), end_date=cls.monday + timedelta(days=13)
+        )
+        PricingRule.objects.create(listing=cls.listing, kind='LENGTH_OF_STAY', adjustment_percent=-10, min_nights=7)
+
+    def quote(self, stays, **extra):
+        return self.client.post(reverse('price-quotes'), {'stays': stays, **extra}, content_type='application/json')
+
+    def stay(self, first_day, nights):
+        start = self.monday + timedelta(days=first_day)
+        return {'listing': self.listing.pk, 'start_date': str(start), 'end_date': str(start + timedelta(days=nights))}
+
+    def test_rules_shape_the_total(self):
+        response = self.quote([self.stay(0, 3), self.stay(4, 2), self.stay(6, 2), self.stay(0, 7)])
+        self.assertEqual(response.status_code, 200)
+        totals = [(q['subtotal'], q['discount'], q['total']) for q in response.data['results']]
+        self.assertEqual(totals, [
+            ('300.00', '0.00', '300.00'),        # weekdays at the base rate
+            ('220.00', '0.00', '220.00'),        # Friday and Saturday nights
+            ('250.00', '0.00', '250.00'),        # Sunday, then the first night of the season
+            ('720.00', '72.00', '648.00'),       # a week qualifies for the discount
+        ])
+
+    def test_currency_and_errors(self):
+        with override_settings(PRICING_EXCHANGE_RATES=['USD=0.0069']):
+            response = self.quote([self.stay(0, 3), {'listing': 0, 'start_date': '2030-01-02', 'end_date': '2030-01-01'},
+                                   {'listing': 999999, 'start_date': '2030-01-01', 'end_date': '2030-01-02'}], currency='usd')
+        self.assertEqual(response.data['results'][0]['total'], '2.07')
+        self.assertEqual(response.data['results'][0]['currency'], 'USD')
+        self.assertEqual([error['index'] for error in response.data['errors']], [1, 2])
+        self.assertEqual(self.quote([self.stay(0, 3)], currency='XYZ').status_code, 400)
+
+    def test_calendars_are_cached_and_invalidated(self):
+        self.quote([self.stay(0, 3)])
+        with self.assertNumQueries(0):
+            quote_stays([(self.listing.pk, self.monday, self.monday + timedelta(days=3))])
+
+        self.client.post(
+            reverse('listing-pricing-rules', args=[self.listing.pk]),
+            {'kind': 'SEASON', 'adjustment_percent': '20', 'start_date': str(self.monday), 'end_date': str(self.monday)},
+            content_type='application/json'
+        )
+        self.assertEqual(self.quote([self.stay(0, 3)]).data['results'][0]['total'], '320.00')
+
+        self.listing.price_per_night = 200
+        self.listing.save()
+        self.assertEqual(self.quote([self.stay(1, 1)]).data['results'][0]['total'], '200.00')
+
+    def test_booking_is_charged_the_quote(self):
+        self.client.force_login(self.owner)
+        stay = self.stay(4, 2)
+        response = self.client.post(reverse('booking-list-create'), {'listing': self.listing.pk, 'start_date': stay['start_date'],
+                                                                    'end_date': stay['end_date'], 'total_price': '1.00'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['total_price'], '220.00')
+
+        # Moving the stay reprices it; the client's figure is ignored again
+        stay = self.stay(0, 3)
+        response = self.client.put(reverse('booking-detail', args=[response.data['id']]), {
+            'listing': self.listing.pk, 'start_date': stay['start_date'], 'end_date': stay['end_date'], 'total_price': '1.00',
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total_price'], '300.00')
+
+    def test_rule_validation(self):
+        url = reverse('listing-pricing-rules', args=[self.listing.pk])
+        self.assertEqual(self.client.post(url, {'kind': 'SEASON', 'adjustment_percent': '5'}).status_code, 400)
+        self.assertEqual(self.client.post(url, {'kind': 'LENGTH_OF_STAY', 'adjustment_percent': '-5'}).status_code, 400)
+        self.assertEqual(self.client.post(url, {'kind': 'WEEKEND', 'adjustment_percent': '-100'}).status_code, 400)
+
+class BulkBookingTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.guest = User.objects.create_user(username='partner', email='partner@example.com', password='testpass123')
+        cls.listings = [
+            Listing.objects.create(
+                title=f'Listing {i}', description='d', location='Cape Town', price_per_night=100, owner=cls.guest
+            )
+            for i in range(3)
+        ]
+        Booking.objects.create(
+            listing=cls.listings[0], user=cls.guest, start_date=date(2030, 3, 1),
+            end_date=date(2030, 3, 5), total_price=400, status='CONFIRMED'
+        )
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.guest)
+
+    def post(self, items):
+        return self.client.post(reverse('booking-bulk-create'), items, content_type='application/json')
+
+    def item(self, listing, start, end):
+        return {'listing': listing.id, 'start_date': start, 'end_date': end}
+
+    def test_partial_success_reports_per_item_errors(self):
+        response = self.post([
+            self.item(self.listings[0], '2030-03-03', '2030-03-06'),  # clashes with existing booking
+            self.item(self.listings[1], '2030-03-01', '2030-03-03'),
+            self.item(self.listings[1], '2030-03-02', '2030-03-04'),  # clashes within the batch
+            {'listing': self.listings[2].id, 'start_date': '2030-03-05', 'end_date': '2030-03-01'},
+            {'listing': 0, 'start_date': '2030-03-01', 'end_date': '2030-03-02'},
+            {**self.item(self.listings[2], '2030-03-01', '2030-03-03'), 'total_price': '1.00'},
+        ])
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(len(response.data['created']), 2)
+        # Two nights at 100, whatever the client sent
+        self.assertEqual([row['total_price'] for row in response.data['created']], ['200.00', '200.00'])
+        self.assertTrue(all(row['id'] for row in response.data['created']))
+        self.assertEqual([error['index'] for error in response.data['errors']], [0, 2, 3, 4])
+        self.assertEqual(Booking.objects.count(), 3)
+
+    def test_query_count_independent_of_batch_size(self):
+        def batch(month):
+            return [
+                self.item(listing, f'2031-{month:02d}-{day:02d}', f'2031-{month:02d}-{day + 1:02d}')
+                for listing in self.listings for day in range(1, 21, 2)
+            ]
+
+        # Price calendars cached up front, so both batches are measured warm
+        quote_stays([(listing.id, date(2031, 1, 1), date(2031, 1, 2)) for listing in self.listings])
+        with CaptureQueriesContext(connection) as small:
+            self.post(batch(1)[:3])
+        with CaptureQueriesContext(connection) as large:
+            self.assertEqual(self.post(batch(2)).status_code, 201)
+        self.assertEqual(len(small), len(large))
+
+    def test_requires_authentication(self):
+        self.client.logout()
+        response = self.post([self.item(self.listings[1], '2030-03-01', '2030-03-03')])
+        self.assertIn(response.status_code, (401, 403))
+
+
+class ConfirmationEmailTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.guest = User.objects.create_user(
+            username='guest', email='guest@example.com', first_name='Ada', last_name='Lovelace'
+        )
+        cls.listing = Listing.objects.create(
+            title='Villa & Garden', description='d', location='Cape Town', price_per_night=150, owner=cls.guest
+        )
+        cls.bookings = [
+            Booking.objects.create(
+                listing=cls.listing, user=cls.guest, start_date=date(2030, 1, 1 + i * 2),
+                end_date=date(2030, 1, 2 + i * 2), total_price=150
+            )
+            for i in range(5)
+        ]
+
+    def test_batch_sends_every_confirmation_over_one_connection(self):
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.open') as open_connection:
+            sent = send_booking_confirmation_emails([booking.id for booking in self.bookings])
+        self.assertEqual(sent, 5)
+        self.assertEqual(open_connection.call_count, 1)
+        self.assertEqual(len(mail.outbox), 5)
+
+        message = mail.outbox[0]
+        self.assertEqual(message.subject, 'Booking Confirmation - Villa & Garden')
+        self.assertIn('Dear Ada Lovelace', message.body)
+        self.assertIn('Property: Villa & Garden', message.body)
+        self.assertIn('Villa &amp; Garden', message.alternatives[0][0])
+
+    def test_outbox_sends_queued_confirmations_in_chunks(self):
+        self.client.force_login(self.guest)
+        response = self.client.post(reverse('booking-list-create'), {
+            'listing': self.listing.id, 'start_date': '2030-02-01', 'end_date': '2030-02-03',
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(mail.outbox), 0)
+        # Queued twice before a run, sent once
+        queue_confirmations([booking.id for booking in self.bookings] + [self.bookings[0].id])
+
+        with mock.patch('listings.tasks.send_booking_confirmation_emails.delay', side_effect=ConnectionError('broker down')):
+            self.assertEqual(send_pending_confirmations(chunk_size=2), 0)
+        self.assertEqual(PendingConfirmation.objects.count(), 6)
+
+        # Run each queued batch inline instead of through the broker
+        with mock.patch('listings.tasks.send_booking_confirmation_emails.delay', side_effect=send_booking_confirmation_emails), \
+                mock.patch('django.core.mail.backends.locmem.EmailBackend.open') as open_connection:
+            self.assertEqual(send_pending_confirmations(chunk_size=2), 6)
+        self.assertEqual(open_connection.call_count, 3)
+        self.assertEqual(len(mail.outbox), 6)
+        self.assertFalse(PendingConfirmation.objects.exists())
+
+
+class OverbookingTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.guest = User.objects.create_user(username='guest', email='guest@example.com')
+        cls.listing = Listing.objects.create(
+            title='Villa', description='d', location='Cape Town', price_per_night=150, owner=cls.guest
+        )
+
+    def book(self, start, end):
+        return self.client.post(reverse('booking-list-create'), {
+            'listing': self.listing.id, 'start_date': start, 'end_date': end, 'total_price': '300.00'
+        }, content_type='application/json')
+
+    def test_overlapping_booking_is_rejected(self):
+        self.client.force_login(self.guest)
+        self.assertEqual(self.book('2030-05-01', '2030-05-04').status_code, 201)
+        response = self.book('2030-05-03', '2030-05-06')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('non_field_errors', response.data)
+        self.assertEqual(self.book('2030-05-04', '2030-05-06').status_code, 201)
+
+    def test_anonymous_booking_is_refused_like_other_endpoints(self):
+        response = self.book('2030-05-01', '2030-05-04')
+        bulk = self.client.post(reverse('booking-bulk-create'), [], content_type='application/json')
+        self.assertEqual((response.status_code, response.data), (bulk.status_code, bulk.data))
+        self.assertEqual(self.client.get(reverse('booking-list-create')).status_code, 200)
+
+    def test_moving_a_booking_onto_another_is_rejected(self):
+        self.client.force_login(self.guest)
+        self.book('2030-05-01', '2030-05-04')
+        second = self.book('2030-05-10', '2030-05-12').data['id']
+        response = self.client.put(reverse('booking-detail', args=[second]), {
+            'listing': self.listing.id, 'start_date': '2030-05-02', 'end_date': '2030-05-05', 'total_price': '300.00'
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class OverbookingStressTests(TransactionTestCase):
+    """Concurrent writers racing for overlapping nights on one listing"""
+    THREADS = 16
+
+    def setUp(self):
+        cache.clear()
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('Shared-cache in-memory SQLite reports lock conflicts instead of waiting')
+        self.guest = User.objects.create_user(username='guest')
+        self.listing = Listing.objects.create(
+            title='Villa', description='d', location='Cape Town', price_per_night=150, owner=self.guest
+        )
+
+    def attempt(self, index, barrier):
+        barrier.wait()
+        start = date(2030, 6, 1) + timedelta(days=index % 4)
+        try:
+            save_booking(Booking(
+                listing_id=self.listing.id, user=self.guest, start_date=start,
+                end_date=start + timedelta(days=3), total_price=450
+            ))
+            return True
+        except BookingConflict:
+            return False
+        finally:
+            connection.close()
+
+    def test_no_double_bookings_under_contention(self):
+        barrier = threading.Barrier(self.THREADS)
+        began = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.THREADS) as pool:
+            results = list(pool.map(lambda i: self.attempt(i, barrier), range(self.THREADS)))
+        elapsed = time.perf_counter() - began
+
+        stays = list(Booking.objects.filter(listing=self.listing).values_list('start_date', 'end_date'))
+        self.assertEqual(len(stays), results.count(True))
+        self.assertGreaterEqual(len(stays), 1)
+        for i, (start, end) in enumerate(stays):
+            for other_start, other_end in stays[i + 1:]:
+                self.assertFalse(start < other_end and other_start < end, f'{stays} contains a double booking')
+        # Contenders are serialized, not stalled
+        self.assertLess(elapsed, 10)
+
+
+class RatingAggregateTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='owner')
+        cls.guests = [User.objects.create_user(username=f'guest{i}') for i in range(4)]
+        cls.listing = Listing.objects.create(
+            title='Villa', description='d', location='Cape Town', price_per_night=150, owner=cls.owner
+        )
+        cls.other = Listing.objects.create(
+            title='Loft', description='d', location='Johannesburg', price_per_night=80, owner=cls.owner
+        )
+
+    def aggregates(self, listing):
+        listing.refresh_from_db()
+        return str(listing.rating_avg), listing.rating_count, listing.rating_histogram
+
+    def test_incremental_updates(self):
+        first = Review.objects.create(listing=self.listing, user=self.guests[0], rating=5)
+        Review.objects.create(listing=self.listing, user=self.guests[1], rating=2)
+        self.assertEqual(self.aggregates(self.listing), ('3.50', 2, [0, 1, 0, 0, 1]))
+
+        first.rating = 4
+        first.save()
+        self.assertEqual(self.aggregates(self.listing), ('3.00', 2, [0, 1, 0, 1, 0]))
+
+        first.listing = self.other
+        first.save()
+        self.assertEqual(self.aggregates(self.listing), ('2.00', 1, [0, 1, 0, 0, 0]))
+        self.assertEqual(self.aggregates(self.other), ('4.00', 1, [0, 0, 0, 1, 0]))
+
+        Review.objects.filter(listing=self.listing).delete()
+        self.assertEqual(self.aggregates(self.listing), ('0.00', 0, [0, 0, 0, 0, 0]))
+
+    def test_rebuild_matches_incremental(self):
+        for i, rating in enumerate([5, 4, 4]):
+            Review.objects.create(listing=self.listing, user=self.guests[i], rating=rating)
+        Review.objects.create(listing=self.other, user=self.guests[3], rating=1)
+        expected = [self.aggregates(self.listing), self.aggregates(self.other)]
+
+        Listing.objects.update(rating_avg=0, rating_count=0, rating_histogram=[9, 9, 9, 9, 9])
+        self.assertEqual(rebuild_rating_aggregates(batch_size=1), 2)
+        self.assertEqual([self.aggregates(self.listing), self.aggregates(self.other)], expected)
+
+    def test_rating_ordered_pages(self):
+        Review.objects.create(listing=self.other, user=self.guests[0], rating=5)
+        Review.objects.create(listing=self.listing, user=self.guests[1], rating=3)
+        response = self.client.get(reverse('listing-list-create'), {'ordering': 'rating', 'page_size': 1})
+        self.assertEqual(response.data['results'][0]['id'], self.other.id)
+        response = self.client.get(reverse('listing-list-create'), {
+            'ordering': 'rating', 'page_size': 1, 'cursor': response.data['next_cursor']
+        })
+        self.assertEqual(response.data['results'][0]['id'], self.listing.id)
+        self.assertEqual(response.data['results'][0]['rating_avg'], '3.00')
+
+
+class ListingSearchTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='owner')
+        cls.villa = Listing.objects.create(
+            title='Ocean villa', description='Sea views and a pool', location='Cape Town',
+            price_per_night=300, owner=cls.owner
+        )
+        cls.cottage = Listing.objects.create(
+            title='Mountain cottage', description='Quiet stay, ocean in the distance', location='Drakensberg',
+            price_per_night=90, owner=cls.owner
+        )
+        cls.closed = Listing.objects.create(
+            title='Ocean flat', description='Closed for renovation', location='Durban',
+            price_per_night=120, owner=cls.owner, is_available=False
+        )
+
+    def search(self, **params):
+        response = self.client.get(reverse('listing-search'), params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return [item['id'] for item in response.data['results']]
+
+    def test_title_matches_rank_above_description_matches(self):
+        ids = self.search(q='ocean')
+        self.assertEqual(set(ids), {self.villa.id, self.cottage.id, self.closed.id})
+        self.assertEqual(ids[-1], self.cottage.id)
+
+    def test_every_term_must_match(self):
+        self.assertEqual(self.search(q='ocean cape'), [self.villa.id])
+        self.assertEqual(self.search(q='"ocean" -pool*'), [self.villa.id])
+        self.assertEqual(self.search(q='glacier'), [])
+
+    def test_filters_combine_with_text(self):
+        self.assertEqual(set(self.search(q='ocean', is_available='true')), {self.villa.id, self.cottage.id})
+        self.assertEqual(self.search(q='ocean', is_available='false'), [self.closed.id])
+        self.assertEqual(self.search(q='ocean', min_price='100', max_price='200'), [self.closed.id])
+
+    def test_index_follows_writes(self):
+        self.villa.title = 'Beach villa'
+        self.villa.save()
+        self.cottage.delete()
+        self.assertEqual(self.search(q='ocean'), [self.closed.id])
+        self.assertEqual(self.search(q='beach'), [self.villa.id])
+
+    def test_pages_and_validation(self):
+        response = self.client.get(reverse('listing-search'), {'q': 'ocean', 'page_size': 2})
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIn('relevance', response.data['results'][0])
+        response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIsNone(response.data['next'])
+
+        response = self.client.get(reverse('listing-search'), {'q': 'ocean', 'min_price': '300', 'max_price': '100'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(reverse('listing-search')).status_code, 400)
+
+
+class GeoSearchTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='owner', password='testpass123')
+
+        def listing(title, latitude, longitude, **extra):
+            return Listing.objects.create(
+                title=title, description='d', location='Cape Town', price_per_night=100, owner=cls.owner,
+                latitude=latitude, longitude=longitude, **extra
+            )
+        # Roughly 0, 3, 8 and 40 km from the centre of Cape Town
+        cls.centre = listing('Centre', -33.9249, 18.4241)
+        cls.near = listing('Near', -33.9249, 18.4566)
+        cls.closed = listing('Closed', -33.8530, 18.4241, is_available=False)
+        cls.far = listing('Far', -33.9249, 18.8562)
+        cls.nowhere = listing('Nowhere', None, None)
+        # Either side of the antimeridian
+        cls.fiji = listing('Fiji', -17.0, 179.9)
+        cls.samoa = listing('Samoa', -17.0, -179.9)
+
+    def nearby(self, **params):
+        response = self.client.get(reverse('listing-nearby'), params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def test_radius_search_orders_by_distance(self):
+        data = self.nearby(latitude=-33.9249, longitude=18.4241, radius_km=10)
+        self.assertEqual([item['id'] for item in data['results']], [self.centre.id, self.near.id, self.closed.id])
+        self.assertEqual(data['results'][0]['distance_km'], 0.0)
+        self.assertAlmostEqual(data['results'][1]['distance_km'], 3.0, delta=0.1)
+
+        data = self.nearby(latitude=-33.9249, longitude=18.4241, radius_km=50, is_available='true')
+        self.assertEqual([item['id'] for item in data['results']], [self.centre.id, self.near.id, self.far.id])
+
+    def test_pages(self):
+        data = self.nearby(latitude=-33.9249, longitude=18.4241, radius_km=50, page_size=2)
+        self.assertEqual([item['id'] for item in data['results']], [self.centre.id, self.near.id])
+        self.assertIsNotNone(data['next'])
+        data = self.nearby(latitude=-33.9249, longitude=18.4241, radius_km=50, page_size=2, page=2)
+        self.assertEqual([item['id'] for item in data['results']], [self.closed.id, self.far.id])
+        self.assertIsNone(data['next'])
+
+    def test_box_search(self):
+        data = self.nearby(min_lat=-34, max_lat=-33.8, min_lng=18.44, max_lng=19)
+        self.assertEqual({item['id'] for item in data['results']}, {self.near.id, self.far.id})
+        # A box wrapping across the antimeridian
+        data = self.nearby(min_lat=-18, max_lat=-16, min_lng=179, max_lng=-179)
+        self.assertEqual({item['id'] for item in data['results']}, {self.fiji.id, self.samoa.id})
+
+    def test_circle_across_the_antimeridian(self):
+        data = self.nearby(latitude=-17.0, longitude=179.95, radius_km=30)
+        self.assertEqual([item['id'] for item in data['results']], [self.fiji.id, self.samoa.id])
+
+    def test_geo_cell_follows_coordinates(self):
+        url = reverse('listing-detail', args=[self.far.id])
+        payload = {'title': 'Far', 'description': 'd', 'location': 'Cape Town', 'price_per_night': '100.00'}
+        response = self.client.put(url, {**payload, 'latitude': -33.9249, 'longitude': 18.4300}, content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.data)
+        data = self.nearby(latitude=-33.9249, longitude=18.4241, radius_km=2)
+        self.assertEqual([item['id'] for item in data['results']], [self.centre.id, self.far.id])
+
+        response = self.client.put(url, {**payload, 'latitude': None, 'longitude': 18.43}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalid_queries_rejected(self):
+        url = reverse('listing-nearby')
+        self.assertEqual(self.client.get(url, {'latitude': 1}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'latitude': 1, 'longitude': 1, 'radius_km': 5000}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'min_lat': -34, 'max_lat': -33}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'min_lat': -60, 'max_lat': 60, 'min_lng': 0, 'max_lng': 10}).status_code, 400)
+        # Only a few hundred km corner to corner the short way round, but 358 degrees wide
+        self.assertEqual(self.client.get(url, {'min_lat': -1, 'max_lat': 1, 'min_lng': -179, 'max_lng': 179}).status_code, 400)
+
+
+class SeedCommandTests(APITestCase):
+    def test_synthetic_volumes(self):
+        call_command(
+            'seed', users=20, listings=30, bookings=200, payments=50, reviews=60, chunk_size=7, stdout=StringIO()
+        )
+        self.assertEqual(User.objects.count(), 20)
+        self.assertEqual(Listing.objects.count(), 30)
+        self.assertEqual(Booking.objects.count(), 200)
+        self.assertEqual(Payment.objects.count(), 50)
+        self.assertEqual(Review.objects.count(), 60)
+        self.assertEqual(Listing.objects.filter(rating_count=2).count(), 30)
+
+        stays = {}
+        for listing_id, start, end in Booking.objects.values_list('listing_id', 'start_date', 'end_date'):
+            stays.setdefault(listing_id, []).append((start, end))
+        for intervals in stays.values():
+            intervals.sort()
+            for (_, end), (start, _) in zip(intervals, intervals[1:]):
+                self.assertLessEqual(end, start)
+
+    def test_without_volumes_seeds_samples(self):
+        call_command('seed', stdout=StringIO())
+        self.assertEqual(Listing.objects.count(), 3)
+
+
+@override_settings(REQUEST_TIMING_SAMPLE_RATE=1)
+class RequestTimingTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.guest = User.objects.create_user(username='guest', email='guest@example.com')
+        cls.listing = Listing.objects.create(
+            title='Villa', description='d', location='Cape Town', price_per_night=150, owner=cls.guest
+        )
+        cls.booking = Booking.objects.create(
+            listing=cls.listing, user=cls.guest, start_date=date(2030, 1, 1),
+            end_date=date(2030, 1, 3), total_price=300
+        )
+
+    def timing(self, response):
+        return {
+            part.split(';')[0]: part for part in response['Server-Timing'].split(', ')
+        }
+
+    def test_breakdown_header_and_log(self):
+        with self.assertLogs('listings.instrumentation', 'INFO') as logs:
+            response = self.client.get(reverse('listing-detail', args=[self.listing.id]))
+        timing = self.timing(response)
+        self.assertIn('desc="1 queries"', timing['db'])
+        self.assertIn('desc="0 calls"', timing['http'])
+        self.assertEqual(set(timing), {'db', 'http', 'serialize', 'total'})
+
+        record = logs.records[0].request_timing
+        self.assertEqual(record['path'], reverse('listing-detail', args=[self.listing.id]))
+        self.assertEqual(record['db_queries'], 1)
+        self.assertFalse(record['slow'])
+
+    def test_chapa_calls_are_counted(self):
+        with ChapaStubServer() as stub, mock.patch.dict(os.environ, {'CHAPA_BASE_URL': stub.base_url}):
+            response = self.client.post(
+                reverse('initiate-payment'),
+                {'booking_id': self.booking.id, 'return_url': 'https://example.com/done'},
+                content_type='application/json',
+            )
+            self.assertEqual(response.status_code, 201)
+            self.assertIn('desc="1 calls"', self.timing(response)['http'])
+
+            tx_ref = response.json()['chapa_tx_ref']
+            response = self.client.post(reverse('verify-payment-async', args=[tx_ref]))
+        self.assertEqual(response.status_code, 200)
+        timing = self.timing(response)
+        self.assertIn('desc="1 calls"', timing['http'])
+        # Queries made from sync_to_async threads still land on the request
+        self.assertNotIn('desc="0 queries"', timing['db'])
+
+    def test_sampling_and_slow_threshold(self):
+        with self.settings(REQUEST_TIMING_SAMPLE_RATE=0):
+            with self.assertNoLogs('listings.instrumentation'):
+                response = Client().get(reverse('listing-detail', args=[self.listing.id]))
+            self.assertFalse(response.has_header('Server-Timing'))
+
+            with self.settings(REQUEST_TIMING_SLOW_MS=0), self.assertLogs('listings.instrumentation', 'WARNING') as logs:
+                response = Client().get(reverse('listing-detail', args=[self.listing.id]))
+            self.assertFalse(response.has_header('Server-Timing'))
+            self.assertTrue(logs.records[0].request_timing['slow'])
+            self.assertNotIn('db_queries', logs.records[0].request_timing)
+
+
+class MetricsTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.guest = User.objects.create_user(username='guest', email='guest@example.com')
+        cls.listing = Listing.objects.create(
+            title='Villa', description='d', location='Cape Town', price_per_night=150, owner=cls.guest
+        )
+        cls.booking = Booking.objects.create(
+            listing=cls.listing, user=cls.guest, start_date=date(2030, 1, 1),
+            end_date=date(2030, 1, 3), total_price=300
+        )
+
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_view_latency_is_labelled_by_route(self):
+        before = self.sample('listings_view_latency_seconds_count', view='listing-detail', method='GET', status='200')
+        self.client.get(reverse('listing-detail', args=[self.listing.id]))
+        self.client.get('/no/such/path/')
+        after = self.sample('listings_view_latency_seconds_count', view='listing-detail', method='GET', status='200')
+        self.assertEqual(after - before, 1)
+        self.assertGreater(self.sample('listings_view_latency_seconds_count', view='unmatched', method='GET', status='404'), 0)
+
+    def test_payment_flow_metrics(self):
+        created = self.sample('listings_payment_status_transitions_total', from_status='none', to_status='PENDING')
+        completed = self.sample('listings_payment_status_transitions_total', from_status='PENDING', to_status='COMPLETED')
+        calls = self.sample('listings_chapa_request_latency_seconds_count', operation='verify')
+        tasks = self.sample('listings_celery_task_duration_seconds_count', task='listings.tasks.verify_payment_task', state='SUCCESS')
+
+        with ChapaStubServer() as stub, mock.patch.dict(os.environ, {'CHAPA_BASE_URL': stub.base_url}):
+            response = self.client.post(
+                reverse('initiate-payment'),
+                {'booking_id': self.booking.id, 'return_url': 'https://example.com/done'},
+                content_type='application/json',
+            )
+            verify_payment_task.apply(args=[response.data['chapa_tx_ref']])
+
+        self.assertEqual(self.sample('listings_payment_status_transitions_total', from_status='none', to_status='PENDING') - created, 1)
+        self.assertEqual(self.sample('listings_payment_status_transitions_total', from_status='PENDING', to_status='COMPLETED') - completed, 1)
+        self.assertEqual(self.sample('listings_chapa_request_latency_seconds_count', operation='verify') - calls, 1)
+        self.assertEqual(
+            self.sample('listings_celery_task_duration_seconds_count', task='listings.tasks.verify_payment_task', state='SUCCESS') - tasks, 1
+        )
+
+    def test_chapa_errors_and_task_retries(self):
+        errors = self.sample('listings_chapa_errors_total', operation='initialize', error='HTTPError')
+        retries = self.sample('listings_celery_task_retries_total', task='listings.tasks.send_booking_confirmation_email')
+
+        stub = ChapaStubServer(handler=FlakyChapaHandler)
+        stub.failures_seen, stub.calls = set(), []
+        with stub:
+            service = ChapaService()
+            service.base_url = stub.base_url
+            self.assertIsNone(service.initiate_payment(100, 'ETB', 'a@example.com', 'A', 'B', 'tx'))
+        with mock.patch('listings.tasks.build_confirmation_message', side_effect=ConnectionError('smtp down')):
+            send_booking_confirmation_email.apply(kwargs={
+                'booking_id': 1, 'user_email': 'a@example.com', 'user_name': 'A', 'listing_title': 'Villa',
+                'start_date': '2030-01-01', 'end_date': '2030-01-03', 'total_price': '300',
+            })
+
+        self.assertEqual(self.sample('listings_chapa_errors_total', operation='initialize', error='HTTPError') - errors, 1)
+        self.assertGreater(self.sample('listings_celery_task_retries_total', task='listings.tasks.send_booking_confirmation_email') - retries, 0)
+
+    def test_metrics_endpoint(self):
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'listings_payment_status_transitions_total', response.content)
+
+
+class ExportTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(username='finance', is_staff=True)
+        cls.guest = User.objects.create_user(username='guest', email='guest@example.com')
+        cls.listing = Listing.objects.create(
+            title='Villa, "sea view"', description='d', location='Cape Town', price_per_night=150, owner=cls.guest
+        )
+        cls.payments = []
+        for i in range(5):
+            booking = Booking.objects.create(
+                listing=cls.listing, user=cls.guest, start_date=date(2030, 1, 1 + i * 2),
+                end_date=date(2030, 1, 2 + i * 2), total_price=150
+            )
+            cls.payments.append(Payment.objects.create(
+                booking=booking, transaction_id=f'TXN_{i}', chapa_tx_ref=f'TX_{i}', amount=150,
+                status='COMPLETED' if i % 2 == 0 else 'PENDING',
+            ))
+        # Spread creation and payment across days
+        for i, payment in enumerate(cls.payments):
+            created = timezone.make_aware(datetime(2025, 3, 1 + i, 12))
+            Payment.objects.filter(pk=payment.pk).update(
+                created_at=created, paid_at=created + timedelta(days=1) if payment.status == 'COMPLETED' else None
+            )
+            Booking.objects.filter(pk=payment.booking_id).update(created_at=created)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.admin)
+
+    def export(self, kind, **params):
+        response = self.client.get(reverse('export-records', args=[kind]), params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_with_joined_fields(self):
+        rows = list(csv.DictReader(io.StringIO(self.export('payments'))))
+        self.assertEqual([row['transaction_id'] for row in rows], [f'TXN_{i}' for i in range(5)])
+        self.assertEqual(rows[0]['listing_title'], 'Villa, "sea view"')
+        self.assertEqual(rows[0]['user_email'], 'guest@example.com')
+
+    def test_ndjson_bookings_and_date_filters(self):
+        lines = self.export('bookings', output='ndjson', created_from='2025-03-02', created_to='2025-03-03').splitlines()
+        self.assertEqual([json.loads(line)['start_date'] for line in lines], ['2030-01-03', '2030-01-05'])
+
+        paid = self.export('payments', output='ndjson', paid_from='2025-03-03')
+        self.assertEqual([json.loads(line)['transaction_id'] for line in paid.splitlines()], ['TXN_2', 'TXN_4'])
+
+    def test_batches_keep_query_count_per_chunk(self):
+        with CaptureQueriesContext(connection) as queries:
+            batches = list(export_batches('payments', chunk_size=2))
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+        self.assertEqual(len(queries), 3)
+
+    def test_access_and_validation(self):
+        self.assertEqual(
+            self.client.get(reverse('export-records', args=['payments']), {'paid_from': '2025-03-05', 'paid_to': '2025-03-01'}).status_code, 400
+        )
+        self.assertEqual(self.client.get(reverse('export-records', args=['bookings']), {'paid_from': '2025-03-01'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('export-records', args=['users'])).status_code, 404)
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('export-records', args=['payments'])).status_code, 403)
+
+    def test_management_command(self):
+        out = StringIO()
+        call_command('export_records', 'payments', '--output-format', 'ndjson', '--created-to', '2025-03-02', stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 2)
+
+
+class AnalyticsRollupTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='host')
+        cls.guest = User.objects.create_user(username='guest')
+        cls.listing = Listing.objects.create(
+            title='Lodge', description='d', location='Nairobi', price_per_night=50, owner=cls.owner
+        )
+        cls.other = Listing.objects.create(
+            title='Loft', description='d', location='Nairobi', price_per_night=50, owner=cls.guest
+        )
+        cls.stay = Booking.objects.create(
+            listing=cls.listing, user=cls.guest, start_date=date(2030, 5, 1),
+            end_date=date(2030, 5, 4), total_price=100, status='CONFIRMED'
+        )
+        Payment.objects.create(
+            booking=cls.stay, transaction_id='TXN_A', chapa_tx_ref='TX_A', amount=100, status='COMPLETED'
+        )
+        # Confirmed but unpaid: occupied, no revenue. Pending: not counted at all.
+        Booking.objects.create(
+            listing=cls.listing, user=cls.guest, start_date=date(2030, 5, 10),
+            end_date=date(2030, 5, 11), total_price=50, status='CONFIRMED'
+        )
+        Booking.objects.create(
+            listing=cls.listing, user=cls.guest, start_date=date(2030, 5, 20),
+            end_date=date(2030, 5, 22), total_price=100
+        )
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.owner)
+
+    def daily(self, **params):
+        params = {'start_date': '2030-05-01', 'end_date': '2030-05-31', **params}
+        return self.client.get(reverse('listing-daily-analytics', args=[self.listing.pk]), params)
+
+    def test_revenue_is_split_by_night_to_the_cent(self):
+        self.assertEqual(nightly_revenue(Decimal('100.00'), 3), [Decimal('33.34'), Decimal('33.33'), Decimal('33.33')])
+
+    def test_backfill_feeds_daily_endpoint(self):
+        call_command('backfill_rollups', stdout=StringIO())
+        response = self.daily()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['days']), 31)
+        self.assertEqual(response.data['occupied_nights'], 4)
+        self.assertEqual(response.data['revenue'], '100.00')
+        self.assertEqual(response.data['occupancy_rate'], round(4 / 31, 4))
+        self.assertEqual(response.data['days'][0]['check_ins'], 1)
+        self.assertEqual(response.data['days'][0]['revenue'], '33.34')
+
+    def test_refresh_only_rebuilds_changes_after_watermark(self):
+        self.assertEqual(refresh_daily_stats(lag_seconds=0)['listings'], 1)
+        self.assertEqual(ListingDailyStat.objects.count(), 4)
+        self.assertEqual(refresh_daily_stats(lag_seconds=0)['listings'], 0)
+
+        self.stay.status = 'CANCELLED'
+        self.stay.save()
+        self.assertEqual(refresh_daily_stats(lag_seconds=0), {'listings': 1, 'rows': 1})
+        self.assertEqual(self.daily().data['revenue'], '0.00')
+
+    def test_deleted_booking_rebuilds_its_listing(self):
+        refresh_daily_stats(lag_seconds=0)
+        with mock.patch('listings.signals.rebuild_listing_rollups.delay') as delay, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.stay.delete()
+        delay.assert_called_once_with([self.listing.pk])
+
+        rebuild_listing_rollups([self.listing.pk])
+        self.assertEqual(list(ListingDailyStat.objects.values_list('date', flat=True)), [date(2030, 5, 10)])
+
+    def test_owner_totals_cover_only_own_listings(self):
+        refresh_daily_stats(lag_seconds=0)
+        response = self.client.get(reverse('owner-analytics'), {'start_date': '2030-05-02', 'end_date': '2030-05-11'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], [{
+            'listing': self.listing.pk, 'title': 'Lodge', 'revenue': '66.66', 'occupied_nights': 3,
+            'occupancy_rate': 0.3, 'check_ins': 1,
+        }])
+
+    def test_access_and_validation(self):
+        self.assertEqual(self.client.get(
+            reverse('listing-daily-analytics', args=[self.other.pk])
+        ).status_code, 404)
+        self.assertEqual(self.daily(start_date='2030-06-01').status_code, 400)
+        self.assertEqual(self.daily(start_date='2028-01-01').status_code, 400)
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('owner-analytics')).status_code, 403)
+
+
+class PendingExpiryTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.guest = User.objects.create_user(username='guest', email='guest@example.com', password='testpass123')
+        cls.listing = Listing.objects.create(
+            title='Villa', description='d', location='Cape Town', price_per_night=100, owner=cls.guest
+        )
+        cls.month = (timezone.localdate().replace(day=1) + timedelta(days=40)).replace(day=1)
+
+        def booking(day, status='PENDING', hours_old=0):
+            booking = Booking.objects.create(
+                listing=cls.listing, user=cls.guest, start_date=cls.month + timedelta(days=day),
+                end_date=cls.month + timedelta(days=day + 2), total_price=200, status=status
+            )
+            Booking.objects.filter(pk=booking.pk).update(created_at=timezone.now() - timedelta(hours=hours_old))
+            return booking
+
+        def payment(booking, status='PENDING', hours_old=0):
+            payment = Payment.objects.create(
+                booking=booking, transaction_id=f'ALX_E_{booking.pk}', chapa_tx_ref=f'ALX_E_{booking.pk}',
+                amount=200, status=status
+            )
+            Payment.objects.filter(pk=payment.pk).update(created_at=timezone.now() - timedelta(hours=hours_old))
+            return payment
+
+        cls.abandoned = booking(0, hours_old=2)
+        cls.fresh = booking(3)
+        cls.confirmed = booking(6, status='CONFIRMED', hours_old=2)
+        cls.checking_out = booking(9, hours_old=2)
+        payment(cls.checking_out, hours_old=2)
+        cls.expired_checkout = booking(12, hours_old=30)
+        cls.expired_payment = payment(cls.expired_checkout, hours_old=30)
+        cls.paid = payment(booking(15, status='CONFIRMED', hours_old=30), status='COMPLETED', hours_old=30)
+        cls.old_key = IdempotencyKey.objects.create(key='old', fingerprint='f', response_status=201, response_body={})
+        IdempotencyKey.objects.filter(pk=cls.old_key.pk).update(created_at=timezone.now() - timedelta(days=2))
+        IdempotencyKey.objects.create(key='new', fingerprint='f', response_status=201, response_body={})
+
+    def setUp(self):
+        super().setUp()
+        # Abandoned checkouts are still unpaid when the sweeper asks Chapa about them
+        self.stub = ChapaStubServer(verify_status='pending').start()
+        self.addCleanup(self.stub.stop)
+        patcher = mock.patch.dict(os.environ, {'CHAPA_BASE_URL': self.stub.base_url})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def statuses(self, *objects):
+        return [type(obj).objects.get(pk=obj.pk).status for obj in objects]
+
+    def booked(self):
+        response = self.client.get(reverse('listing-calendar', args=[self.listing.pk]), {'month': self.month.strftime('%Y-%m')})
+        return [day['date'].day for day in response.data['months'][0]['days'] if day['booked']]
+
+    def test_sweep_cancels_only_expired_rows(self):
+        self.assertEqual(self.booked(), [1, 2, 4, 5, 7, 8, 10, 11, 13, 14, 16, 17])
+        before = REGISTRY.get_sample_value('listings_payment_status_transitions_total',
+                                           {'from_status': 'PENDING', 'to_status': 'CANCELLED'}) or 0
+        stamped = timezone.now()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            result = sweep_pending()
+
+        self.assertEqual(result, {'payments': 1, 'bookings': 2, 'nights': 4, 'idempotency_keys': 1, 'paid': 0})
+        self.assertEqual(
+            self.statuses(self.abandoned, self.fresh, self.confirmed, self.checking_out, self.expired_checkout),
+            ['CANCELLED', 'PENDING', 'CONFIRMED', 'PENDING', 'CANCELLED'],
+        )
+        self.assertEqual(self.statuses(self.expired_payment, self.paid), ['CANCELLED', 'COMPLETED'])
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['new'])
+        # Stamped for the analytics rollups, which bulk_update would otherwise skip
+        self.assertGreaterEqual(Booking.objects.get(pk=self.abandoned.pk).updated_at, stamped)
+        self.assertGreaterEqual(Payment.objects.get(pk=self.expired_payment.pk).updated_at, stamped)
+        self.assertEqual(self.booked(), [4, 5, 7, 8, 10, 11, 16, 17])
+        after = REGISTRY.get_sample_value('listings_payment_status_transitions_total',
+                                          {'from_status': 'PENDING', 'to_status': 'CANCELLED'})
+        self.assertEqual(after - before, 1)
+        self.assertEqual(sweep_pending(), {'payments': 0, 'bookings': 0, 'nights': 0, 'idempotency_keys': 0, 'paid': 0})
+
+    def test_batches_are_bounded(self):
+        for day in (20, 23):
+            Booking.objects.filter(pk=Booking.objects.create(
+                listing=self.listing, user=self.guest, start_date=self.month + timedelta(days=day),
+                end_date=self.month + timedelta(days=day + 1), total_price=100
+            ).pk).update(created_at=timezone.now() - timedelta(hours=3))
+        before = REGISTRY.get_sample_value('listings_pending_sweep_reclaimed_total', {'kind': 'bookings'}) or 0
+
+        self.assertEqual(sweep_pending(batch_size=1, max_batches=2)['bookings'], 3)
+        self.assertEqual(sweep_pending(batch_size=1, max_batches=2)['bookings'], 1)
+        after = REGISTRY.get_sample_value('listings_pending_sweep_reclaimed_total', {'kind': 'bookings'})
+        self.assertEqual(after - before, 4)
+
+    def test_gateway_is_asked_before_cancelling(self):
+        # No answer from Chapa: nothing is cancelled on a guess
+        self.stub.fault_status = 404
+        self.assertEqual(sweep_pending()['payments'], 0)
+        self.assertEqual(self.statuses(self.expired_payment), ['PENDING'])
+
+        # Paid just before the sweep: settled and confirmed instead
+        self.stub.fault_status = None
+        self.stub.verify_status = 'success'
+        with self.captureOnCommitCallbacks(execute=True):
+            result = sweep_pending()
+        self.assertEqual((result['payments'], result['paid']), (0, 1))
+        self.assertEqual(self.statuses(self.expired_payment, self.expired_checkout), ['COMPLETED', 'CONFIRMED'])
+        self.assertEqual(list(PendingConfirmation.objects.values_list('booking_id', flat=True)), [self.expired_checkout.pk])
+
+    def test_capture_after_cancellation_is_flagged(self):
+        sweep_pending()
+        before = REGISTRY.get_sample_value('listings_payment_late_captures_total') or 0
+        self.stub.verify_status = 'success'
+        with self.assertLogs('listings.tasks', 'ERROR'):
+            self.assertEqual(verify_payment_task(self.expired_payment.chapa_tx_ref), 'CANCELLED')
+        self.assertEqual(REGISTRY.get_sample_value('listings_payment_late_captures_total') - before, 1)
+
+    async def test_async_verify_never_reconfirms_a_cancelled_payment(self):
+        await sync_to_async(sweep_pending)()
+        self.stub.verify_status = 'success'
+        with self.assertLogs('listings.tasks', 'ERROR'):
+            response = await self.async_client.post(reverse('verify-payment-async', args=[self.expired_payment.chapa_tx_ref]))
+        self.assertEqual(response.json()['status'], 'CANCELLED')
+        booking = await Booking.objects.aget(pk=self.expired_checkout.pk)
+        self.assertEqual(booking.status, 'CANCELLED')
+
+        # Settled payments are answered without a gateway call
+        with mock.patch('listings.views.AsyncChapaService.verify_payment') as verify:
+            response = await self.async_client.post(reverse('verify-payment-async', args=[self.paid.chapa_tx_ref]))
+        self.assertEqual(response.json()['status'], 'COMPLETED')
+        verify.assert_not_called()
+
+    def test_expired_booking_cannot_be_paid(self):
+        sweep_pending()
+        response = self.client.post(reverse('initiate-payment'), {
+            'booking_id': self.abandoned.pk, 'return_url': 'https://example.com/done',
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {'error': 'Booking has been cancelled'})
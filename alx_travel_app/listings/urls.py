@@ -1,22 +1,51 @@
 from django.urls import path
 from .views import (
-    listing_list_create, listing_detail, 
-    booking_list_create, booking_detail,
-    initiate_payment, verify_payment, payment_list, payment_detail
+    listing_list_create, listing_detail, listing_availability_search, listing_batch_availability,
+    listing_search, listing_nearby, listing_calendar,
+    booking_list_create, booking_detail, booking_bulk_create,
+    initiate_payment, verify_payment, payment_list, payment_detail,
+    initiate_payment_async, verify_payment_async, chapa_webhook, metrics, export_records,
+    owner_analytics, listing_daily_analytics, listing_pricing_rules, pricing_rule_detail, price_quotes
 )
 
 urlpatterns = [
     # Listings API
     path('listings/', listing_list_create, name='listing-list-create'),
+    path('listings/available/', listing_availability_search, name='listing-availability-search'),
+    path('listings/availability/batch/', listing_batch_availability, name='listing-batch-availability'),
+    path('listings/search/', listing_search, name='listing-search'),
+    path('listings/nearby/', listing_nearby, name='listing-nearby'),
     path('listings/<int:pk>/', listing_detail, name='listing-detail'),
+    path('listings/<int:pk>/calendar/', listing_calendar, name='listing-calendar'),
+
+    # Pricing API
+    path('listings/<int:pk>/pricing-rules/', listing_pricing_rules, name='listing-pricing-rules'),
+    path('pricing-rules/<int:pk>/', pricing_rule_detail, name='pricing-rule-detail'),
+    path('quotes/', price_quotes, name='price-quotes'),
 
     # Bookings API
     path('bookings/', booking_list_create, name='booking-list-create'),
+    path('bookings/bulk/', booking_bulk_create, name='booking-bulk-create'),
     path('bookings/<int:pk>/', booking_detail, name='booking-detail'),
     
     # Payment API
     path('payments/initiate/', initiate_payment, name='initiate-payment'),
     path('payments/verify/<str:tx_ref>/', verify_payment, name='verify-payment'),
+    path('payments/webhook/', chapa_webhook, name='chapa-webhook'),
     path('payments/', payment_list, name='payment-list'),
     path('payments/<int:pk>/', payment_detail, name='payment-detail'),
+
+    # Async payment API (non-blocking when served over ASGI)
+    path('payments/async/initiate/', initiate_payment_async, name='initiate-payment-async'),
+    path('payments/async/verify/<str:tx_ref>/', verify_payment_async, name='verify-payment-async'),
+
+    # Finance exports (admin only)
+    path('exports/<str:kind>/', export_records, name='export-records'),
+
+    # Owner analytics (read from daily rollups)
+    path('analytics/listings/', owner_analytics, name='owner-analytics'),
+    path('analytics/listings/<int:pk>/daily/', listing_daily_analytics, name='listing-daily-analytics'),
+
+    # Prometheus
+    path('metrics/', metrics, name='metrics'),
 ]
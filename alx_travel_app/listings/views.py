@@ -1,23 +1,63 @@
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser, IsAuthenticated, IsAuthenticatedOrReadOnly
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.utils.urls import replace_query_param
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
+from asgiref.sync import sync_to_async
 from django.shortcuts import get_object_or_404
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from django.utils import timezone
-from .models import Listing, Booking, Payment
-from .serializers import ListingSerializer, BookingSerializer, PaymentSerializer, PaymentInitiationSerializer
-from .chapa_service import ChapaService
-from .tasks import send_booking_confirmation_email
+from django.db import transaction
+from .models import Listing, Booking, Payment, PricingRule
+from .serializers import (
+    ListingSerializer, BookingSerializer, PaymentSerializer, PaymentInitiationSerializer,
+    AvailabilitySearchSerializer, BatchAvailabilitySerializer, CalendarSerializer, ListingSearchSerializer,
+    NearbySearchSerializer, BulkBookingItemSerializer, ExportSerializer,
+    AnalyticsRangeSerializer, PricingRuleSerializer, QuoteItemSerializer
+)
+from .bookings import bulk_create_bookings, lock_booking
+from .availability import available_listings, batch_availability
+from .search import search_listings, SEARCH_MAX_PAGES
+from .geo import nearest_in_box, nearest_within
+from .occupancy import calendar_months
+from .querysets import listing_queryset, booking_queryset, payment_queryset
+from .chapa_service import ChapaService, AsyncChapaService
+from .circuit import CallRejected
+from . import cache as listing_cache
+from .pagination import KeysetPagination, RatingKeysetPagination
+from .streaming import ndjson_response, DEFAULT_CHUNK_SIZE
+from .tasks import verify_payment_task, record_verification
+from .confirmations import queue_confirmations
+from .payments import new_tx_ref, initiation_kwargs, payment_defaults
+from .metrics import render_metrics
+from .exports import EXPORTS, EXPORT_FORMATS, iter_export
+from .analytics import listing_totals, occupancy_rate, daily_series, money
+from . import idempotency
+from .pricing import QuoteError, quote_stays
 import uuid
+import json
 import logging
+import math
 
 logger = logging.getLogger(__name__)
 
+BULK_BOOKING_MAX_ITEMS = 5000
+QUOTE_MAX_ITEMS = 5000
+
 ### LISTINGS CRUD ###
 
 @swagger_auto_schema(
     method='get',
+    manual_parameters=[
+        openapi.Parameter('cursor', openapi.IN_QUERY, description="Opaque cursor from a previous page", type=openapi.TYPE_STRING),
+        openapi.Parameter('page_size', openapi.IN_QUERY, description="Number of listings per page", type=openapi.TYPE_INTEGER),
+        openapi.Parameter('stream', openapi.IN_QUERY, description="Set to 'ndjson' to stream every listing as newline-delimited JSON", type=openapi.TYPE_STRING),
+        openapi.Parameter('ordering', openapi.IN_QUERY, description="'newest' (default) or 'rating'", type=openapi.TYPE_STRING),
+    ],
     responses={200: ListingSerializer(many=True)}
 )
 @swagger_auto_schema(
@@ -27,11 +67,21 @@ logger = logging.getLogger(__name__)
 )
 @api_view(['GET', 'POST'])
 def listing_list_create(request):
-    """Retrieve all listings or create a new listing"""
+    """Retrieve listings page by page (or as an NDJSON stream) or create a new listing"""
     if request.method == 'GET':
-        listings = Listing.objects.all()
-        serializer = ListingSerializer(listings, many=True)
-        return Response(serializer.data)
+        listings = listing_queryset().order_by('-created_at', '-id')
+
+        if request.query_params.get('stream') == 'ndjson':
+            return ndjson_response(listings, ListingSerializer, chunk_size=DEFAULT_CHUNK_SIZE)
+
+        url = request.build_absolute_uri()
+        entry = listing_cache.get_list(url)
+        if entry is None:
+            paginator = RatingKeysetPagination() if request.query_params.get('ordering') == 'rating' else KeysetPagination()
+            page = paginator.paginate_queryset(listings, request)
+            serializer = ListingSerializer(page, many=True)
+            entry = listing_cache.set_list(url, paginator.get_paginated_response(serializer.data).data)
+        return listing_cache.cached_response(request, entry)
 
     elif request.method == 'POST':
         serializer = ListingSerializer(data=request.data)
@@ -57,14 +107,20 @@ def listing_list_create(request):
 @api_view(['GET', 'PUT', 'DELETE'])
 def listing_detail(request, pk):
     """Retrieve, update, or delete a listing by ID"""
+    if request.method == 'GET':
+        entry = listing_cache.get_detail(pk)
+        if entry is not None:
+            return listing_cache.cached_response(request, entry)
+
     try:
-        listing = Listing.objects.get(pk=pk)
+        listing = listing_queryset().get(pk=pk)
     except Listing.DoesNotExist:
         return Response({"error": "Listing not found"}, status=status.HTTP_404_NOT_FOUND)
 
     if request.method == 'GET':
         serializer = ListingSerializer(listing)
-        return Response(serializer.data)
+        entry = listing_cache.set_detail(listing, serializer.data)
+        return listing_cache.cached_response(request, entry)
 
     elif request.method == 'PUT':
         serializer = ListingSerializer(listing, data=request.data)
@@ -78,6 +134,263 @@ def listing_detail(request, pk):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+@swagger_auto_schema(
+    method='get',
+    query_serializer=AvailabilitySearchSerializer,
+    responses={200: ListingSerializer(many=True), 400: 'Bad Request'}
+)
+@api_view(['GET'])
+def listing_availability_search(request):
+    """Find listings that are free for the whole requested date range"""
+    serializer = AvailabilitySearchSerializer(data=request.query_params)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    listings = available_listings(listing_queryset(), **serializer.validated_data)
+    paginator = KeysetPagination()
+    page = paginator.paginate_queryset(listings, request)
+    return paginator.get_paginated_response(ListingSerializer(page, many=True).data)
+
+
+@swagger_auto_schema(
+    method='get',
+    query_serializer=CalendarSerializer,
+    responses={200: 'Booked and free nights per month', 400: 'Bad Request', 404: 'Not Found'}
+)
+@api_view(['GET'])
+def listing_calendar(request, pk):
+    """Month views of which nights a listing has booked, read from its occupancy bitmap"""
+    serializer = CalendarSerializer(data=request.query_params)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    params = serializer.validated_data
+    months = calendar_months(pk, params.get('month') or timezone.localdate(), params['months'])
+    if months is None:
+        return Response({"error": "Listing not found"}, status=status.HTTP_404_NOT_FOUND)
+    return Response({'listing': pk, 'months': months})
+
+
+@swagger_auto_schema(
+    method='post',
+    request_body=BatchAvailabilitySerializer,
+    responses={200: 'Availability and price per listing', 400: 'Bad Request'}
+)
+@api_view(['POST'])
+def listing_batch_availability(request):
+    """Availability and price of one stay at many listings, e.g. every card on a results page"""
+    serializer = BatchAvailabilitySerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    params = serializer.validated_data
+    try:
+        rows = batch_availability(params['listings'], params['start_date'], params['end_date'], params.get('currency'))
+    except QuoteError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    found = {row['listing'] for row in rows}
+    return Response({
+        'results': [quote_payload(row) for row in rows],
+        'missing': [listing_id for listing_id in dict.fromkeys(params['listings']) if listing_id not in found],
+    })
+
+
+@swagger_auto_schema(
+    method='get',
+    query_serializer=ListingSearchSerializer,
+    responses={200: ListingSerializer(many=True), 400: 'Bad Request'}
+)
+@api_view(['GET'])
+def listing_search(request):
+    """Full-text search over listing title, description and location, best matches first"""
+    serializer = ListingSearchSerializer(data=request.query_params)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    params = serializer.validated_data
+    page, page_size = params.pop('page'), params.pop('page_size')
+    # Fetch one extra row to know whether another page exists
+    matches = search_listings(
+        listing_queryset(), params.pop('q'), limit=page_size + 1, offset=(page - 1) * page_size, **params
+    )
+
+    results = []
+    for listing, relevance in matches[:page_size]:
+        data = ListingSerializer(listing).data
+        data['relevance'] = round(relevance, 4)
+        results.append(data)
+
+    has_next = len(matches) > page_size and page < SEARCH_MAX_PAGES
+    next_link = replace_query_param(request.build_absolute_uri(), 'page', page + 1) if has_next else None
+    return Response({'next': next_link, 'results': results})
+
+
+@swagger_auto_schema(
+    method='get',
+    query_serializer=NearbySearchSerializer,
+    responses={200: ListingSerializer(many=True), 400: 'Bad Request'}
+)
+@api_view(['GET'])
+def listing_nearby(request):
+    """Listings within a radius of a point, or inside a box, nearest first"""
+    serializer = NearbySearchSerializer(data=request.query_params)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    params = serializer.validated_data
+    page, page_size = params['page'], params['page_size']
+    listings = Listing.objects.all()
+    if params.get('is_available') is not None:
+        listings = listings.filter(is_available=params['is_available'])
+
+    # Fetch one extra row to know whether another page exists
+    limit = page * page_size + 1
+    if 'box' in params:
+        matches = nearest_in_box(listings, params['box'], params['latitude'], params['longitude'], limit)
+    else:
+        matches = nearest_within(listings, params['latitude'], params['longitude'], params['radius_km'], limit)
+
+    window = matches[(page - 1) * page_size:page * page_size]
+    found = listing_queryset().in_bulk([listing_id for listing_id, _ in window])
+    results = []
+    for listing_id, distance in window:
+        data = ListingSerializer(found[listing_id]).data
+        data['distance_km'] = round(distance, 3)
+        results.append(data)
+
+    has_next = len(matches) > page * page_size and page < SEARCH_MAX_PAGES
+    next_link = replace_query_param(request.build_absolute_uri(), 'page', page + 1) if has_next else None
+    return Response({'next': next_link, 'results': results})
+
+### PRICING ###
+
+@swagger_auto_schema(
+    method='get',
+    responses={200: PricingRuleSerializer(many=True), 404: 'Listing not found'}
+)
+@swagger_auto_schema(
+    method='post',
+    request_body=PricingRuleSerializer,
+    responses={201: PricingRuleSerializer, 400: 'Bad Request', 404: 'Listing not found'}
+)
+@api_view(['GET', 'POST'])
+def listing_pricing_rules(request, pk):
+    """List or add the seasonal, weekend and length-of-stay rules of a listing"""
+    if not Listing.objects.filter(pk=pk).exists():
+        return Response({'error': 'Listing not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    if request.method == 'GET':
+        serializer = PricingRuleSerializer(PricingRule.objects.filter(listing_id=pk), many=True)
+        return Response(serializer.data)
+
+    serializer = PricingRuleSerializer(data=request.data)
+    if serializer.is_valid():
+        serializer.save(listing_id=pk)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+@swagger_auto_schema(
+    method='get',
+    responses={200: PricingRuleSerializer}
+)
+@swagger_auto_schema(
+    method='put',
+    request_body=PricingRuleSerializer,
+    responses={200: PricingRuleSerializer}
+)
+@swagger_auto_schema(
+    method='delete',
+    responses={204: 'No Content'}
+)
+@api_view(['GET', 'PUT', 'DELETE'])
+def pricing_rule_detail(request, pk):
+    """Retrieve, update, or delete a pricing rule by ID"""
+    try:
+        rule = PricingRule.objects.get(pk=pk)
+    except PricingRule.DoesNotExist:
+        return Response({'error': 'Pricing rule not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    if request.method == 'GET':
+        return Response(PricingRuleSerializer(rule).data)
+
+    elif request.method == 'PUT':
+        serializer = PricingRuleSerializer(rule, data=request.data)
+        if serializer.is_valid():
+            serializer.save()
+            return Response(serializer.data)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    elif request.method == 'DELETE':
+        rule.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+@swagger_auto_schema(
+    method='post',
+    request_body=openapi.Schema(
+        type=openapi.TYPE_OBJECT,
+        properties={
+            'currency': openapi.Schema(type=openapi.TYPE_STRING, description="Defaults to ETB"),
+            'stays': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'listing': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'start_date': openapi.Schema(type=openapi.TYPE_STRING, format=openapi.FORMAT_DATE),
+                    'end_date': openapi.Schema(type=openapi.TYPE_STRING, format=openapi.FORMAT_DATE),
+                },
+            )),
+        },
+    ),
+    responses={200: 'Quotes and per-stay errors', 400: 'Bad Request'}
+)
+@api_view(['POST'])
+def price_quotes(request):
+    """Price many (listing, date range) stays from nightly rates and pricing rules"""
+    stays = request.data.get('stays') if isinstance(request.data, dict) else None
+    if not isinstance(stays, list):
+        return Response({'error': 'Expected a list of stays'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(stays) > QUOTE_MAX_ITEMS:
+        return Response({'error': f'At most {QUOTE_MAX_ITEMS} stays per request'}, status=status.HTTP_400_BAD_REQUEST)
+
+    errors = {}
+    valid = []
+    for index, item in enumerate(stays):
+        serializer = QuoteItemSerializer(data=item)
+        if serializer.is_valid():
+            data = serializer.validated_data
+            valid.append((index, (data['listing'], data['start_date'], data['end_date'])))
+        else:
+            errors[index] = serializer.errors
+
+    try:
+        quotes = quote_stays([stay for _, stay in valid], request.data.get('currency'))
+    except QuoteError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    results = []
+    for (index, _), quote in zip(valid, quotes):
+        if isinstance(quote, QuoteError):
+            errors[index] = {'non_field_errors': [str(quote)]}
+        else:
+            results.append(quote_payload(quote, index))
+
+    return Response({
+        'results': results,
+        'errors': [{'index': index, 'errors': errors[index]} for index in sorted(errors)],
+    })
+
+
+def quote_payload(quote, index=None):
+    """A quote as JSON; money goes out as strings, as ModelSerializer renders DecimalFields"""
+    payload = dict(
+        quote, subtotal=str(quote['subtotal']), discount=str(quote['discount']), total=str(quote['total']),
+    )
+    if index is not None:
+        payload['index'] = index
+    return payload
+
 ### BOOKINGS CRUD ###
 
 @swagger_auto_schema(
@@ -90,34 +403,21 @@ def listing_detail(request, pk):
     responses={201: BookingSerializer}
 )
 @api_view(['GET', 'POST'])
+@permission_classes([IsAuthenticatedOrReadOnly])
 def booking_list_create(request):
     """List all bookings or create a new booking"""
     if request.method == 'GET':
-        bookings = Booking.objects.all()
+        bookings = booking_queryset()
         serializer = BookingSerializer(bookings, many=True)
         return Response(serializer.data)
 
     elif request.method == 'POST':
         serializer = BookingSerializer(data=request.data)
         if serializer.is_valid():
-            booking = serializer.save()
-            
-            # Trigger email notification asynchronously
-            try:
-                send_booking_confirmation_email.delay(
-                    booking_id=booking.id,
-                    user_email=booking.user_email,
-                    user_name=booking.user_name,
-                    listing_title=booking.listing.title,
-                    start_date=str(booking.start_date),
-                    end_date=str(booking.end_date),
-                    total_price=str(booking.total_price)
-                )
-                logger.info(f'Email task queued for booking {booking.id}')
-            except Exception as e:
-                logger.error(f'Failed to queue email task for booking {booking.id}: {str(e)}')
-                # Don't fail the booking creation if email task fails
-            
+            # Raises a 400 if another booking holds these nights (checked under a listing lock)
+            booking = serializer.save(user=request.user)
+            # Sent with the next outbox batch by send_pending_confirmations
+            queue_confirmations([booking.id])
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -139,7 +439,7 @@ def booking_list_create(request):
 def booking_detail(request, pk):
     """Retrieve, update, or delete a booking by ID"""
     try:
-        booking = Booking.objects.get(pk=pk)
+        booking = booking_queryset().get(pk=pk)
     except Booking.DoesNotExist:
         return Response({"error": "Booking not found"}, status=status.HTTP_404_NOT_FOUND)
 
@@ -159,20 +459,89 @@ def booking_detail(request, pk):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+@swagger_auto_schema(
+    method='post',
+    request_body=BulkBookingItemSerializer(many=True),
+    responses={
+        201: 'All bookings created',
+        207: 'Some bookings created; see errors',
+        400: 'No bookings created'
+    }
+)
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def booking_bulk_create(request):
+    """Create many bookings for the requesting user in one transaction"""
+    if not isinstance(request.data, list):
+        return Response({'error': 'Expected a list of bookings'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(request.data) > BULK_BOOKING_MAX_ITEMS:
+        return Response(
+            {'error': f'At most {BULK_BOOKING_MAX_ITEMS} bookings per request'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    errors = {}
+    valid = []
+    for index, item in enumerate(request.data):
+        serializer = BulkBookingItemSerializer(data=item)
+        if serializer.is_valid():
+            valid.append((index, serializer.validated_data))
+        else:
+            errors[index] = serializer.errors
+
+    # Every item is charged the server-side quote, priced in one pass
+    quotes = quote_stays([(data['listing'], data['start_date'], data['end_date']) for _, data in valid])
+    priced = []
+    for (index, data), quote in zip(valid, quotes):
+        if isinstance(quote, QuoteError):
+            errors[index] = {'non_field_errors': [str(quote)]}
+        else:
+            priced.append((index, {**data, 'total_price': quote['total']}))
+
+    created, conflicts = bulk_create_bookings(request.user, priced)
+    errors.update(conflicts)
+
+    queue_confirmations([booking.id for booking in created])
+
+    if not created:
+        response_status = status.HTTP_400_BAD_REQUEST
+    elif errors:
+        response_status = status.HTTP_207_MULTI_STATUS
+    else:
+        response_status = status.HTTP_201_CREATED
+
+    return Response({
+        'created': BookingSerializer(created, many=True).data,
+        'errors': [{'index': index, 'errors': errors[index]} for index in sorted(errors)],
+    }, status=response_status)
+
+
 ### PAYMENT ENDPOINTS ###
 
 @swagger_auto_schema(
     method='post',
     request_body=PaymentInitiationSerializer,
+    manual_parameters=[
+        openapi.Parameter(
+            'Idempotency-Key', openapi.IN_HEADER, type=openapi.TYPE_STRING,
+            description="Repeats with the same key return the first response without contacting Chapa again"
+        ),
+    ],
     responses={
         201: openapi.Response('Payment initiated successfully', PaymentSerializer),
         400: 'Bad Request',
-        404: 'Booking not found'
+        404: 'Booking not found',
+        422: 'Idempotency-Key reused for a different request',
+        503: 'Payment gateway unavailable; see Retry-After'
     }
 )
 @api_view(['POST'])
 def initiate_payment(request):
     """Initiate payment for a booking"""
+    idempotency_key = request.headers.get(idempotency.HEADER)
+    if idempotency_key is not None and not 0 < len(idempotency_key) <= idempotency.MAX_KEY_LENGTH:
+        return Response({'error': 'Invalid Idempotency-Key'}, status=status.HTTP_400_BAD_REQUEST)
+
     serializer = PaymentInitiationSerializer(data=request.data)
     if not serializer.is_valid():
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -180,60 +549,109 @@ def initiate_payment(request):
     booking_id = serializer.validated_data['booking_id']
     return_url = serializer.validated_data['return_url']
     callback_url = serializer.validated_data.get('callback_url')
-    
+
+    request_fingerprint = idempotency.fingerprint('initiate_payment', serializer.validated_data) if idempotency_key else None
     try:
-        booking = Booking.objects.get(id=booking_id)
-    except Booking.DoesNotExist:
-        return Response({'error': 'Booking not found'}, status=status.HTTP_404_NOT_FOUND)
-    
+        if idempotency_key:
+            stored = idempotency.lookup(idempotency_key, request_fingerprint)
+            if stored:
+                return replay_response(stored)
+
+        # One initialization in flight per booking: concurrent retries wait
+        # here and then find the payment (or stored response) of the first
+        with transaction.atomic():
+            booking = lock_booking(booking_id)
+            if booking is None:
+                return Response({'error': 'Booking not found'}, status=status.HTTP_404_NOT_FOUND)
+            outcome = initiation_outcome(booking, idempotency_key, request_fingerprint)
+            if outcome:
+                return outcome_response(outcome)
+
+            tx_ref = new_tx_ref(booking)
+
+            # Initialize Chapa service
+            chapa_service = ChapaService()
+
+            # Initiate payment with Chapa
+            chapa_response = chapa_service.initiate_payment(
+                **initiation_kwargs(booking, tx_ref, callback_url=callback_url, return_url=return_url)
+            )
+
+            if not chapa_response or chapa_response.get('status') != 'success':
+                logger.error(f"Chapa payment initiation failed: {chapa_response}")
+                return Response({'error': 'Payment initiation failed'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+            payment_data = chapa_response.get('data', {})
+            return outcome_response(save_initiated_payment(
+                booking, tx_ref, payment_data.get('checkout_url'), idempotency_key, request_fingerprint
+            ))
+    except idempotency.IdempotencyKeyReused:
+        return Response(
+            {'error': 'Idempotency-Key was already used for a different request'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+    except CallRejected as e:
+        return gateway_unavailable(e)
+
+def initiation_outcome(booking, idempotency_key, request_fingerprint):
+    """
+    The (status, body, replayed) answer for a locked booking that needs no
+    new Chapa checkout, or None if one should be started
+    """
+    if idempotency_key:
+        stored = idempotency.lookup(idempotency_key, request_fingerprint, use_database=True)
+        if stored:
+            return (*stored, True)
+
     # Check if payment already exists
     if hasattr(booking, 'payment'):
         if booking.payment.status == 'COMPLETED':
-            return Response({'error': 'Payment already completed'}, status=status.HTTP_400_BAD_REQUEST)
+            return status.HTTP_400_BAD_REQUEST, {'error': 'Payment already completed'}, False
         elif booking.payment.status == 'PENDING':
-            return Response(PaymentSerializer(booking.payment).data, status=status.HTTP_200_OK)
-    
-    # Generate unique transaction reference
-    tx_ref = f"ALX_TRAVEL_{booking.id}_{uuid.uuid4().hex[:8]}"
-    
-    # Initialize Chapa service
-    chapa_service = ChapaService()
-    
-    # Initiate payment with Chapa
-    chapa_response = chapa_service.initiate_payment(
-        amount=booking.total_price,
-        currency='ETB',
-        email=booking.user.email,
-        first_name=booking.user.first_name or booking.user.username,
-        last_name=booking.user.last_name or '',
-        tx_ref=tx_ref,
-        callback_url=callback_url,
-        return_url=return_url
-    )
-    
-    if not chapa_response or chapa_response.get('status') != 'success':
-        logger.error(f"Chapa payment initiation failed: {chapa_response}")
-        return Response({'error': 'Payment initiation failed'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-    
-    # Create or update payment record
-    payment_data = chapa_response.get('data', {})
+            return idempotent_outcome(
+                idempotency_key, request_fingerprint, PaymentSerializer(booking.payment).data, status.HTTP_200_OK
+            )
+    # An expired booking no longer holds its nights, so it cannot be paid for
+    if booking.status == 'CANCELLED':
+        return status.HTTP_400_BAD_REQUEST, {'error': 'Booking has been cancelled'}, False
+    return None
+
+def save_initiated_payment(booking, tx_ref, checkout_url, idempotency_key, request_fingerprint):
+    """Create or update the booking's payment for a new Chapa checkout"""
     payment, created = Payment.objects.get_or_create(
         booking=booking,
-        defaults={
-            'transaction_id': tx_ref,
-            'chapa_tx_ref': tx_ref,
-            'amount': booking.total_price,
-            'currency': 'ETB',
-            'status': 'PENDING',
-            'checkout_url': payment_data.get('checkout_url')
-        }
+        defaults=payment_defaults(booking, tx_ref, checkout_url)
     )
-    
+
     if not created:
-        payment.checkout_url = payment_data.get('checkout_url')
+        payment.checkout_url = checkout_url
         payment.save()
-    
-    return Response(PaymentSerializer(payment).data, status=status.HTTP_201_CREATED)
+
+    return idempotent_outcome(idempotency_key, request_fingerprint, PaymentSerializer(payment).data, status.HTTP_201_CREATED)
+
+def idempotent_outcome(idempotency_key, request_fingerprint, data, status_code):
+    """An answer that is also stored under the request's Idempotency-Key, if it sent one"""
+    if idempotency_key:
+        idempotency.store(idempotency_key, request_fingerprint, status_code, data)
+    return status_code, data, False
+
+def outcome_response(outcome, response_class=Response):
+    status_code, data, replayed = outcome
+    response = response_class(data, status=status_code)
+    if replayed:
+        response['Idempotent-Replayed'] = 'true'
+    return response
+
+def replay_response(stored):
+    return outcome_response((*stored, True))
+
+def gateway_unavailable(rejection, response_class=Response):
+    """503 with Retry-After for a Chapa call the circuit breaker or bulkhead turned away"""
+    response = response_class(
+        {'error': 'Payment gateway temporarily unavailable'}, status=status.HTTP_503_SERVICE_UNAVAILABLE
+    )
+    response['Retry-After'] = str(max(1, math.ceil(rejection.retry_after)))
+    return response
 
 @swagger_auto_schema(
     method='post',
@@ -242,52 +660,59 @@ def initiate_payment(request):
     ],
     responses={
         200: PaymentSerializer,
+        202: openapi.Response('Verification queued', PaymentSerializer),
         404: 'Payment not found',
         500: 'Verification failed'
     }
 )
 @api_view(['POST'])
 def verify_payment(request, tx_ref):
-    """Verify payment status with Chapa"""
+    """Queue verification of a payment with Chapa and return its current state"""
     try:
-        payment = Payment.objects.get(chapa_tx_ref=tx_ref)
+        payment = payment_queryset().get(chapa_tx_ref=tx_ref)
     except Payment.DoesNotExist:
         return Response({'error': 'Payment not found'}, status=status.HTTP_404_NOT_FOUND)
     
-    # Initialize Chapa service
-    chapa_service = ChapaService()
+    # Settled payments need no further round trip to the gateway
+    if payment.status != 'PENDING':
+        return Response(PaymentSerializer(payment).data, status=status.HTTP_200_OK)
     
-    # Verify payment with Chapa
-    verification_response = chapa_service.verify_payment(tx_ref)
-    
-    if not verification_response:
+    try:
+        verify_payment_task.delay(tx_ref)
+    except Exception as e:
+        logger.error(f'Failed to queue verification for payment {tx_ref}: {str(e)}')
         return Response({'error': 'Payment verification failed'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
-    # Update payment status based on Chapa response
-    chapa_data = verification_response.get('data', {})
-    chapa_status = chapa_data.get('status', '').lower()
+    return Response(PaymentSerializer(payment).data, status=status.HTTP_202_ACCEPTED)
+
+@swagger_auto_schema(
+    methods=['get', 'post'],
+    responses={200: 'Notification accepted', 400: 'Missing tx_ref', 403: 'Invalid signature'}
+)
+@api_view(['GET', 'POST'])
+def chapa_webhook(request):
+    """Receive Chapa callbacks/webhooks and queue verification"""
+    if request.method == 'POST':
+        signature = request.headers.get('Chapa-Signature') or request.headers.get('X-Chapa-Signature')
+        if not ChapaService.verify_webhook_signature(request.body, signature):
+            return Response({'error': 'Invalid signature'}, status=status.HTTP_403_FORBIDDEN)
+        data = request.data
+    else:
+        data = request.query_params
     
-    if chapa_status == 'success':
-        payment.status = 'COMPLETED'
-        payment.paid_at = timezone.now()
-        payment.chapa_reference = chapa_data.get('reference')
-        payment.payment_method = chapa_data.get('method')
-        
-        # Update booking status
-        payment.booking.status = 'CONFIRMED'
-        payment.booking.save()
-        
-        # TODO: Send confirmation email using Celery
-        # send_booking_confirmation_email.delay(payment.booking.id)
-        
-    elif chapa_status in ['failed', 'cancelled']:
-        payment.status = 'FAILED' if chapa_status == 'failed' else 'CANCELLED'
-        payment.booking.status = 'CANCELLED'
-        payment.booking.save()
+    # Callbacks use trx_ref, webhooks use tx_ref
+    tx_ref = data.get('tx_ref') or data.get('trx_ref')
+    if not tx_ref:
+        return Response({'error': 'tx_ref is required'}, status=status.HTTP_400_BAD_REQUEST)
     
-    payment.save()
+    # The notification is only a hint; the task re-verifies with the gateway
+    try:
+        verify_payment_task.delay(tx_ref)
+    except Exception as e:
+        logger.error(f'Failed to queue verification for payment {tx_ref}: {str(e)}')
+        return Response({'error': 'Unable to process notification'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
     
-    return Response(PaymentSerializer(payment).data, status=status.HTTP_200_OK)
+    return Response({'status': 'accepted'}, status=status.HTTP_200_OK)
 
 @swagger_auto_schema(
     method='get',
@@ -296,7 +721,7 @@ def verify_payment(request, tx_ref):
 @api_view(['GET'])
 def payment_list(request):
     """List all payments"""
-    payments = Payment.objects.all()
+    payments = payment_queryset()
     serializer = PaymentSerializer(payments, many=True)
     return Response(serializer.data)
 
@@ -308,9 +733,223 @@ def payment_list(request):
 def payment_detail(request, pk):
     """Get payment details"""
     try:
-        payment = Payment.objects.get(pk=pk)
+        payment = payment_queryset().get(pk=pk)
     except Payment.DoesNotExist:
         return Response({'error': 'Payment not found'}, status=status.HTTP_404_NOT_FOUND)
     
     serializer = PaymentSerializer(payment)
     return Response(serializer.data)
+
+
+### ASYNC PAYMENT ENDPOINTS ###
+# Plain Django async views, since DRF's @api_view is sync-only. Served over
+# ASGI, one worker keeps many Chapa round trips in flight at once.
+
+@csrf_exempt
+@require_POST
+async def initiate_payment_async(request):
+    """Initiate payment for a booking without blocking the worker"""
+    idempotency_key = request.headers.get(idempotency.HEADER)
+    if idempotency_key is not None and not 0 < len(idempotency_key) <= idempotency.MAX_KEY_LENGTH:
+        return JsonResponse({'error': 'Invalid Idempotency-Key'}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        return JsonResponse({'error': 'Invalid JSON body'}, status=status.HTTP_400_BAD_REQUEST)
+
+    serializer = PaymentInitiationSerializer(data=data)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    booking_id = serializer.validated_data['booking_id']
+    return_url = serializer.validated_data['return_url']
+    callback_url = serializer.validated_data.get('callback_url')
+
+    # Same key store as initiate_payment: a key used on either endpoint replays on both
+    request_fingerprint = idempotency.fingerprint('initiate_payment', serializer.validated_data) if idempotency_key else None
+    try:
+        if idempotency_key:
+            stored = await sync_to_async(idempotency.lookup)(idempotency_key, request_fingerprint)
+            if stored:
+                return outcome_response((*stored, True), JsonResponse)
+
+        booking, outcome = await sync_to_async(locked_initiation_outcome)(
+            booking_id, idempotency_key, request_fingerprint
+        )
+        if outcome:
+            return outcome_response(outcome, JsonResponse)
+
+        tx_ref = new_tx_ref(booking)
+        chapa_response = await AsyncChapaService().initiate_payment(
+            **initiation_kwargs(booking, tx_ref, callback_url=callback_url, return_url=return_url)
+        )
+
+        if not chapa_response or chapa_response.get('status') != 'success':
+            logger.error(f"Chapa payment initiation failed: {chapa_response}")
+            return JsonResponse({'error': 'Payment initiation failed'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        payment_data = chapa_response.get('data', {})
+        outcome = await sync_to_async(record_initiation)(
+            booking_id, tx_ref, payment_data.get('checkout_url'), idempotency_key, request_fingerprint
+        )
+        return outcome_response(outcome, JsonResponse)
+    except idempotency.IdempotencyKeyReused:
+        return JsonResponse(
+            {'error': 'Idempotency-Key was already used for a different request'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+    except CallRejected as e:
+        return gateway_unavailable(e, JsonResponse)
+
+
+def locked_initiation_outcome(booking_id, idempotency_key, request_fingerprint):
+    """The booking and initiation_outcome for it, checked under the booking lock"""
+    with transaction.atomic():
+        booking = lock_booking(booking_id)
+        if booking is None:
+            return None, (status.HTTP_404_NOT_FOUND, {'error': 'Booking not found'}, False)
+        return booking, initiation_outcome(booking, idempotency_key, request_fingerprint)
+
+
+def record_initiation(booking_id, tx_ref, checkout_url, idempotency_key, request_fingerprint):
+    """
+    Save an async initiation under the booking lock.
+
+    The lock cannot be held across the awaited gateway call, so a concurrent
+    attempt may have answered first; its payment or stored response wins and
+    this checkout is left unused.
+    """
+    with transaction.atomic():
+        booking = lock_booking(booking_id)
+        if booking is None:
+            return status.HTTP_404_NOT_FOUND, {'error': 'Booking not found'}, False
+        outcome = initiation_outcome(booking, idempotency_key, request_fingerprint)
+        if outcome:
+            logger.warning(f'Discarding Chapa checkout {tx_ref}: booking {booking_id} was answered concurrently')
+            return outcome
+        return save_initiated_payment(booking, tx_ref, checkout_url, idempotency_key, request_fingerprint)
+
+
+@csrf_exempt
+@require_POST
+async def verify_payment_async(request, tx_ref):
+    """Verify payment status with Chapa without blocking the worker"""
+    try:
+        payment = await payment_queryset().aget(chapa_tx_ref=tx_ref)
+    except Payment.DoesNotExist:
+        return JsonResponse({'error': 'Payment not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    # Settled payments need no further round trip to the gateway. CANCELLED
+    # ones still go out, so a capture after expiry is flagged as in the task.
+    if payment.status not in ('PENDING', 'CANCELLED'):
+        return JsonResponse(PaymentSerializer(payment).data, status=status.HTTP_200_OK)
+
+    try:
+        verification_response = await AsyncChapaService().verify_payment(tx_ref)
+    except CallRejected as e:
+        return gateway_unavailable(e, JsonResponse)
+
+    if not verification_response:
+        return JsonResponse({'error': 'Payment verification failed'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    payment = await sync_to_async(record_verification)(tx_ref, verification_response.get('data') or {})
+    if payment is None:
+        return JsonResponse({'error': 'Payment not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    return JsonResponse(PaymentSerializer(payment).data, status=status.HTTP_200_OK)
+
+
+### FINANCE EXPORTS ###
+
+@swagger_auto_schema(
+    method='get',
+    query_serializer=ExportSerializer,
+    responses={200: 'CSV or NDJSON stream', 400: 'Bad Request'}
+)
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def export_records(request, kind):
+    """Stream every payment or booking (with listing and user fields) as CSV or NDJSON"""
+    if kind not in EXPORTS:
+        return Response({'error': 'Unknown export'}, status=status.HTTP_404_NOT_FOUND)
+    serializer = ExportSerializer(data=request.query_params, context={'kind': kind})
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    filters = dict(serializer.validated_data)
+    output = filters.pop('output')
+    response = StreamingHttpResponse(iter_export(kind, output, **filters), content_type=EXPORT_FORMATS[output])
+    response['Content-Disposition'] = f'attachment; filename="{kind}.{output}"'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+### OWNER ANALYTICS ###
+
+@swagger_auto_schema(
+    method='get',
+    query_serializer=AnalyticsRangeSerializer,
+    responses={200: 'Revenue and occupancy per listing', 400: 'Bad Request'}
+)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def owner_analytics(request):
+    """Revenue and occupancy totals for each of the current user's listings"""
+    serializer = AnalyticsRangeSerializer(data=request.query_params)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    start_date = serializer.validated_data['start_date']
+    end_date = serializer.validated_data['end_date']
+
+    listings = listing_totals(Listing.objects.filter(owner=request.user).only('id', 'title'), start_date, end_date)
+    results = [
+        {
+            'listing': listing.id,
+            'title': listing.title,
+            'revenue': money(listing.revenue),
+            'occupied_nights': listing.occupied_nights,
+            'occupancy_rate': occupancy_rate(listing.occupied_nights, start_date, end_date),
+            'check_ins': listing.check_ins,
+        }
+        for listing in listings.order_by('id')
+    ]
+    return Response({'start_date': start_date, 'end_date': end_date, 'results': results})
+
+@swagger_auto_schema(
+    method='get',
+    query_serializer=AnalyticsRangeSerializer,
+    responses={200: 'Daily revenue and occupancy', 400: 'Bad Request', 404: 'Listing not found'}
+)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def listing_daily_analytics(request, pk):
+    """Day-by-day revenue and occupancy for one listing owned by the current user"""
+    listings = Listing.objects.all() if request.user.is_staff else Listing.objects.filter(owner=request.user)
+    if not listings.filter(pk=pk).exists():
+        return Response({'error': 'Listing not found'}, status=status.HTTP_404_NOT_FOUND)
+    serializer = AnalyticsRangeSerializer(data=request.query_params)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    start_date = serializer.validated_data['start_date']
+    end_date = serializer.validated_data['end_date']
+
+    days = daily_series(pk, start_date, end_date)
+    occupied_nights = sum(day['occupied'] for day in days)
+    return Response({
+        'listing': pk,
+        'start_date': start_date,
+        'end_date': end_date,
+        'revenue': money(sum(day['revenue'] for day in days)),
+        'occupied_nights': occupied_nights,
+        'occupancy_rate': occupancy_rate(occupied_nights, start_date, end_date),
+        'days': [dict(day, revenue=money(day['revenue'])) for day in days],
+    })
+
+
+### METRICS ###
+
+def metrics(request):
+    """Prometheus scrape endpoint, aggregated across worker processes when configured"""
+    body, content_type = render_metrics()
+    return HttpResponse(body, content_type=content_type)
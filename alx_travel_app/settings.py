@@ -9,7 +9,7 @@ https://docs.djangoproject.com/en/3.2/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
-from decouple import config
+from decouple import Csv, config
 
 from pathlib import Path
 
@@ -45,6 +45,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'listings.metrics.MetricsMiddleware',
+    'listings.instrumentation.RequestTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -134,10 +136,24 @@ STATIC_URL = '/static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
+# Cache Configuration
+# Local memory by default; point CACHE_BACKEND/CACHE_LOCATION at a shared
+# backend (e.g. django.core.cache.backends.redis.RedisCache) in production
+# so every worker sees the same entries and invalidations.
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='alx-travel'),
+    }
+}
+LISTING_CACHE_TIMEOUT = config('LISTING_CACHE_TIMEOUT', default=300, cast=int)
+
+
 # Chapa Payment Configuration
 CHAPA_SECRET_KEY = config('CHAPA_SECRET_KEY', default='')
 CHAPA_PUBLIC_KEY = config('CHAPA_PUBLIC_KEY', default='')
 CHAPA_BASE_URL = config('CHAPA_BASE_URL', default='https://api.chapa.co/v1')
+CHAPA_WEBHOOK_SECRET = config('CHAPA_WEBHOOK_SECRET', default='')
 
 # Logging Configuration
 LOGGING = {
@@ -149,6 +165,10 @@ LOGGING = {
             'class': 'logging.FileHandler',
             'filename': 'payment.log',
         },
+        'console': {
+            'level': 'INFO',
+            'class': 'logging.StreamHandler',
+        },
     },
     'loggers': {
         'listings.chapa_service': {
@@ -156,6 +176,11 @@ LOGGING = {
             'level': 'INFO',
             'propagate': True,
         },
+        'listings.instrumentation': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     },
 }
 
@@ -167,6 +192,75 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
+CELERY_BEAT_SCHEDULE = {
+    'reconcile-pending-payments': {
+        'task': 'listings.tasks.reconcile_pending_payments',
+        'schedule': config('PAYMENT_RECONCILE_INTERVAL', default=300, cast=int),
+    },
+    'refresh-daily-rollups': {
+        'task': 'listings.tasks.refresh_daily_rollups',
+        'schedule': config('ANALYTICS_ROLLUP_INTERVAL', default=300, cast=int),
+    },
+    'expire-stale-pending': {
+        'task': 'listings.tasks.expire_stale_pending',
+        'schedule': config('PENDING_SWEEP_INTERVAL', default=300, cast=int),
+    },
+    'send-pending-confirmations': {
+        'task': 'listings.tasks.send_pending_confirmations',
+        'schedule': config('CONFIRMATION_EMAIL_INTERVAL', default=30, cast=int),
+    },
+}
+
+# Payment reconciliation: PENDING payments older than STALE_AFTER minutes
+# are re-verified with Chapa in batches, CONCURRENCY gateway calls at a time
+PAYMENT_RECONCILE_STALE_AFTER = config('PAYMENT_RECONCILE_STALE_AFTER', default=15, cast=int)
+PAYMENT_RECONCILE_BATCH_SIZE = config('PAYMENT_RECONCILE_BATCH_SIZE', default=200, cast=int)
+PAYMENT_RECONCILE_CONCURRENCY = config('PAYMENT_RECONCILE_CONCURRENCY', default=8, cast=int)
+
+# Expiry sweeper: PENDING payments older than PAYMENT_TTL minutes and
+# PENDING bookings without a payment older than BOOKING_TTL minutes are
+# cancelled, BATCH_SIZE rows per transaction and MAX_BATCHES per kind a run
+PENDING_PAYMENT_TTL = config('PENDING_PAYMENT_TTL', default=1440, cast=int)
+PENDING_BOOKING_TTL = config('PENDING_BOOKING_TTL', default=60, cast=int)
+PENDING_SWEEP_BATCH_SIZE = config('PENDING_SWEEP_BATCH_SIZE', default=500, cast=int)
+PENDING_SWEEP_MAX_BATCHES = config('PENDING_SWEEP_MAX_BATCHES', default=20, cast=int)
+
+# Confirmation outbox: each run sends at most MAX_CHUNKS batches of
+# CHUNK_SIZE emails, every batch over one SMTP connection
+CONFIRMATION_EMAIL_CHUNK_SIZE = config('CONFIRMATION_EMAIL_CHUNK_SIZE', default=100, cast=int)
+CONFIRMATION_EMAIL_MAX_CHUNKS = config('CONFIRMATION_EMAIL_MAX_CHUNKS', default=50, cast=int)
+
+# How long initiate_payment remembers an Idempotency-Key response (seconds)
+IDEMPOTENCY_KEY_TTL = config('IDEMPOTENCY_KEY_TTL', default=86400, cast=int)
+
+# Quote engine: per-listing price calendars cover CALENDAR_DAYS from today
+# and are cached for CALENDAR_TIMEOUT seconds. Exchange rates are units of
+# each currency per ETB, e.g. "USD=0.0069,EUR=0.0064"
+PRICING_CALENDAR_DAYS = config('PRICING_CALENDAR_DAYS', default=730, cast=int)
+PRICING_CALENDAR_TIMEOUT = config('PRICING_CALENDAR_TIMEOUT', default=3600, cast=int)
+PRICING_MAX_NIGHTS = config('PRICING_MAX_NIGHTS', default=365, cast=int)
+PRICING_EXCHANGE_RATES = config('PRICING_EXCHANGE_RATES', default='', cast=Csv())
+
+# Largest radius (and half the longest box side) /listings/nearby/ accepts
+GEO_MAX_RADIUS_KM = config('GEO_MAX_RADIUS_KM', default=200, cast=float)
+
+# Occupancy bitmaps behind /listings/<pk>/calendar/ cover HORIZON_DAYS from
+# the first of the current month and are cached for CACHE_TIMEOUT seconds
+OCCUPANCY_HORIZON_DAYS = config('OCCUPANCY_HORIZON_DAYS', default=400, cast=int)
+OCCUPANCY_CACHE_TIMEOUT = config('OCCUPANCY_CACHE_TIMEOUT', default=300, cast=int)
+
+# Analytics rollups: listings whose bookings or payments changed more than
+# LAG_SECONDS ago are rebuilt BATCH_SIZE listings at a time
+ANALYTICS_ROLLUP_BATCH_SIZE = config('ANALYTICS_ROLLUP_BATCH_SIZE', default=500, cast=int)
+ANALYTICS_ROLLUP_LAG_SECONDS = config('ANALYTICS_ROLLUP_LAG_SECONDS', default=60, cast=int)
+ANALYTICS_MAX_RANGE_DAYS = config('ANALYTICS_MAX_RANGE_DAYS', default=366, cast=int)
+
+# Request instrumentation: SAMPLE_RATE of requests get a DB/HTTP/serializer
+# breakdown (Server-Timing header + log line); anything over SLOW_MS is logged
+# whether sampled or not. Raise the rate while investigating a slow endpoint.
+REQUEST_TIMING_SAMPLE_RATE = config('REQUEST_TIMING_SAMPLE_RATE', default=0.01, cast=float)
+REQUEST_TIMING_SLOW_MS = config('REQUEST_TIMING_SLOW_MS', default=1000, cast=int)
+REQUEST_TIMING_HEADER = config('REQUEST_TIMING_HEADER', default=True, cast=bool)
 
 # Email Configuration
 EMAIL_BACKEND = config('EMAIL_BACKEND', default='django.core.mail.backends.console.EmailBackend')
@@ -0,0 +1,6 @@
+"""
+Test and benchmark helpers that are not part of the listings app itself.
+
+Nothing in listings imports from here outside its tests and bench
+commands, so deployments can leave this package out.
+"""
@@ -0,0 +1,147 @@
+"""
+Local stand-in for the Chapa API used by the listings benchmarks and tests.
+
+Speaks HTTP/1.1 with keep-alive so connection reuse by the client is
+observable, and can add artificial latency to mimic a remote gateway or
+inject error responses (fault_status, for a fault_rate share of requests)
+to mimic a failing one. Both can be changed while the server runs.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import multiprocessing
+import random
+import threading
+import time
+
+
+class ChapaStubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; without TCP_NODELAY a
+    # keep-alive client stalls on delayed ACKs and looks slower than it is
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def simulate_latency(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+    def inject_fault(self):
+        """Answer with the configured error instead; True if it did"""
+        if self.server.fault_status and random.random() < self.server.fault_rate:
+            self.send_json(self.server.fault_status, {'status': 'failed', 'message': 'Injected fault'})
+            return True
+        return False
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+        self.simulate_latency()
+        if self.inject_fault():
+            return
+        if not self.path.endswith('/transaction/initialize'):
+            return self.send_json(404, {'status': 'failed', 'message': 'Not found'})
+        tx_ref = body.get('tx_ref')
+        self.send_json(200, {
+            'status': 'success',
+            'message': 'Hosted Link',
+            'data': {'checkout_url': f'https://checkout.chapa.co/checkout/payment/{tx_ref}'},
+        })
+
+    def do_GET(self):
+        self.simulate_latency()
+        if self.inject_fault():
+            return
+        if '/transaction/verify/' not in self.path:
+            return self.send_json(404, {'status': 'failed', 'message': 'Not found'})
+        tx_ref = self.path.rsplit('/', 1)[-1]
+        self.send_json(200, {
+            'status': 'success',
+            'data': {
+                'status': self.server.verify_status,
+                'tx_ref': tx_ref,
+                'reference': f'CHSTUB{tx_ref[-8:]}',
+                'method': 'telebirr',
+            },
+        })
+
+
+class ChapaStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, latency=0.0, verify_status='success', handler=ChapaStubHandler, fault_status=None, fault_rate=1.0):
+        super().__init__(('127.0.0.1', 0), handler)
+        self.latency = latency
+        self.verify_status = verify_status
+        self.fault_status = fault_status
+        self.fault_rate = fault_rate
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def _serve(latency, verify_status, fault_status, fault_rate, ready):
+    server = ChapaStubServer(
+        latency=latency, verify_status=verify_status, fault_status=fault_status, fault_rate=fault_rate
+    )
+    ready.put(server.base_url)
+    server.serve_forever()
+
+
+class ChapaStubProcess:
+    """
+    Runs the stub in a child process.
+
+    Load tests use this so the stub's threads do not compete for the GIL
+    with the client being measured.
+    """
+
+    def __init__(self, latency=0.0, verify_status='success', fault_status=None, fault_rate=1.0):
+        self.latency = latency
+        self.verify_status = verify_status
+        self.fault_status = fault_status
+        self.fault_rate = fault_rate
+        self.process = None
+        self.base_url = None
+
+    def __enter__(self):
+        ready = multiprocessing.Queue()
+        self.process = multiprocessing.Process(
+            target=_serve, args=(self.latency, self.verify_status, self.fault_status, self.fault_rate, ready),
+            daemon=True
+        )
+        self.process.start()
+        self.base_url = ready.get(timeout=10)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.process.terminate()
+        self.process.join()